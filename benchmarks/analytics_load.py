@@ -0,0 +1,107 @@
+"""
+Latency of /analytics under concurrent load, with and without the process pool.
+
+    python benchmarks/analytics_load.py [concurrency] [rounds] [pool_workers]
+
+Starts benchmarks/fake_openai.py and the app (uvicorn, one worker) as
+subprocesses, once with ANALYTICS_WORKERS=0 (thread pool) and once with
+ANALYTICS_WORKERS=pool_workers (default: CPU count), waits for /ready, then
+fires `concurrency` simultaneous /analytics requests per round for distinct
+(user, end_date) pairs, so single-flight can't merge them. Prints p50 / p95 /
+p99 latency and throughput per mode. Rate limiting is switched off.
+
+The pool only helps with more than one core: on a single CPU both modes
+share it and the numbers show the overhead of the pool instead.
+"""
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PORT = int(os.getenv("BENCH_APP_PORT", "8765"))
+FAKE_PORT = int(os.getenv("BENCH_FAKE_PORT", "9165"))
+BASE = f"http://127.0.0.1:{APP_PORT}/api/v1"
+LAST_DAY = date(2025, 10, 18)
+USERS = 50
+
+
+def start(args, env) -> subprocess.Popen:
+    return subprocess.Popen(args, cwd=ROOT, env={**os.environ, **env},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 120) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(f"{BASE}/ready")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("app did not become ready")
+
+
+async def one(client: httpx.AsyncClient, user_id: int, end_date: str) -> float:
+    started = time.perf_counter()
+    response = await client.get(f"{BASE}/analytics/{user_id}", params={"end_date": end_date})
+    response.raise_for_status()
+    return time.perf_counter() - started
+
+
+async def load(concurrency: int, rounds: int) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=300, limits=limits) as client:
+        await wait_ready(client)
+        latencies, elapsed = [], 0.0
+        for r in range(rounds + 1):
+            # Свои даты в каждом раунде: кэши и single-flight не склеивают запросы
+            keys = range(r * concurrency, (r + 1) * concurrency)
+            pairs = [(1 + k % USERS, (LAST_DAY - timedelta(days=k // USERS)).isoformat()) for k in keys]
+            started = time.perf_counter()
+            batch = await asyncio.gather(*(one(client, u, d) for u, d in pairs))
+            if r:  # первый раунд — прогрев
+                elapsed += time.perf_counter() - started
+                latencies += batch
+    q = statistics.quantiles(latencies, n=100)
+    return {"p50": q[49], "p95": q[94], "p99": q[98], "rps": len(latencies) / elapsed}
+
+
+def run_mode(workers: int, concurrency: int, rounds: int) -> dict:
+    fake = start([sys.executable, "benchmarks/fake_openai.py"], {"FAKE_PORT": str(FAKE_PORT)})
+    app = start(
+        # keep-alive дольше раунда: иначе uvicorn закрывает соединения, простоявшие до конца раунда
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(APP_PORT), "--log-level", "warning",
+         "--timeout-keep-alive", "120"],
+        {"OPENAI_API_KEY": "benchmark", "OPENAI_BASE_URL": f"http://127.0.0.1:{FAKE_PORT}/v1",
+         "ANALYTICS_WORKERS": str(workers), "RATE_LIMIT_ENABLED": "0"},
+    )
+    try:
+        return asyncio.run(load(concurrency, rounds))
+    finally:
+        for process in (app, fake):
+            process.terminate()
+            process.wait()
+
+
+def main() -> None:
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else (os.cpu_count() or 1)
+
+    print(f"{concurrency} concurrent /analytics, {rounds} rounds, {os.cpu_count()} CPU")
+    print(f"{'mode':<22} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>7}")
+    for name, n in (("thread pool", 0), (f"process pool ({workers})", workers)):
+        stats = run_mode(n, concurrency, rounds)
+        print(f"{name:<22} {stats['p50'] * 1000:>8.0f} {stats['p95'] * 1000:>8.0f} "
+              f"{stats['p99'] * 1000:>8.0f} {stats['rps']:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
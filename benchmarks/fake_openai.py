@@ -0,0 +1,289 @@
+"""
+Minimal fake of the OpenAI API for exercising the resilience layer locally.
+
+    python benchmarks/fake_openai.py                 # http://127.0.0.1:9100/v1
+    OPENAI_BASE_URL=http://127.0.0.1:9100/v1 OPENAI_API_KEY=test uvicorn main:app
+
+Covers what the app uses: the assistant bootstrap (files, vector store,
+assistant), threads, messages, streamed runs with tool calls and usage, run
+cancellation, chat completions (thread summaries, streamed generic answers)
+and audio translation.
+Faults are injected via env:
+
+    FAKE_LATENCY=0.5      seconds before every response
+    FAKE_ERROR_RATE=0.3   share of requests answered with 503
+    FAKE_HANG_RATE=0.1    share of run streams that stall after the first token
+    FAKE_TOKEN_DELAY=0.05 seconds between streamed tokens
+    FAKE_TOOL_CALL=1      first run of every thread asks for get_spending_summary
+
+GET /fake/faults shows the current settings, POST /fake/faults?error_rate=1
+changes them on the fly (e.g. to simulate a brownout and watch the breaker).
+"""
+import asyncio
+import itertools
+import json
+import os
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+faults = {
+    "latency": float(os.getenv("FAKE_LATENCY", "0")),
+    "error_rate": float(os.getenv("FAKE_ERROR_RATE", "0")),
+    "hang_rate": float(os.getenv("FAKE_HANG_RATE", "0")),
+    "token_delay": float(os.getenv("FAKE_TOKEN_DELAY", "0.02")),
+    "tool_call": os.getenv("FAKE_TOOL_CALL", "0") == "1",
+}
+
+app = FastAPI()
+_ids = itertools.count(1)
+threads: dict = {}
+runs: dict = {}
+
+REPLY = "Это ответ фейкового сервера: всё работает, можно проверять дедлайны и повторы."
+
+
+def new_id(prefix: str) -> str:
+    return f"{prefix}_{next(_ids)}"
+
+
+@app.middleware("http")
+async def inject_faults(request: Request, call_next):
+    if request.url.path.startswith("/fake/"):
+        return await call_next(request)
+    await asyncio.sleep(faults["latency"])
+    if random.random() < faults["error_rate"]:
+        return JSONResponse({"error": {"message": "injected failure", "type": "server_error"}}, status_code=503)
+    return await call_next(request)
+
+
+@app.get("/fake/faults")
+async def get_faults():
+    return faults
+
+
+@app.post("/fake/faults")
+async def set_faults(latency: float = None, error_rate: float = None, hang_rate: float = None,
+                     token_delay: float = None, tool_call: bool = None):
+    for key, value in locals().items():
+        if value is not None:
+            faults[key] = value
+    return faults
+
+
+# --- bootstrap ---------------------------------------------------------------
+
+@app.post("/v1/files")
+async def create_file():
+    return {"id": new_id("file"), "object": "file", "bytes": 0, "created_at": int(time.time()),
+            "filename": "products.txt", "purpose": "assistants", "status": "processed"}
+
+
+@app.post("/v1/vector_stores")
+async def create_vector_store():
+    return {"id": new_id("vs"), "object": "vector_store", "created_at": int(time.time()), "name": "fake",
+            "status": "completed", "usage_bytes": 0,
+            "file_counts": {"in_progress": 0, "completed": 0, "failed": 0, "cancelled": 0, "total": 0}}
+
+
+@app.post("/v1/vector_stores/{vs_id}/files")
+@app.get("/v1/vector_stores/{vs_id}/files/{file_id}")
+async def vector_store_file(vs_id: str, request: Request, file_id: str = None):
+    if file_id is None:
+        file_id = (await request.json())["file_id"]
+    return {"id": file_id, "object": "vector_store.file", "created_at": int(time.time()),
+            "vector_store_id": vs_id, "status": "completed", "usage_bytes": 0, "last_error": None}
+
+
+@app.post("/v1/assistants")
+async def create_assistant(request: Request):
+    body = await request.json()
+    return {"id": new_id("asst"), "object": "assistant", "created_at": int(time.time()),
+            "model": body.get("model"), "instructions": "", "tools": body.get("tools", []), "metadata": {}}
+
+
+# --- threads & messages ------------------------------------------------------
+
+def thread_object(thread_id: str) -> dict:
+    return {"id": thread_id, "object": "thread", "created_at": threads[thread_id]["created_at"],
+            "metadata": threads[thread_id]["metadata"], "tool_resources": {}}
+
+
+def message_object(thread_id: str, role: str, text: str, message_id: str = None, metadata: dict = None) -> dict:
+    return {"id": message_id or new_id("msg"), "object": "thread.message", "created_at": int(time.time()),
+            "thread_id": thread_id, "role": role, "status": "completed", "attachments": [],
+            "metadata": metadata or {},
+            "content": [{"type": "text", "text": {"value": text, "annotations": []}}]}
+
+
+@app.post("/v1/threads")
+async def create_thread(request: Request):
+    body = await request.json()
+    thread_id = new_id("thread")
+    threads[thread_id] = {"created_at": int(time.time()), "metadata": body.get("metadata") or {},
+                          "messages": [], "runs": 0}
+    for m in body.get("messages") or []:
+        threads[thread_id]["messages"].append(message_object(thread_id, m["role"], m["content"],
+                                                             metadata=m.get("metadata")))
+    return thread_object(thread_id)
+
+
+def get_thread(thread_id: str) -> dict:
+    if thread_id not in threads:
+        threads[thread_id] = {"created_at": int(time.time()), "metadata": {}, "messages": [], "runs": 0}
+    return threads[thread_id]
+
+
+@app.get("/v1/threads/{thread_id}")
+async def retrieve_thread(thread_id: str):
+    get_thread(thread_id)
+    return thread_object(thread_id)
+
+
+@app.delete("/v1/threads/{thread_id}")
+async def delete_thread(thread_id: str):
+    threads.pop(thread_id, None)
+    return {"id": thread_id, "object": "thread.deleted", "deleted": True}
+
+
+@app.post("/v1/threads/{thread_id}")
+async def update_thread(thread_id: str, request: Request):
+    get_thread(thread_id)["metadata"] = (await request.json()).get("metadata") or {}
+    return thread_object(thread_id)
+
+
+@app.post("/v1/threads/{thread_id}/messages")
+async def create_message(thread_id: str, request: Request):
+    body = await request.json()
+    message = message_object(thread_id, body["role"], body["content"], metadata=body.get("metadata"))
+    get_thread(thread_id)["messages"].append(message)
+    return message
+
+
+@app.get("/v1/threads/{thread_id}/messages")
+async def list_messages(thread_id: str, limit: int = 20, order: str = "desc", after: str = None):
+    data = get_thread(thread_id)["messages"]
+    data = list(reversed(data)) if order == "desc" else list(data)
+    if after:
+        data = data[[m["id"] for m in data].index(after) + 1:]
+    has_more, data = len(data) > limit, data[:limit]
+    return {"object": "list", "data": data, "has_more": has_more,
+            "first_id": data[0]["id"] if data else None, "last_id": data[-1]["id"] if data else None}
+
+
+# --- runs ----------------------------------------------------------------------
+
+def run_object(run_id: str, status: str, required_action: dict = None) -> dict:
+    run = runs[run_id]
+    return {"id": run_id, "object": "thread.run", "created_at": run["created_at"], "thread_id": run["thread_id"],
+            "assistant_id": run["assistant_id"], "status": status, "required_action": required_action,
+            "model": "fake", "instructions": "", "tools": [], "metadata": {}, "usage": None,
+            "parallel_tool_calls": True}
+
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def stream_reply(run_id: str):
+    run = runs[run_id]
+    thread_id = run["thread_id"]
+    message_id = new_id("msg")
+    message = message_object(thread_id, "assistant", "", message_id)
+    message["content"], message["status"] = [], "in_progress"
+    yield sse("thread.message.created", message)
+
+    hang = random.random() < faults["hang_rate"]
+    text = ""
+    for i, token in enumerate(REPLY.split(" ")):
+        token = token if i == 0 else " " + token
+        text += token
+        yield sse("thread.message.delta", {"id": message_id, "object": "thread.message.delta", "delta": {
+            "content": [{"index": 0, "type": "text", "text": {"value": token, "annotations": []}}]}})
+        if hang:
+            await asyncio.sleep(3600)
+        await asyncio.sleep(faults["token_delay"])
+
+    threads[thread_id]["messages"].append(message_object(thread_id, "assistant", text, message_id))
+    yield sse("thread.message.completed", threads[thread_id]["messages"][-1])
+    # Промпт растёт вместе с тредом — чтобы было видно эффект сжатия
+    completed = run_object(run_id, "completed")
+    prompt_tokens = sum(len(m["content"][0]["text"]["value"]) // 3 + 20 for m in threads[thread_id]["messages"])
+    completed["usage"] = {"prompt_tokens": prompt_tokens, "completion_tokens": len(text) // 3,
+                          "total_tokens": prompt_tokens + len(text) // 3}
+    yield sse("thread.run.completed", completed)
+    yield "event: done\ndata: [DONE]\n\n"
+
+
+async def stream_run(run_id: str):
+    yield sse("thread.run.created", run_object(run_id, "queued"))
+    yield sse("thread.run.in_progress", run_object(run_id, "in_progress"))
+    if runs[run_id]["needs_tool"]:
+        tool_call = {"id": new_id("call"), "type": "function",
+                     "function": {"name": "get_spending_summary", "arguments": "{}"}}
+        yield sse("thread.run.requires_action", run_object(run_id, "requires_action", {
+            "type": "submit_tool_outputs", "submit_tool_outputs": {"tool_calls": [tool_call]}}))
+        yield "event: done\ndata: [DONE]\n\n"
+        return
+    async for chunk in stream_reply(run_id):
+        yield chunk
+
+
+@app.post("/v1/threads/{thread_id}/runs")
+async def create_run(thread_id: str, request: Request):
+    body = await request.json()
+    thread = get_thread(thread_id)
+    run_id = new_id("run")
+    runs[run_id] = {"thread_id": thread_id, "assistant_id": body.get("assistant_id"),
+                    "created_at": int(time.time()), "needs_tool": faults["tool_call"] and thread["runs"] == 0}
+    thread["runs"] += 1
+    return StreamingResponse(stream_run(run_id), media_type="text/event-stream")
+
+
+@app.post("/v1/threads/{thread_id}/runs/{run_id}/submit_tool_outputs")
+async def submit_tool_outputs(thread_id: str, run_id: str, request: Request):
+    body = await request.json()
+    print(f"[fake] tool outputs for {run_id}: {[o['output'][:80] for o in body['tool_outputs']]}")
+    return StreamingResponse(stream_reply(run_id), media_type="text/event-stream")
+
+
+@app.post("/v1/threads/{thread_id}/runs/{run_id}/cancel")
+async def cancel_run(thread_id: str, run_id: str):
+    print(f"[fake] cancelled {run_id}")
+    return run_object(run_id, "cancelling")
+
+
+async def stream_completion(completion_id: str, model: str):
+    for i, token in enumerate(REPLY.split(" ")):
+        chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                 "model": model, "choices": [{"index": 0, "finish_reason": None,
+                                              "delta": {"content": token if i == 0 else " " + token}}]}
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        await asyncio.sleep(faults["token_delay"])
+    chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+             "model": model, "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}]}
+    yield f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completion(request: Request):
+    body = await request.json()
+    if body.get("stream"):
+        return StreamingResponse(stream_completion(new_id("chatcmpl"), body.get("model")),
+                                 media_type="text/event-stream")
+    return {"id": new_id("chatcmpl"), "object": "chat.completion", "created": int(time.time()),
+            "model": body.get("model"), "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                "role": "assistant", "content": f"Резюме {len(body['messages'][-1]['content'])} символов переписки."}}],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}}
+
+
+@app.post("/v1/audio/translations")
+async def translate():
+    return {"text": "распознанный фейковым сервером текст"}
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=int(os.getenv("FAKE_PORT", "9100")))
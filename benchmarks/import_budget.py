@@ -0,0 +1,74 @@
+"""
+Import-time budget of the app: guards the cold start against regressions.
+
+    python benchmarks/import_budget.py                  # exit code 1 if over budget
+    IMPORT_BUDGET_MS=600 python benchmarks/import_budget.py
+
+Runs `python -X importtime -c "import main"` a few times in fresh
+interpreters, takes the best cumulative time of `main` and checks it against
+IMPORT_BUDGET_MS. It also fails if a module that must stay lazy (pandas,
+numpy, the OpenAI SDK) is imported by `import main` at all: those load in the
+lifespan warm-up (src/utils/startup.py), not at import. Prints the slowest
+imports, so a regression shows where it came from.
+"""
+import os
+import re
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "900"))
+RUNS = int(os.getenv("IMPORT_BUDGET_RUNS", "3"))
+LAZY_MODULES = ("pandas", "numpy", "openai")
+
+_LINE_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure() -> list:
+    """(self_us, cumulative_us, depth, module) per import of `import main`."""
+    env = {"OPENAI_API_KEY": "import-budget", **os.environ}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        sys.exit(f"import main failed:\n{proc.stderr[-2000:]}")
+    return [
+        (int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2, m.group(4))
+        for m in map(_LINE_RE.match, proc.stderr.splitlines()) if m
+    ]
+
+
+def main() -> int:
+    samples = [measure() for _ in range(RUNS)]
+    best = min(samples, key=lambda rows: next(cum for _, cum, _, name in rows if name == "main"))
+    total_ms = next(cum for _, cum, _, name in best if name == "main") / 1000
+
+    print(f"import main: {total_ms:.0f} ms (best of {RUNS}), budget {BUDGET_MS:.0f} ms")
+    # -X importtime печатает детей перед родителем: прямые импорты main — строки глубины 1 перед ним
+    main_at = next(i for i, row in enumerate(best) if row[3] == "main")
+    children = []
+    for row in reversed(best[:main_at]):
+        if row[2] == 0:
+            break
+        if row[2] == 1:
+            children.append(row)
+    print("slowest imports of main:")
+    top = sorted(children, key=lambda row: -row[1])[:10]
+    for _, cum, _, name in top:
+        print(f"  {cum / 1000:8.1f} ms  {name}")
+
+    failed = False
+    eager = sorted({name for _, _, _, name in best if name in LAZY_MODULES})
+    if eager:
+        print(f"FAIL: imported eagerly, must stay lazy: {', '.join(eager)}")
+        failed = True
+    if total_ms > BUDGET_MS:
+        print(f"FAIL: import time {total_ms:.0f} ms exceeds the budget of {BUDGET_MS:.0f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
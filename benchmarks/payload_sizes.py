@@ -0,0 +1,67 @@
+"""
+Payload size and latency of the transaction listing and /analytics per encoding.
+
+    python benchmarks/payload_sizes.py [user_id] [rounds]
+
+Runs the app in-process (TestClient, no network) for the heaviest user by
+default — the one with the most transactions — and prints, for every Accept
+layout and Accept-Encoding, the bytes on the wire, the median server latency
+and the transfer time of those bytes on a 1 Mbit/s mobile link. MessagePack
+and brotli rows appear only if the optional packages are installed.
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+# Замеряем кодирование, а не ограничитель частоты
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from main import app  # noqa: E402
+from src.utils.encoding import COLUMNAR_JSON, COLUMNAR_MSGPACK, JSON, MSGPACK, has_module  # noqa: E402
+from src.utils.transactions import load_transactions  # noqa: E402
+
+MOBILE_BITS_PER_SECOND = 1_000_000
+
+ACCEPTS = [JSON, COLUMNAR_JSON] + ([MSGPACK, COLUMNAR_MSGPACK] if has_module("msgpack") else [])
+ENCODINGS = ["identity", "gzip"] + (["br"] if has_module("brotli") else [])
+
+
+def measure(client: TestClient, path: str, accept: str, encoding: str, rounds: int):
+    latencies = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        # iter_raw: тело как на проводе, без распаковки клиентом
+        with client.stream("GET", path, headers={"Accept": accept, "Accept-Encoding": encoding}) as response:
+            wire = b"".join(response.iter_raw())
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200, (path, accept, encoding, response.status_code)
+    return len(wire), statistics.median(latencies)
+
+
+def main() -> None:
+    df = load_transactions()
+    user_id = int(sys.argv[1]) if len(sys.argv) > 1 else int(df["id"].value_counts().idxmax())
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    end_date = df["date"].max().strftime("%Y-%m-%d")
+
+    cases = [(f"/api/v1/users/{user_id}/transactions", accept) for accept in ACCEPTS]
+    cases.append((f"/api/v1/analytics/{user_id}?end_date={end_date}", JSON))
+
+    print(f"user {user_id}: {int((df['id'] == user_id).sum())} transactions, median of {rounds} rounds")
+    print(f"{'endpoint':<28} {'accept':<34} {'encoding':<9} {'bytes':>8} {'server ms':>10} {'1 Mbit/s ms':>12}")
+    with TestClient(app) as client:
+        for path, accept in cases:
+            for encoding in ENCODINGS:
+                size, latency = measure(client, path, accept, encoding, rounds)
+                name = path.split("?")[0].replace("/api/v1", "")
+                print(f"{name:<28} {accept:<34} {encoding:<9} {size:>8} {latency * 1000:>10.1f} "
+                      f"{size * 8 / MOBILE_BITS_PER_SECOND * 1000:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Time-to-first-token of product questions with and without the local product index.
+
+    python benchmarks/ttft_product_index.py [rounds]
+
+Needs OPENAI_API_KEY: it runs the real assistant bootstrap and creates a fresh
+thread per question, so each run sees the same (empty) history. "file_search"
+is the old path (remote vector store), "local index" injects the BM25 hits as
+additional instructions and drops file_search from the run's tools.
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils.openai_client import bootstrap_assistant, get_client  # noqa: E402
+from src.utils.assistant_tools import ASSISTANT_TOOLS  # noqa: E402
+from src.utils.product_index import get_product_index  # noqa: E402
+
+client = get_client()
+assistant = bootstrap_assistant()
+
+QUESTIONS = [
+    ("Что такое Вакала и какая там доходность?", 1),
+    ("Какие условия исламской ипотеки?", 1),
+    ("Можно взять рассрочку на 200 000 тенге?", 1),
+    ("Сколько можно положить в Копилку?", 1),
+    ("Какой депозит выбрать для бизнеса?", 2),
+    ("Какой лимит у овердрафта по бизнес карте?", 2),
+]
+
+
+def time_to_first_token(question: str, run_options: dict) -> float:
+    thread = client.beta.threads.create(messages=[{"role": "user", "content": question}])
+    started = time.perf_counter()
+    try:
+        with client.beta.threads.runs.stream(
+                thread_id=thread.id,
+                assistant_id=assistant.id,
+                **run_options,
+        ) as stream:
+            for event in stream:
+                if event.event == "thread.message.delta":
+                    return time.perf_counter() - started
+        return float("nan")
+    finally:
+        client.beta.threads.delete(thread.id)
+
+
+def report(name: str, samples: list) -> None:
+    samples = sorted(s for s in samples if s == s)
+    p90 = samples[int(0.9 * (len(samples) - 1))]
+    print(f"{name:<12} n={len(samples):<3} median={statistics.median(samples):.2f}s p90={p90:.2f}s")
+
+
+def main(rounds: int) -> None:
+    index = get_product_index()
+    baseline, local = [], []
+    for _ in range(rounds):
+        for question, segment in QUESTIONS:
+            baseline.append(time_to_first_token(question, {}))
+
+            context = index.context_for(question, segment=segment)
+            options = {"additional_instructions": context, "tools": ASSISTANT_TOOLS} if context else {}
+            local.append(time_to_first_token(question, options))
+
+    report("file_search", baseline)
+    report("local index", local)
+
+    started = time.perf_counter()
+    for question, segment in QUESTIONS * 100:
+        index.context_for(question, segment=segment)
+    per_query = (time.perf_counter() - started) / (len(QUESTIONS) * 100)
+    print(f"index lookup: {per_query * 1e6:.1f} µs/query")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
@@ -6,6 +6,12 @@ from starlette.middleware.cors import CORSMiddleware
 from src.endpoints import list_of_routes
 from sqlalchemy import create_engine
 from src.utils.db import database, metadata, DATABASE_URL
+from src.utils.encoding import install_compression
+from src.utils.profiling import install_profiler
+from src.utils.rate_limit import install_rate_limiter
+from src.utils.analytics_pool import shutdown_analytics_pool
+from src.utils.catalog import drop_stale_products_table, write_catalog
+from src.utils.startup import start_warm_up
 from contextlib import asynccontextmanager
 
 def bind_routes(application: FastAPI) -> None:
@@ -13,23 +19,48 @@ def bind_routes(application: FastAPI) -> None:
         application.include_router(route, prefix='/api/v1')
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
+# server.py готовит БД один раз в мастере, до форка воркеров
+_database_ready = False
+
+
+def prepare_database() -> None:
+    """Schema and product catalog (products.csv -> products_table) of the DB."""
+    global _database_ready
+    # Импорт моделей регистрирует их таблицы в metadata
     from src.models.products import products_table
     from src.models.user import users_table
 
     engine = create_engine(DATABASE_URL.replace("+aiosqlite", ""), connect_args={"check_same_thread": False})
+    drop_stale_products_table(engine)
+    metadata.create_all(bind=engine)
+    write_catalog(engine)
+    engine.dispose()
+    _database_ready = True
+
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
     # Логика при старте приложения: устанавливаем соединение с БД
-    metadata.create_all(bind=engine)
+    if not _database_ready:
+        prepare_database()
     await database.connect()
+    # Датасет, пул аналитики и ассистент прогреваются в фоне: до готовности /ready отвечает 503
+    warm_up = start_warm_up()
     yield
     # Логика при завершении работы приложения: разрываем соединение с БД
+    warm_up.cancel()
+    shutdown_analytics_pool()
     await database.disconnect()
 app = FastAPI(lifespan=lifespan)
 
 origins = []
 
+bind_routes(app)
+install_compression(app)
+install_rate_limiter(app)
+install_profiler(app)
+
+# Последним — значит снаружи: заголовки CORS есть и на ответах 429
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -38,8 +69,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-bind_routes(app)
-
 # IGNORED_PATHS = [
 #     "/docs",
 #     "/redoc",
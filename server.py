@@ -0,0 +1,222 @@
+"""
+Production entry point: prefork server with a shared read-only dataset.
+
+    WEB_CONCURRENCY=4 PORT=8000 python server.py
+
+The parent process imports the app once, prepares the database (schema and
+product catalog) and warms what the workers share (see src/utils/startup.py):
+the transaction dataset, the product index and the OpenAI bootstrap (files,
+vector store, assistant) are created here and only here. Then it forks WEB_CONCURRENCY uvicorn workers that accept
+on the same listening socket and share those pages copy-on-write.
+
+Signals to the parent process:
+  SIGTERM / SIGINT — graceful shutdown of all workers;
+  SIGHUP           — rolling restart, workers are replaced one at a time;
+a worker that exits unexpectedly is respawned, after a delay that doubles with
+every crash in a row (RESPAWN_BACKOFF .. RESPAWN_BACKOFF_MAX seconds). When
+CRASH_LOOP_LIMIT workers in a row die within STABLE_AFTER seconds of their
+start (e.g. the app fails to start) the parent gives up and shuts down instead
+of forking forever.
+
+POSIX only (needs os.fork); for local development use `python main.py`.
+"""
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+import uvicorn
+
+from src.utils.analytics_pool import ANALYTICS_WORKERS, publish_dataset, shutdown_analytics_pool
+from src.utils.startup import preload_components
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+WORKERS = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+BACKLOG = int(os.getenv("BACKLOG", "2048"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info")
+RESPAWN_BACKOFF = float(os.getenv("RESPAWN_BACKOFF", "1"))
+RESPAWN_BACKOFF_MAX = float(os.getenv("RESPAWN_BACKOFF_MAX", "60"))
+CRASH_LOOP_LIMIT = int(os.getenv("CRASH_LOOP_LIMIT", "5"))
+# Воркер, проживший столько секунд, не считается упавшим на старте — счётчик падений сбрасывается
+STABLE_AFTER = 30
+# Код выхода воркера, не поднявшего приложение (как у uvicorn)
+STARTUP_FAILURE = 3
+
+
+def preload():
+    """Imports the app, prepares the database and warms everything the workers should share."""
+    from main import app, prepare_database
+
+    # Схема и каталог — один раз здесь, а не в lifespan каждого воркера
+    prepare_database()
+
+    # Импорт приложения ничего не грузит — прогреваем общее для воркеров явно
+    preload_components()
+    if ANALYTICS_WORKERS > 0:
+        # Один набор shared memory блоков на всё дерево процессов
+        publish_dataset()
+    return app
+
+
+def bind_socket() -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((HOST, PORT))
+    sock.listen(BACKLOG)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Master:
+    def __init__(self, app, sock: socket.socket):
+        self.app = app
+        self.sock = sock
+        self.workers = {}
+        self.retiring = set()
+        self.signal = None
+        self.exit_code = 0
+        # Падения подряд и время, когда поднять замену
+        self.crashes = 0
+        self.respawn_at = []
+
+    def spawn(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = self.run_worker()
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.workers[pid] = time.monotonic()
+        return pid
+
+    def run_worker(self) -> int:
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, signal.SIG_DFL)
+        config = uvicorn.Config(
+            self.app,
+            log_level=LOG_LEVEL,
+            timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        )
+        server = uvicorn.Server(config)
+        server.run(sockets=[self.sock])
+        # Ошибку lifespan uvicorn уже залогировал и просто вернулся
+        return 0 if server.started else STARTUP_FAILURE
+
+    def reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            started = self.workers.pop(pid, None)
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+            elif self.signal not in (signal.SIGTERM, signal.SIGINT):
+                self.on_crash(pid, os.waitstatus_to_exitcode(status), started)
+
+    def on_crash(self, pid: int, code: int, started) -> None:
+        """Schedules a replacement with backoff; stops everything on a crash loop."""
+        if started is not None and time.monotonic() - started >= STABLE_AFTER:
+            self.crashes = 0
+        self.crashes += 1
+        if self.crashes >= CRASH_LOOP_LIMIT:
+            print(f"❌ Workers crashed {self.crashes} times in a row (last: {pid}, code {code}), giving up")
+            self.exit_code = 1
+            self.signal = signal.SIGTERM
+            return
+        delay = min(RESPAWN_BACKOFF_MAX, RESPAWN_BACKOFF * 2 ** (self.crashes - 1))
+        print(f"⚠️ Worker {pid} exited unexpectedly (code {code}), respawning in {delay:.1f}s")
+        self.respawn_at.append(time.monotonic() + delay)
+
+    def respawn_due(self) -> None:
+        now = time.monotonic()
+        for due in [t for t in self.respawn_at if t <= now]:
+            self.respawn_at.remove(due)
+            self.spawn()
+
+    def stop_worker(self, pid: int) -> None:
+        """SIGTERM, then SIGKILL if the worker outlives the graceful timeout."""
+        self.retiring.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        while pid in self.workers and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self.reap()
+        if pid in self.workers:
+            os.kill(pid, signal.SIGKILL)
+
+    def rolling_restart(self) -> None:
+        for old in list(self.workers):
+            self.spawn()
+            self.stop_worker(old)
+
+    def stop(self) -> None:
+        self.respawn_at.clear()
+        for pid in list(self.workers):
+            self.retiring.add(pid)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        while self.workers and time.monotonic() < deadline:
+            time.sleep(0.1)
+            self.reap()
+        for pid in self.workers:
+            os.kill(pid, signal.SIGKILL)
+
+    def on_signal(self, signum, frame) -> None:
+        self.signal = signum
+
+    def run(self) -> None:
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, self.on_signal)
+
+        for _ in range(WORKERS):
+            self.spawn()
+        print(f"✅ Started {WORKERS} workers on {HOST}:{PORT}")
+
+        while True:
+            time.sleep(0.5)
+            if self.signal == signal.SIGHUP:
+                self.signal = None
+                print("🔄 Rolling restart")
+                self.rolling_restart()
+            elif self.signal is not None:
+                print("🛑 Shutting down")
+                self.stop()
+                return
+            self.reap()
+            self.respawn_due()
+
+
+def main() -> None:
+    sock = bind_socket()
+    app = preload()
+    # Всё, что загрузили в родителе, переносим в постоянное поколение GC:
+    # сборщик в воркерах не будет трогать эти объекты и копировать их страницы.
+    gc.collect()
+    gc.freeze()
+    master = Master(app, sock)
+    master.run()
+    shutdown_analytics_pool()
+    sys.exit(master.exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,18 @@ from src.endpoints.utils import router as utils_router
 from src.endpoints.transactions import router as transactions_router
 from src.endpoints.transactions_SME import router as transactions_SME_router
 from src.endpoints.auth import router as auth_router
+from src.endpoints.segments import router as segments_router
+from src.endpoints.goals import router as goals_router
+from src.endpoints.products import router as products_router
 
 list_of_routes = [
     auth_router,
     chat_router,
     transactions_router,
     transactions_SME_router,
+    segments_router,
+    goals_router,
+    products_router,
     utils_router,
 ]
 
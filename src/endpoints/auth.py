@@ -4,6 +4,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy import select, func, insert
 
+from src.utils.chat_threads import start_provisioning
 from src.utils.db import database
 from src.models.user import users_table
 from src.schemas.users import UserOut, UserCreate,Token
@@ -50,6 +51,9 @@ async def login(username: str, password: str):
     if not user or not verify_password(password, user["hashed_password"]):
         raise HTTPException(status_code=400, detail="Неверный логин или пароль. Попробуйте еще раз")
 
+    # Тред ассистента готовим заранее, пока клиент открывает чат
+    start_provisioning(dict(user))
+
     token = create_access_token({"sub": user["username"]})
     return {"access_token": token, "token_type": "bearer", "id": user["id"], "username": user["username"], "email": user["email"], "type_id" : user["type_id"]}
 
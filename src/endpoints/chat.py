@@ -1,5 +1,8 @@
+import asyncio
+import base64
 import io
 import json
+import re
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, File, UploadFile, HTTPException
 from sqlalchemy import select, update, func, and_, insert
@@ -7,13 +10,27 @@ import math
 from src.models.user import users_table
 from src.models.chat import chat_messages_table
 from src.utils.db import database
-from src.utils.openai_client import client, assistant
+from src.utils.openai_client import get_assistant, get_async_client
 from datetime import datetime
-from typing import Optional
-import tempfile
+from typing import Optional, Tuple
 import os
 
-from src.utils.transactions import get_user_transactions
+from src.utils import answer_cache, rate_limit, resilience
+from src.utils.analytics_pool import run_analytics
+from src.utils.chat_threads import get_thread, remember_thread, start_provisioning, thread_seed
+from src.utils.assistant_tools import ASSISTANT_TOOLS, call_tool
+from src.utils.intents import match_intent, answer_intent
+from src.utils.product_index import get_product_index
+from src.utils.run_scheduler import run_scheduler
+from src.utils.singleflight import SingleFlight
+from src.utils.thread_compaction import (
+    compact_thread, is_compaction_message, is_previous_thread, message_text, needs_compaction,
+    record_run_usage,
+)
+from src.utils.voice import spool_upload, transcribe, check_audio_size, guess_audio_suffix
+
+# Сжатие треда идёт в фоне, не больше одного на пользователя
+_compactions = SingleFlight("thread_compaction")
 
 router = APIRouter(
     tags=["chat"],
@@ -24,37 +41,31 @@ router = APIRouter(
 @router.post("/chat/voice")
 async def send_voice(file: UploadFile = File(...)):
     """
-    Accepts an uploaded audio file and transcribes it using OpenAI's GPT-4o Transcription model.
+    Accepts an uploaded audio file and transcribes it using OpenAI's Whisper model.
+    The upload is passed to the client from its spooled buffer (no temp-file copy),
+    files over VOICE_MAX_BYTES are rejected with 413.
     """
 
-    tmp_path = None
+    audio = None
     try:
-        # Save uploaded file to a temporary location
+        audio = await spool_upload(file)
+
+        # Whisper определяет формат по расширению
         suffix = os.path.splitext(file.filename or "")[1] or ".mp3"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            tmp.write(await file.read())
-            tmp_path = tmp.name
-
-        # Open and transcribe
-        with open(tmp_path, "rb") as audio_file:
-            transcription = client.audio.translations.create(
-                model="whisper-1",
-                file=audio_file,
-                prompt="Ответь мне на русском языке"
-            )
+        text = await transcribe(audio, f"voice{suffix}")
 
-        return {"text": transcription.text}
+        return {"text": text}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Transcription failed: {e}")
 
     finally:
-        # Cleanup: remove the temp file
-        try:
-            if tmp_path and os.path.exists(tmp_path):
-                os.remove(tmp_path)
-        except Exception:
-            pass
+        # Буфер из spool_upload (если загрузку пришлось копировать) мог уйти на диск — закрываем сразу
+        if audio is not None:
+            audio.close()
+        await file.close()
 
 @router.get("/history/{user_id}")
 async def get_history(
@@ -68,6 +79,7 @@ async def get_history(
 
     - Fetches messages from OpenAI thread.
     - Uses `after` cursor for pagination (use message ID of the last message).
+    - A "thread_id:message_id" cursor must point into the user's own thread chain, otherwise 400.
     - Optionally filters results by text content.
     """
     # Find user in DB
@@ -85,22 +97,31 @@ async def get_history(
             "total_fetched": 0,
         }
 
+    # После сжатия у пользователя цепочка тредов (previous_thread_id в metadata).
+    # Курсор внутри текущего треда — id сообщения, в более старых — "thread_id:message_id";
+    # чужой тред в курсоре не принимаем
+    if after and ":" in after:
+        cursor_thread_id, after = after.split(":", 1)
+        if not await is_previous_thread(thread_id, cursor_thread_id):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        thread_id = cursor_thread_id
+    after = after or None
+
     try:
         # Fetch from OpenAI thread with cursor-based pagination
-        response = client.beta.threads.messages.list(
+        response = await resilience.call(
+            get_async_client().beta.threads.messages.list,
             thread_id=thread_id,
             order="desc",       # newest first
             limit=limit,
-            after=after,        # cursor for pagination
+            **({"after": after} if after else {}),  # cursor for pagination
         )
 
         messages = []
         for msg in response.data:
-            text_content = ""
-            if msg.content and isinstance(msg.content, list):
-                for block in msg.content:
-                    if hasattr(block, "text") and hasattr(block.text, "value"):
-                        text_content += block.text.value
+            # Служебные копии, созданные при сжатии треда, показываем в старом треде
+            if is_compaction_message(msg):
+                continue
 
             created_dt = (
                 datetime.fromtimestamp(msg.created_at).isoformat()
@@ -111,7 +132,7 @@ async def get_history(
             messages.append({
                 "id": msg.id,
                 "role": msg.role,
-                "message": text_content,
+                "message": message_text(msg),
                 "created_at": created_dt,
                 "is_active": True,
             })
@@ -121,13 +142,20 @@ async def get_history(
             messages = [m for m in messages if query.lower() in m["message"].lower()]
 
         # Return cursor info
-        next_cursor = None
-        if response.has_more and len(messages) > 0:
-            next_cursor = messages[-1]["id"]  # the last message on this page
+        has_more, next_cursor = response.has_more, None
+        if has_more and response.data:
+            next_cursor = response.data[-1].id  # the last message on this page
+            if thread_id != user["thread_id"]:
+                next_cursor = f"{thread_id}:{next_cursor}"
+        elif not has_more:
+            thread = await resilience.call(get_async_client().beta.threads.retrieve, thread_id)
+            previous_thread_id = (thread.metadata or {}).get("previous_thread_id")
+            if previous_thread_id:
+                has_more, next_cursor = True, f"{previous_thread_id}:"
 
         return {
             "messages": messages,
-            "has_more": response.has_more,
+            "has_more": has_more,
             "next_cursor": next_cursor,
             "total_fetched": len(messages),
         }
@@ -140,17 +168,203 @@ async def get_history(
             "total_fetched": 0,
         }
 
+async def _stream_text(websocket: WebSocket, text: str) -> None:
+    """Sends a ready answer in the same word frames as a streamed assistant reply."""
+    for token in re.findall(r"\S+\s*", text):
+        await websocket.send_json({"type": "word", "value": token})
+
+
+async def _stream_completion(websocket: WebSocket, messages: list) -> str:
+    """Streams a chat completion (no thread, no tools) to the websocket as word frames; returns the text."""
+    def open_stream():
+        return get_async_client().chat.completions.stream(
+            model=answer_cache.ANSWER_MODEL,
+            messages=messages,
+        )
+
+    reply = ''
+    async for event in resilience.stream_events(open_stream):
+        if event.type == "content.delta":
+            reply += event.delta
+            await websocket.send_json({"type": "word", "value": event.delta})
+    return reply
+
+
+async def _user_thread(user: dict):
+    """The user's thread; waits for its compaction in flight, so new messages land in the successor."""
+    await _compactions.wait(user["id"])
+    return await get_thread(user)
+
+
+async def _compact(thread, user: dict) -> None:
+    """Rotates the user's thread to a compacted one."""
+    async with run_scheduler.thread(thread.id, user["id"]):
+        seed_messages, seed_metadata = await thread_seed(user["id"], user.get("type_id"))
+        new_thread = await compact_thread(thread, seed_messages, seed_metadata)
+    if new_thread is None:
+        return
+    # Пишем, только если тред ещё тот же: другая вкладка могла сжать его раньше —
+    # тогда остаётся её тред, а свой удаляем
+    await database.execute(
+        update(users_table)
+        .where(users_table.c.id == user["id"], users_table.c.thread_id == thread.id)
+        .values(thread_id=new_thread.id)
+    )
+    winner = await database.fetch_val(select(users_table.c.thread_id).where(users_table.c.id == user["id"]))
+    if winner != new_thread.id:
+        try:
+            await resilience.call(get_async_client().beta.threads.delete, new_thread.id)
+        except Exception:
+            # Лишний тред никому не мешает
+            pass
+        return
+    user["thread_id"] = new_thread.id
+    remember_thread(user["id"], new_thread)
+
+
+async def _remember_exchange(thread_id: str, user_id: int, question: str, answer: str) -> None:
+    """Adds a locally answered question to the thread, so the assistant and /history see it."""
+    async with run_scheduler.thread(thread_id, user_id):
+        for role, content in (("user", question), ("assistant", answer)):
+            await resilience.call(
+                get_async_client().beta.threads.messages.create,
+                thread_id=thread_id, role=role, content=content, idempotent=False,
+            )
+
+
+_RUN_FINISHED_EVENTS = {
+    "thread.run.completed", "thread.run.failed", "thread.run.cancelled",
+    "thread.run.expired", "thread.run.incomplete",
+}
+
+
+async def _stream_run(websocket: WebSocket, thread_id: str, user_id: int, type_id: Optional[int],
+                      run_options: dict) -> Tuple[str, bool, Optional[int]]:
+    """
+    Streams an assistant run to the websocket as word frames;
+    returns (reply, used_tools, prompt tokens of the run).
+    When the assistant calls functions the run stops in requires_action: the calls
+    are computed locally and the run continues with the submitted outputs.
+    If streaming fails midway (deadline, upstream error, client gone) the run is
+    cancelled, so it doesn't block the thread for the next message.
+    """
+    assistant = await get_assistant()
+
+    def open_stream():
+        return get_async_client().beta.threads.runs.stream(
+            thread_id=thread_id,
+            assistant_id=assistant.id,
+            **run_options,
+        )
+
+    reply, used_tools, active_run_id, prompt_tokens = '', False, None, None
+    try:
+        while open_stream is not None:
+            required_run = None
+            async for event in resilience.stream_events(open_stream):
+                if event.event == "thread.message.delta":
+                    token = event.data.delta.content[0].text.value
+                    reply += token
+                    await websocket.send_json({"type": "word", "value": token})
+                elif event.event == "thread.run.created":
+                    active_run_id = event.data.id
+                elif event.event == "thread.run.requires_action":
+                    required_run = event.data
+                elif event.event in _RUN_FINISHED_EVENTS:
+                    active_run_id = None
+                    if event.data.usage is not None:
+                        prompt_tokens = event.data.usage.prompt_tokens
+
+            open_stream = None
+            if required_run is not None:
+                used_tools = True
+                tool_calls = required_run.required_action.submit_tool_outputs.tool_calls
+                outputs = await asyncio.gather(*(
+                    run_analytics(call_tool, user_id, type_id, call.function.name, call.function.arguments)
+                    for call in tool_calls
+                ))
+                tool_outputs = [
+                    {"tool_call_id": call.id, "output": output}
+                    for call, output in zip(tool_calls, outputs)
+                ]
+
+                def open_stream(run_id=required_run.id, tool_outputs=tool_outputs):
+                    return get_async_client().beta.threads.runs.submit_tool_outputs_stream(
+                        thread_id=thread_id,
+                        run_id=run_id,
+                        tool_outputs=tool_outputs,
+                    )
+    except BaseException:
+        if active_run_id is not None:
+            await _cancel_run(thread_id, active_run_id)
+        raise
+    return reply, used_tools, prompt_tokens
+
+
+async def _cancel_run(thread_id: str, run_id: str) -> None:
+    try:
+        await asyncio.shield(resilience.call(get_async_client().beta.threads.runs.cancel, run_id, thread_id=thread_id))
+    except Exception:
+        # Не вышло — run сам истечёт на стороне OpenAI
+        pass
+
+
+def _voice_from_frame(frame: dict) -> Optional[Tuple[bytes, str]]:
+    """
+    Returns (audio, suffix) if the websocket frame carries a voice message.
+    Raises 413 / 400 for oversized or undecodable audio — before START is sent.
+    """
+    if frame.get("bytes") is not None:
+        audio = frame["bytes"]
+        check_audio_size(len(audio))
+        return audio, guess_audio_suffix(audio)
+
+    text = frame.get("text") or ""
+    if not text.startswith("{"):
+        return None
+    try:
+        payload = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(payload, dict) or payload.get("type") != "audio":
+        return None
+
+    value = payload.get("value") or ""
+    # Размер проверяем до декодирования: base64 длиннее данных на треть
+    check_audio_size(len(value) * 3 // 4)
+    try:
+        audio = base64.b64decode(value, validate=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Аудио должно быть в base64")
+    suffix = f".{payload['format'].lstrip('.')}" if payload.get("format") else guess_audio_suffix(audio)
+    return audio, suffix
+
+
+async def _send_error(websocket: WebSocket, detail, started: bool) -> None:
+    await websocket.send_json({"type": "error", "value": detail})
+    # После START клиент ждёт END — закрываем ответ и при ошибке
+    if started:
+        await websocket.send_json({"type": "system", "value": "END"})
+
+
 @router.websocket("/ws/chat/{user_id}")
 async def chat_websocket(websocket: WebSocket, user_id: int):
     """
     WebSocket endpoint that streams assistant responses like ChatGPT.
+    The client sends a question as a text frame, or as voice: a binary frame with
+    the whole audio clip, or {"type": "audio", "value": "<base64>", "format": "m4a"}.
     Message protocol:
+      {"type": "system", "value": "PROVISIONING"}   (right after connect, while the thread is prepared;
+                                                     messages can be sent right away)
       {"type": "system", "value": "START"}
+      {"type": "transcription", "value": "Hello world?"}   (voice questions only)
       {"type": "word", "value": "Hello"}
       {"type": "word", "value": "world!"}
       {"type": "system", "value": "END"}
     On error:
       {"type": "error", "value": "Invalid ID"}
+      {"type": "system", "value": "END"}      (after an error that follows START)
+    Errors before START (rate limit, oversized or undecodable audio) come as a lone error frame.
     """
 
     await websocket.accept()
@@ -168,74 +382,27 @@ async def chat_websocket(websocket: WebSocket, user_id: int):
 
         user = dict(user)
 
-        # Get or create thread
-        if user.get("thread_id"):
-            thread = client.beta.threads.retrieve(user["thread_id"])
-            transactions_file_id = user.get("transactions_file_id")
-        else:
-            transactions = get_user_transactions(user_id)
-
-            if transactions:
-                transactions_file = client.files.create(
-                    file=io.BytesIO(json.dumps(transactions).encode('utf-8')),
-                    purpose='assistants',
-                )
-                transactions_file_id = transactions_file.id
-
-                type_message = ''
-
-                if user['type_id'] == 1:
-                    type_message = '[RINAT] Этот пользователь - физическое лицо. Ему нужно предлагать только продукты для физических лиц.'
-                elif user['type_id'] == 2:
-                    type_message = '[RINAT] Этот пользователь - юридическое лицо. Ему нужно предлагать только продукты для юридических лиц.'
-
-                thread = client.beta.threads.create(messages=[
-                        {
-                            'role': 'user',
-                            'content': type_message
-                        },
-                        {
-                            'role': 'user',
-                            'content': '''[RINAT] Я загружу JSON с банковскими транзакциями данного пользователя. Можешь использовать его для анализа доходов и расходов.
-                            Файл содержит список JSON-объектов, у которых есть поля: 
-                            `id` - идентификатор пользователя, 
-                            `name` - имя пользователя,
-                            `status` - откуда была произведена оплата,
-                            `date` - дата транзакции,
-                            `category` - категория транзакции,
-                            `amount` - сумма транзакции,
-                            `currency` - валюта,
-                            `salary` - зарплата ползователя каждый месяц
-                            `balance_left` - текущий баланс пользователя
-                            ''',
-                            # 'attachments': [
-                            #     {'file_id': transactions_file.id, 'tools': [{'type': 'code_interpreter'}]}
-                            # ]
-                        }
-                    ],tool_resources={
-                        'code_interpreter': {
-                            'file_ids': [transactions_file.id],
-                        }
-                    })
-                # client.beta.threads.runs.create(
-                #     thread_id=thread.id,
-                #     assistant_id=assistant.id,
-                #     instructions='Вот история транзакций данного пользователя в JSON формате. Используй её для анализа расходов и персонализированных предложений.',
-                #     tool_resources={}
-                # )
-            else:
-                thread = client.beta.threads.create()
-                transactions_file_id = None
-            await database.execute(
-                update(users_table)
-                .where(users_table.c.id == user_id)
-                .values(thread_id=thread.id, transactions_file_id=transactions_file_id)
-            )
+        # Тред готовится в фоне (или уже в кэше): сообщения принимаем сразу, а тред
+        # ждём только там, где он нужен. Транзакции в тред не грузим — ассистент получает
+        # данные через функции (src/utils/assistant_tools.py) и компактный профиль
+        type_id = user.get("type_id")
+        if start_provisioning(user) is not None:
+            await websocket.send_json({"type": "system", "value": "PROVISIONING"})
 
         # Main chat loop
         while True:
+            started = False
             try:
-                user_msg = await websocket.receive_text()
+                frame = await websocket.receive()
+                if frame["type"] == "websocket.disconnect":
+                    break
+                voice = _voice_from_frame(frame)
+                user_msg = frame.get("text") or ""
+
+                # Сообщение запускает ассистента (и Whisper для голоса) — списываем из ведра клиента
+                client = rate_limit.client_key(websocket.scope)
+                # Оба ведра проверяются до списания: отклонённый голос не съедает токены чата
+                await rate_limit.check(client, *(("chat", "voice") if voice is not None else ("chat",)))
 
                 # await database.execute(
                 #     insert(chat_messages_table).values(
@@ -249,32 +416,64 @@ async def chat_websocket(websocket: WebSocket, user_id: int):
 
                 # Signal start of response
                 await websocket.send_json({"type": "system", "value": "START"})
-
-                # Add user message to thread
-                client.beta.threads.messages.create(
-                    thread_id=thread.id,
-                    role="user",
-                    content=user_msg,
-                    attachments=[
-                        {'file_id': transactions_file_id, 'tools': [{'type': 'code_interpreter'}]}
-                    ] if transactions_file_id else [],
-                )
-
-                # bot_reply = ""
-
-                # Stream assistant reply
-                with client.beta.threads.runs.stream(
+                started = True
+
+                # Голос распознаём здесь же и сразу отдаём текст клиенту, до ответа ассистента
+                if voice is not None:
+                    audio, suffix = voice
+                    user_msg = await transcribe(io.BytesIO(audio), f"voice{suffix}")
+                    await websocket.send_json({"type": "transcription", "value": user_msg})
+
+                # Простые аналитические вопросы отвечаем сами, без запуска ассистента
+                intent = match_intent(user_msg)
+                answer = await run_analytics(answer_intent, user_id, intent) if intent else None
+                if answer is not None:
+                    await _stream_text(websocket, answer)
+                    await websocket.send_json({"type": "system", "value": "END"})
+                    started = False
+                    thread = await _user_thread(user)
+                    await _remember_exchange(thread.id, user_id, user_msg, answer)
+                    continue
+
+                # Общие вопросы о продуктах не зависят от клиента — отвечаем из кэша или
+                # отдельным запросом без треда с профилем, чтобы в общий кэш не попали его данные
+                product_context = get_product_index().context_for(user_msg, segment=type_id)
+                if answer_cache.is_cacheable(user_msg, product_context):
+                    answer = answer_cache.lookup(user_msg, type_id)
+                    if answer is None:
+                        answer = await _stream_completion(
+                            websocket, answer_cache.answer_messages(user_msg, product_context),
+                        )
+                        answer_cache.store(user_msg, type_id, answer)
+                    else:
+                        await _stream_text(websocket, answer)
+                    await websocket.send_json({"type": "system", "value": "END"})
+                    started = False
+                    thread = await _user_thread(user)
+                    await _remember_exchange(thread.id, user_id, user_msg, answer)
+                    continue
+
+                # Карточки продуктов подбираем локально; если нашли — run без file_search
+                run_options = {}
+                if product_context:
+                    run_options = {
+                        "additional_instructions": product_context,
+                        "tools": ASSISTANT_TOOLS,
+                    }
+
+                # Один активный run на тред: сообщения из других вкладок ждут своей очереди
+                thread = await _user_thread(user)
+                async with run_scheduler.run(thread.id, user_id):
+                    await resilience.call(
+                        get_async_client().beta.threads.messages.create,
                         thread_id=thread.id,
-                        assistant_id=assistant.id,
-                ) as stream:
-                    message = ''
-                    for event in stream:
-                        if event.event == "thread.message.delta":
-                            token = event.data.delta.content[0].text.value
-                            # bot_reply += token
-                            message += token
-                            await websocket.send_json({"type": "word", "value": token})
-                    # await websocket.send_text(message)
+                        role="user",
+                        content=user_msg,
+                        idempotent=False,
+                    )
+                    reply, used_tools, prompt_tokens = await _stream_run(
+                        websocket, thread.id, user_id, type_id, run_options,
+                    )
 
                 # await database.execute(
                 #     insert(chat_messages_table).values(
@@ -288,11 +487,20 @@ async def chat_websocket(websocket: WebSocket, user_id: int):
 
                 # End of response
                 await websocket.send_json({"type": "system", "value": "END"})
+                started = False
+
+                # Тред разросся — сжимаем в фоне, цикл сразу принимает следующее сообщение.
+                # Ошибку сжатия глотает SingleFlight — попробуем после следующего ответа
+                record_run_usage(prompt_tokens)
+                if needs_compaction(prompt_tokens):
+                    _compactions.start(user_id, _compact, thread, user)
 
             except WebSocketDisconnect:
                 break
+            except HTTPException as e:
+                await _send_error(websocket, e.detail, started)
             except Exception as e:
-                await websocket.send_json({"type": "error", "value": str(e)})
+                await _send_error(websocket, str(e), started)
     except Exception as e:
         await websocket.send_json({"type": "error", "value": f"Server error: {str(e)}"})
         await websocket.close()
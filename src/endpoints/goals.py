@@ -0,0 +1,32 @@
+from typing import Any, Dict
+
+from fastapi import APIRouter
+from sqlalchemy import select
+
+from src.models.user import users_table
+from src.schemas.goals import GoalPlan
+from src.utils.analytics_pool import run_analytics
+from src.utils.db import database
+
+router = APIRouter(
+    tags=["goals"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.post("/users/{user_id}/goals/plan")
+async def plan_user_goal(user_id: int, plan: GoalPlan) -> Dict[str, Any]:
+    """
+    Вероятность накопить на цель к каждому месяцу — с Копилкой, Вакалой (или депозитами для бизнеса)
+    и без вложений, по симуляции Монте-Карло.
+    Пример: {"target_amount": 5000000, "months": 36}
+    """
+    from src.utils.goals import plan_goal
+
+    type_id = plan.type_id
+    if type_id is None:
+        type_id = await database.fetch_val(select(users_table.c.type_id).where(users_table.c.id == user_id))
+    return await run_analytics(
+        plan_goal, user_id, type_id, plan.target_amount, plan.months,
+        plan.monthly_contribution, plan.initial_amount, plan.end_date,
+    )
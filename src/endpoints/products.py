@@ -0,0 +1,24 @@
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Query
+
+from src.utils.catalog import get_catalog
+
+router = APIRouter(
+    tags=["products"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.get("/products/eligible")
+async def eligible_products(
+    amount: Optional[float] = Query(None, ge=0, description="Сумма, ₸"),
+    term_m: Optional[float] = Query(None, ge=0, description="Срок, месяцев"),
+    age: Optional[int] = Query(None, ge=0, le=120, description="Возраст клиента"),
+    segment: Optional[int] = Query(None, ge=1, le=2, description="1 — физлица, 2 — бизнес (как type_id)"),
+) -> List[Dict[str, Any]]:
+    """
+    Продукты каталога, условия которых допускают сумму, срок и возраст; не заданный параметр не фильтрует.
+    Пример: /products/eligible?amount=250000&term_m=6&age=30&segment=1
+    """
+    return get_catalog().eligible(amount=amount, term_m=term_m, age=age, segment=segment)
@@ -0,0 +1,40 @@
+from typing import Any, Dict, List
+
+from fastapi import APIRouter
+from sqlalchemy import select
+
+from src.models.user import users_table
+from src.schemas.segments import SegmentQuery
+from src.utils.analytics_pool import run_analytics
+from src.utils.db import database
+
+router = APIRouter(
+    tags=["segments"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@router.post("/segments/query")
+async def query_segments(query: SegmentQuery) -> Dict[str, Any]:
+    """
+    Пользователи, подходящие под фильтры профиля, с количеством и постраничными id.
+    Пример: экономные физ. лица со свободными ≥ 200k и долей такси > 15%:
+    {"type_id": 1, "filters": [{"field": "financial_type", "op": "eq", "value": "Экономный"},
+    {"field": "free_cash_m", "op": "gte", "value": 200000}, {"field": "share.Такси", "op": "gt", "value": 0.15}]}
+    """
+    from src.utils.segments import query_segment
+
+    user_ids = None
+    if query.type_id is not None:
+        # Сегмент клиента известен только из таблицы users, в датасете его нет
+        rows = await database.fetch_all(select(users_table.c.id).where(users_table.c.type_id == query.type_id))
+        user_ids = [row["id"] for row in rows]
+    return await run_analytics(query_segment, query.model_dump(exclude={"type_id"}), user_ids)
+
+
+@router.get("/segments/fields")
+async def segment_fields() -> Dict[str, List[str]]:
+    """Поля профиля, доступные в фильтрах, сортировке и fields."""
+    from src.utils.segments import NUMERIC_FIELDS, TEXT_FIELDS
+
+    return {"numeric": NUMERIC_FIELDS, "text": TEXT_FIELDS}
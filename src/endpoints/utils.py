@@ -1,8 +1,9 @@
 import asyncio
 from fastapi import APIRouter, Request, Depends
-from sqlalchemy import select
-from src.models.products import products_table
-from src.utils.db import database
+from fastapi.responses import JSONResponse
+from src.utils.catalog import reload_catalog, store_catalog
+from src.utils.metrics import collect_metrics
+from src.utils.startup import readiness
 
 
 router = APIRouter(
@@ -13,20 +14,32 @@ router = APIRouter(
 @router.get("/load/products")
 async def seed_default_data():
     """
-    Seeds default data into the database if it's empty.
+    Re-reads products.csv into the in-memory catalog and products_table.
     """
-    query = select(products_table.c.id)
-    rows = await database.fetch_all(query)
+    count = await store_catalog(reload_catalog())
+    return {"products": count}
 
-    if rows:  # Already seeded
-        print("✅ Default data already exists, skipping seeding.")
-        return
 
-    default_products = [
-        {"name": "Premium Cashback Card", "category": "Credit Card", "description": "3% cashback on groceries."},
-        {"name": "Student Debit Card", "category": "Debit Card", "description": "No maintenance fee for students."},
-        {"name": "Travel Rewards Card", "category": "Credit Card", "description": "Earn miles for every purchase."},
-    ]
+@router.get("/metrics")
+async def get_metrics():
+    """
+    Runtime metrics of the process (analytics pool queue depth etc.).
+    """
+    return collect_metrics()
+
 
-    insert_query = products_table.insert().values(default_products)
-    await database.execute(insert_query)
\ No newline at end of file
+@router.get("/health")
+async def health():
+    """
+    Liveness: the process is up and serving requests.
+    """
+    return {"status": "ok"}
+
+
+@router.get("/ready")
+async def ready():
+    """
+    Readiness: dataset, analytics pool and assistant are warmed up; 503 until then.
+    """
+    state = readiness()
+    return JSONResponse(state, status_code=200 if state["ready"] else 503)
@@ -1,6 +1,7 @@
 from sqlalchemy import Table, Column, Integer, String, Float, MetaData
 from src.utils.db import metadata
 
+# Заполняется из products.csv при старте (src/utils/catalog.py)
 products_table = Table(
     "products",
     metadata,
@@ -8,4 +9,16 @@ products_table = Table(
     Column("name", String, nullable=False),
     Column("category", String),
     Column("description", String),
+    Column("code", String, unique=True),
+    Column("segment", Integer),
+    Column("markup_from", Integer),
+    Column("expected_yield", String),
+    Column("min_sum", Integer),
+    Column("max_sum", Integer),
+    Column("min_term_m", Integer),
+    Column("max_term_m", Integer),
+    Column("min_term_d", Integer),
+    Column("max_term_d", Integer),
+    Column("min_age", Integer),
+    Column("max_age", Integer),
 )
\ No newline at end of file
@@ -0,0 +1,12 @@
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+
+class GoalPlan(BaseModel):
+    target_amount: int = Field(..., gt=0, description="Сколько нужно накопить, ₸")
+    months: Optional[int] = Field(None, ge=1, le=360, description="Срок цели; по умолчанию — пока цель не станет достижимой")
+    monthly_contribution: Optional[int] = Field(None, ge=0, description="Взнос в месяц; по умолчанию — свободный остаток по транзакциям")
+    initial_amount: int = Field(0, ge=0, description="Уже накоплено, ₸")
+    type_id: Optional[int] = Field(None, description="1 — физ. лица, 2 — юр. лица; по умолчанию — из таблицы users")
+    end_date: Optional[str] = Field(None, description="YYYY-MM-DD; по умолчанию — последняя транзакция клиента")
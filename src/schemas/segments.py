@@ -0,0 +1,20 @@
+from typing import Any, List, Literal, Optional
+
+from pydantic import BaseModel, Field
+
+
+class SegmentFilter(BaseModel):
+    field: str = Field(..., description="Поле профиля, напр. free_cash_m или share.Такси")
+    op: Literal["eq", "ne", "gt", "gte", "lt", "lte", "in", "not_in", "between"]
+    value: Any = Field(..., description="Число/строка; список для in/not_in; [от, до] для between")
+
+
+class SegmentQuery(BaseModel):
+    type_id: Optional[int] = Field(None, description="1 — физ. лица, 2 — юр. лица (по таблице users)")
+    filters: List[SegmentFilter] = []
+    end_date: Optional[str] = Field(None, description="YYYY-MM-DD; по умолчанию — последний день датасета")
+    sort_by: Optional[str] = None
+    descending: bool = False
+    offset: int = Field(0, ge=0)
+    limit: int = Field(100, ge=1, le=10_000)
+    fields: List[str] = Field([], description="Какие поля профиля вернуть в rows (пусто — только ids)")
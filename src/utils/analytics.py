@@ -0,0 +1,328 @@
+from datetime import date, datetime, timedelta
+from fastapi import HTTPException
+from typing import Optional, List, Dict, Any, Tuple
+import pandas as pd
+
+from src.utils.anomalies import anomaly_insights
+from src.utils.catalog import SEGMENT_PERSONAL, get_catalog
+from src.utils.forecast import FORECAST_FIELDS, forecast_for
+from src.utils.peers import peer_comparison
+from src.utils.transactions import CATEGORIES, load_transactions
+
+WEEKDAY_RU = {
+    0: "Понедельник", 1: "Вторник", 2: "Среда",
+    3: "Четверг", 4: "Пятница", 5: "Суббота", 6: "Воскресенье"
+}
+
+
+def user_period(
+    user_id: int,
+    end_date: Optional[str] = None,
+    days: int = 90
+) -> Tuple[pd.DataFrame, date, date]:
+    """Транзакции пользователя за `days` дней до end_date (включительно) и границы периода."""
+    df = load_transactions()
+    user_data = df[df["id"] == user_id].copy()
+    if user_data.empty:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+
+    # ЖЁСТКО приводим тип в рамках запроса (на случай hot-reload/старых данных)
+    user_data["date"] = pd.to_datetime(user_data["date"], errors="coerce")
+
+    # Период
+    end_dt = datetime.strptime(end_date, "%Y-%m-%d") if end_date else datetime.now()
+    start_dt = end_dt - timedelta(days=days)
+
+    # Сравниваем именно даты (без времени), чтобы избежать TZ-наследования
+    d0, d1 = start_dt.date(), end_dt.date()
+    mask = (user_data["date"].dt.date >= d0) & (user_data["date"].dt.date <= d1)
+    period_data = user_data.loc[mask].dropna(subset=["date"])
+
+    if period_data.empty:
+        detail = "Нет транзакций за последние 3 месяца" if days == 90 else "Нет транзакций за указанный период"
+        raise HTTPException(status_code=404, detail=detail)
+
+    return period_data, d0, d1
+
+
+def category_totals(period_data: pd.DataFrame) -> pd.Series:
+    """Суммы по категориям в фиксированном порядке CATEGORIES."""
+    return (
+        period_data.groupby("category", observed=True)["amount"]
+        .sum()
+        .reindex(CATEGORIES, fill_value=0)
+        .astype(int)
+    )
+
+
+def spending_summary_3m(
+    user_id: int,
+    end_date: Optional[str] = None
+) -> Dict[str, Any]:
+    period_data, d0, d1 = user_period(user_id, end_date)
+    grouped = category_totals(period_data)
+
+    total_spent = int(grouped.sum())
+    salary = int(period_data["salary"].iloc[0])
+    salary_3m = salary * 3
+    balance_left = int(salary_3m - total_spent)
+
+    categories_summary: List[Dict[str, Any]] = [
+        {"category": cat, "amount": int(grouped.loc[cat]),
+         "share": round(int(grouped.loc[cat]) / total_spent, 4) if total_spent else 0.0}
+        for cat in CATEGORIES
+    ]
+
+    return {
+        "user_id": user_id,
+        "period": {
+            "start_date": d0.isoformat(),
+            "end_date": d1.isoformat(),
+            "days": (d1 - d0).days
+        },
+        "currency": "KZT",
+        "salary_monthly": salary,
+        "salary_3m": salary_3m,
+        "total_spent_3m": total_spent,
+        "balance_left_3m": balance_left,
+        "categories": categories_summary
+    }
+
+
+def monthify_sum_3m(x: float) -> float:
+    return x / 3.0
+
+def financial_type(spent_ratio: float) -> str:
+    if spent_ratio <= 0.70: return "Экономный"
+    if spent_ratio <= 0.85: return "Сбалансированный"
+    if spent_ratio <= 1.00: return "Тратит всё"
+    return "В минусе"
+
+def pick_products(salary_m: int,
+                  free_cash_m: float,
+                  spent_ratio: float,
+                  period_data: pd.DataFrame,
+                  cats_share: Dict[str, float],
+                  forecast: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Жадная логика подбора продуктов на основе CSV; forecast — прогноз конца месяца (src/utils/forecast.py)."""
+    recs = []
+    # Условия продуктов — из каталога (products.csv), на момент вызова
+    catalog = get_catalog()
+    products = catalog.segment_products(SEGMENT_PERSONAL)
+
+    # Инвестиции — если есть свободный остаток
+    if free_cash_m >= products["SAVINGS"]["min_sum"]:
+        recs.append({
+            "product": products["SAVINGS"]["name"],
+            "reason": f"Ежемесячно свободно ~{int(free_cash_m):,} ₸ — можно копить (доходность {products['SAVINGS']['expected_yield']}).".replace(",", " "),
+            "suggested_monthly": int(min(free_cash_m, 200_000))
+        })
+    if free_cash_m >= products["WAKALA"]["min_sum"]:
+        recs.append({
+            "product": products["WAKALA"]["name"],
+            "reason": f"Достаточный остаток для инвестиций (доходность {products['WAKALA']['expected_yield']}).",
+            "suggested_monthly": int(min(free_cash_m, 300_000))
+        })
+
+    # Финансирование — при высоком коэффициенте расходов
+    max_tx = int(period_data["amount"].max()) if not period_data.empty else 0
+    # Прогноз: к концу месяца деньги закончатся
+    shortfall = forecast is not None and forecast["month_end_balance"] < 0
+    # BNPL — для крупных покупок до 300k, если бюджет напряжён (>=0.9) или по прогнозу не хватит до конца месяца
+    if (spent_ratio >= 0.90 or shortfall) and catalog.is_eligible("BNPL", amount=max_tx):
+        rec = {
+            "product": products["BNPL"]["name"],
+            "reason": f"Крупные покупки до {products['BNPL']['max_sum']:,} ₸ при высоких расходах — удобно распределить платежи.".replace(",", " "),
+            "limits": {"min": products["BNPL"]["min_sum"], "max": products["BNPL"]["max_sum"], "term_m": [products["BNPL"]["min_term_m"], products["BNPL"]["max_term_m"]]}
+        }
+        if shortfall:
+            rec["timing"] = forecast_timing(forecast, "крупные покупки лучше оформлять в рассрочку")
+        recs.append(rec)
+
+    # Исламское финансирование — когда нужен буфер > 100k и расходы высокие
+    if spent_ratio >= 0.90 and salary_m >= 400_000:
+        recs.append({
+            "product": products["ISLAM_FIN"]["name"],
+            "reason": f"Высокая доля расходов — можно покрывать покупки/потребности халяль-финансированием до {format_kzt(products['ISLAM_FIN']['max_sum'])}.",
+            "limits": {"min": products["ISLAM_FIN"]["min_sum"], "max": products["ISLAM_FIN"]["max_sum"], "term_m": [products["ISLAM_FIN"]["min_term_m"], products["ISLAM_FIN"]["max_term_m"]]},
+            "note": f"Проверка возраста {products['ISLAM_FIN']['min_age']}–{products['ISLAM_FIN']['max_age']} лет потребуется при оформлении."
+        })
+
+    # Ипотека — только по профилю дохода, без возраста (его нет в CSV)
+    if salary_m >= 1_000_000 and spent_ratio <= 0.85:
+        recs.append({
+            "product": products["ISLAM_MORT"]["name"],
+            "reason": "Стабильный доход и контролируемые расходы — профиль подходит для ипотеки.",
+            "limits": {"min": products["ISLAM_MORT"]["min_sum"], "max": products["ISLAM_MORT"]["max_sum"], "term_m": [products["ISLAM_MORT"]["min_term_m"], products["ISLAM_MORT"]["max_term_m"]]},
+            "note": f"Возрастная проверка {products['ISLAM_MORT']['min_age']}–{products['ISLAM_MORT']['max_age']} лет при подаче заявки."
+        })
+
+    # Уточняющие персональные советы по поведению (не продукт, но полезно)
+    dining_ent = cats_share.get("Кофе и рестораны", 0) + cats_share.get("Развлечения", 0)
+    if dining_ent >= 0.25:
+        recs.append({
+            "product": "Совет по бюджету",
+            "reason": f"Большая доля кафе+развлечения ({int(dining_ent*100)}%). Сократи на 10–15% и направляй разницу в Копилку.",
+            "suggested_monthly": int(0.1 * salary_m)
+        })
+
+    return recs
+
+def forecast_timing(forecast: Dict[str, Any], action: str) -> str:
+    """Когда предлагать продукт: по прогнозу остатка на конец месяца."""
+    month_end = date.fromisoformat(forecast["month_end"]).strftime("%d.%m")
+    text = f"По прогнозу на {month_end} остаток {format_kzt(forecast['month_end_balance'])}"
+    if forecast["shortfall_date"]:
+        text += f", деньги закончатся около {date.fromisoformat(forecast['shortfall_date']).strftime('%d.%m')}"
+    return f"{text} — {action} до этой даты."
+
+def format_kzt(x: int) -> str:
+    # 1_234_567 -> "1 234 567 ₸"
+    return f"{int(x):,} ₸".replace(",", " ")
+
+def make_advice(
+    salary_m: int,
+    spent_ratio: float,
+    cats_share: Dict[str, float],
+    grouped_amounts: Dict[str, int],
+    free_cash_m: float
+) -> str:
+    # Находим «большую» категорию для конкретики
+    if grouped_amounts:
+        top_cat = max(grouped_amounts.items(), key=lambda kv: kv[1])[0]
+        top_cat_amt = grouped_amounts[top_cat]
+    else:
+        top_cat, top_cat_amt = "Продукты питания", 0
+
+    dining_ent_share = cats_share.get("Кофе и рестораны", 0) + cats_share.get("Развлечения", 0)
+    cut10_top = int(top_cat_amt * 0.10)
+    suggest_save = int(min(max(0.05 * salary_m, 10_000), 200_000))
+    suggest_invest = int(min(max(free_cash_m * 0.7, 50_000), 300_000))
+
+    if spent_ratio >= 0.95:
+        return (
+            f"Бюджет перенапряжён: расходы ≈ {round(spent_ratio*100)}%. "
+            f"Сократи «{top_cat}» на 10% (~{format_kzt(cut10_top)}) и используй BNPL для крупных покупок до 300 000 ₸. "
+            f"Если нужен буфер — рассмотрите Исламское финансирование до 5 000 000 ₸."
+        )
+    elif 0.85 <= spent_ratio < 0.95:
+        extra = ""
+        if dining_ent_share >= 0.25:
+            extra = " Сократи кафе+развлечения на 10–15% и направляй разницу в Копилку."
+        return (
+            f"На грани: расходы ≈ {round(spent_ratio*100)}%. "
+            f"Начни откладывать {format_kzt(suggest_save)} в «Копилку».{extra}"
+        )
+    elif 0.70 <= spent_ratio < 0.85:
+        return (
+            f"Сбалансированный профиль: расходы ≈ {round(spent_ratio*100)}%. "
+            f"Рекомендуем инвестировать {format_kzt(suggest_invest)} в «Вакала» (до 20%) "
+            f"и параллельно копить {format_kzt(suggest_save)} в «Копилку»."
+        )
+    else:
+        return (
+            f"Отличный запас: расходы ≈ {round(spent_ratio*100)}%. "
+            f"Ускорь достижение целей — направляй {format_kzt(suggest_invest)} в «Вакала» и "
+            f"{format_kzt(suggest_save)} в «Копилку». Создай цель и привяжи автосписание."
+        )
+
+def user_analytics(
+    user_id: int,
+    end_date: Optional[str] = None
+) -> Dict[str, Any]:
+    # Период 3 месяца до end_date
+    period, d0, d1 = user_period(user_id, end_date)
+
+    # Базовые метрики
+    salary_m = int(period["salary"].iloc[0])  # зарплата в месяц
+    spent_3m = int(period["amount"].sum())
+    spent_m = monthify_sum_3m(spent_3m)
+    salary_3m = salary_m * 3
+    spent_ratio = float(spent_3m / salary_3m) if salary_3m > 0 else 0.0
+    free_cash_3m = salary_3m - spent_3m
+    free_cash_m = max(0.0, monthify_sum_3m(free_cash_3m))
+
+    # Категории
+    grouped = category_totals(period)
+    total = int(grouped.sum()) or 1
+    cats = [{"category": c, "amount": int(grouped[c]), "share": round(int(grouped[c]) / total, 4)} for c in CATEGORIES]
+    cats_share = {c["category"]: c["share"] for c in cats}
+    grouped_amounts = {c: int(grouped[c]) for c in CATEGORIES}
+    top3 = sorted(cats, key=lambda x: x["amount"], reverse=True)[:3]
+
+    # Тип пользователя и рекомендации/продукты
+    ftype = financial_type(spent_ratio)
+    forecast = forecast_for(user_id, d1)
+    products = pick_products(salary_m, free_cash_m, spent_ratio, period, cats_share, forecast)
+
+    # Доп. быстрые инсайты
+    avg_ticket = int(period["amount"].mean())
+    tx_count = int(period.shape[0])
+    days = (d1 - d0).days
+    tx_per_day = round(tx_count / max(1, days), 2)
+
+    # --- Интересные факты (4 шт.) ---
+    insights: List[str] = []
+    dining = period[period["category"] == "Кофе и рестораны"]["amount"]
+    if not dining.empty:
+        insights.append(f"Средний чек в «Кофе и рестораны»: {int(dining.mean()):,} ₸".replace(",", " "))
+    else:
+        insights.append("В категории «Кофе и рестораны» не было покупок за период.")
+
+    by_day = period.copy()
+    by_day["weekday"] = by_day["date"].dt.weekday
+    wd_avg = by_day.groupby("weekday")["amount"].mean()
+    if not wd_avg.empty:
+        wd = int(wd_avg.idxmax())
+        insights.append(f"Самый затратный день недели: {WEEKDAY_RU[wd]} (средний чек {int(wd_avg.max()):,} ₸)".replace(",", " "))
+
+    top_cat = max(cats, key=lambda x: x["amount"]) if cats else None
+    if top_cat:
+        insights.append(f"Топ-категория: {top_cat['category']} — {round(top_cat['share'] * 100, 1)}% всех трат.")
+
+    idx = period["amount"].idxmax()
+    if pd.notna(idx):
+        row = period.loc[idx]
+        insights.append(f"Макс. транзакция: {int(row['amount']):,} ₸ — {row['category']} — {row['date'].date()}".replace(",", " "))
+
+    # Необычные траты периода (онлайн-статистика по категориям, src/utils/anomalies.py)
+    insights.extend(anomaly_insights(user_id, d0, d1))
+
+    # Сравнение с похожими клиентами по квантильным скетчам (src/utils/peers.py)
+    peers = peer_comparison(salary_m, grouped_amounts)
+    insights.extend(peers["insights"])
+
+    # --- НОВОЕ: персональный совет ---
+    advice = make_advice(salary_m, spent_ratio, cats_share, grouped_amounts, free_cash_m)
+
+    return {
+        "user_id": user_id,
+        "period": {
+            "start_date": d0.isoformat(),
+            "end_date": d1.isoformat(),
+            "days": days
+        },
+        "profile": {
+            "salary_monthly": salary_m,
+            "spent_3m": spent_3m,
+            "spent_monthly": int(spent_m),
+            "spent_ratio": round(spent_ratio, 3),
+            "balance_left_3m": int(free_cash_3m),
+            "balance_left_monthly": int(free_cash_m),
+            "financial_type": ftype
+        },
+        "activity": {
+            "transactions_count": tx_count,
+            "avg_ticket": avg_ticket,
+            "tx_per_day": tx_per_day
+        },
+        "categories": {
+            "breakdown": cats,
+            "top3": top3
+        },
+        "recommendations": products,
+        "insights": insights,
+        "peers": {"group": peers["peers"], "percentiles": peers["percentiles"]},
+        "forecast": forecast and {k: forecast[k] for k in FORECAST_FIELDS},
+        "advice": advice
+    }
@@ -0,0 +1,257 @@
+from typing import Optional, List, Dict, Any
+import pandas as pd
+
+from src.utils.analytics import (
+    CATEGORIES, monthify_sum_3m, financial_type, format_kzt, forecast_timing, user_period, category_totals,
+)
+from src.utils.anomalies import anomaly_insights
+from src.utils.catalog import SEGMENT_BUSINESS, get_catalog
+from src.utils.forecast import FORECAST_FIELDS, forecast_for
+from src.utils.peers import peer_comparison
+
+# То, что не укладывается в диапазоны каталога (products.csv)
+PRODUCT_EXTRAS: Dict[str, Dict[str, Any]] = {
+    "BIZ_CARD": {
+        "daily_limit": 10_000_000,
+        "service_fee": 0,
+        "cashout_rule": "до 1 000 000 ₸ — 0%; свыше — 1%",
+        "cashback": "до 1% на бизнес-категории"
+    },
+    "BIZ_TARIFFS": {
+        "payments_per_month": "10–200",
+        "fee_range": "0–15 000 ₸/мес",
+        "extras": ["Скидки на валютные операции", "Скидки на бизнес-карту",
+                   "Проверка контрагентов", "Налоговая отчётность", "Сервисы по развитию бизнеса"]
+    },
+}
+
+
+def business_products() -> Dict[str, Dict[str, Any]]:
+    """Бизнес-продукты каталога на момент вызова, с дополнительными условиями PRODUCT_EXTRAS."""
+    products = get_catalog().segment_products(SEGMENT_BUSINESS)
+    for code, extras in PRODUCT_EXTRAS.items():
+        products[code].update(extras)
+    return products
+
+
+def pick_products_business(
+    salary_m: int,
+    free_cash_m: float,
+    spent_ratio: float,
+    period_data: pd.DataFrame,
+    cats_share: Dict[str, float],
+    tx_count: int,
+    forecast: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Подбор БИЗНЕС-продуктов:
+    - Овердрафт при высокой нагрузке на бюджет или кассовых разрывах (в т.ч. прогнозных, forecast)
+    - Беззалоговое/залоговое исламское финансирование для оборотки/инвестиций
+    - Депозиты «Овернайт» и «Выгодный» при наличии свободного кэша
+    - Бизнес-карта с кэшбэком — почти всегда релевантна
+    - Тарифные пакеты РКО — по активности платежей
+    """
+    recs: List[Dict[str, Any]] = []
+    products = business_products()
+    max_tx = int(period_data["amount"].max()) if not period_data.empty else 0
+    avg_tx = int(period_data["amount"].mean()) if not period_data.empty else 0
+    tx_pm = max(1, round(tx_count / 3))  # транзакций в месяц (грубо)
+
+    # 1) Овердрафт — при напряженном бюджете, больших разовых платежах или прогнозном кассовом разрыве
+    shortfall = forecast is not None and forecast["month_end_balance"] < 0
+    if spent_ratio >= 0.90 or max_tx >= 300_000 or shortfall:
+        rec = {
+            "product": products["BIZ_OVERDRAFT"]["name"],
+            "reason": ("Высокая нагрузка на бюджет или крупные платежи — овердрафт до "
+                       f"{products['BIZ_OVERDRAFT']['max_sum']:,} ₸ помогает сгладить кассовые разрывы.").replace(",", " "),
+            "limits": {"min": products["BIZ_OVERDRAFT"]["min_sum"], "max": products["BIZ_OVERDRAFT"]["max_sum"], "max_term_days": products["BIZ_OVERDRAFT"]["max_term_d"]},
+            "note": f"Исламский кредитный лимит на счёт (овердрафт) до {products['BIZ_OVERDRAFT']['max_term_d']} дней."
+        }
+        if shortfall:
+            rec["timing"] = forecast_timing(forecast, "лимит стоит открыть")
+        recs.append(rec)
+
+    # 2) Исламское финансирование — беззалоговое / залоговое (выбор по величине потребности)
+    # эвристика: если средний месячный дефицит > 200k или планируются инвестиции — предлагать беззалоговое
+    monthly_gap = max(0, int((spent_ratio - 1.0) * salary_m)) if spent_ratio > 1 else 0
+    if spent_ratio >= 0.85 or monthly_gap > 200_000 or max_tx > 500_000:
+        recs.append({
+            "product": products["BIZ_ISLAM_UNSEC"]["name"],
+            "reason": ("Оборотные потребности/закуп — беззалоговое исламское финансирование до "
+                       f"{products['BIZ_ISLAM_UNSEC']['max_sum']:,} ₸.").replace(",", " "),
+            "limits": {"min": products["BIZ_ISLAM_UNSEC"]["min_sum"], "max": products["BIZ_ISLAM_UNSEC"]["max_sum"],
+                       "term_m": [products["BIZ_ISLAM_UNSEC"]["min_term_m"], products["BIZ_ISLAM_UNSEC"]["max_term_m"]]}
+        })
+        # если потребность крупнее (эвристика > 5 млн) — добавить залоговое
+        if max_tx >= 5_000_000 or free_cash_m < 200_000:
+            recs.append({
+                "product": products["BIZ_ISLAM_SEC"]["name"],
+                "reason": ("Крупные потребности/инвестиции — залоговое исламское финансирование до "
+                           f"{products['BIZ_ISLAM_SEC']['max_sum']:,} ₸.").replace(",", " "),
+                "limits": {"min": products["BIZ_ISLAM_SEC"]["min_sum"], "max": products["BIZ_ISLAM_SEC"]["max_sum"],
+                           "term_m": [products["BIZ_ISLAM_SEC"]["min_term_m"], products["BIZ_ISLAM_SEC"]["max_term_m"]]}
+            })
+
+    # 3) Депозиты — если есть свободный кэш
+    if free_cash_m >= products["BIZ_OVERNIGHT"]["min_sum"]:
+        recs.append({
+            "product": products["BIZ_OVERNIGHT"]["name"],
+            "reason": f"Свободный кэш ≥ {products['BIZ_OVERNIGHT']['min_sum']:,} ₸ — разместить на депозите «Овернайт», доходность {products['BIZ_OVERNIGHT']['expected_yield']}. ".replace(",", " "),
+            "suggested_monthly": int(min(free_cash_m, 2_000_000))
+        })
+    elif free_cash_m >= products["BIZ_PROFIT"]["min_sum"]:
+        recs.append({
+            "product": products["BIZ_PROFIT"]["name"],
+            "reason": f"Свободный кэш ≥ {products['BIZ_PROFIT']['min_sum']:,} ₸ — депозит «Выгодный», доходность {products['BIZ_PROFIT']['expected_yield']}. ".replace(",", " "),
+            "suggested_monthly": int(min(free_cash_m, 1_000_000))
+        })
+
+    # 4) Бизнес-карта — полезна почти всем (кэшбэк, лимиты, снятие)
+    recs.append({
+        "product": products["BIZ_CARD"]["name"],
+        "reason": (f"Кэшбэк {products['BIZ_CARD']['cashback']}, лимит по операциям до "
+                   f"{products['BIZ_CARD']['daily_limit']:,} ₸ в сутки, обслуживание {products['BIZ_CARD']['service_fee']} ₸. "
+                   f"Снятие: {products['BIZ_CARD']['cashout_rule']}.").replace(",", " ")
+    })
+
+    # 5) Тарифные пакеты РКО — под активность
+    def pick_tariff(n: int) -> str:
+        if n <= 20: return "Пакет S (до ~20 платежей/мес, абонплата ближе к 0)"
+        if n <= 80: return "Пакет M (до ~80 платежей/мес, оптимален по цене/объёму)"
+        return "Пакет L (100–200 платежей/мес, максимальные скидки)"
+
+    recs.append({
+        "product": products["BIZ_TARIFFS"]["name"],
+        "reason": f"Активность ~{tx_pm} платежей/мес — рекомендуем: {pick_tariff(tx_pm)}.",
+        "note": "Дополнительно: " + ", ".join(products["BIZ_TARIFFS"]["extras"])
+    })
+
+    return recs
+
+
+def make_advice_business(
+    salary_m: int,
+    spent_ratio: float,
+    cats_share: Dict[str, float],
+    grouped_amounts: Dict[str, int],
+    free_cash_m: float
+) -> str:
+    top_cat = max(grouped_amounts.items(), key=lambda kv: kv[1])[0] if grouped_amounts else "Продукты питания"
+    top_amt = grouped_amounts.get(top_cat, 0)
+
+    if spent_ratio >= 0.95:
+        return (f"Высокая загрузка бюджета (расходы ≈ {round(spent_ratio*100)}%). "
+                f"Сократи «{top_cat}» на 10% (~{format_kzt(int(top_amt*0.1))}) и используй овердрафт для сглаживания "
+                f"кассовых разрывов. Для закупов — подумай о беззалоговом исламском финансировании.")
+    elif 0.85 <= spent_ratio < 0.95:
+        return (f"Бюджет на грани (≈ {round(spent_ratio*100)}%). Проведи ревизию постоянных трат, "
+                f"перенеси часть платежей на бизнес-карту (кэшбэк до 1%), а свободный кэш размещай на «Выгодный» депозит.")
+    elif 0.70 <= spent_ratio < 0.85:
+        return (f"Сбалансировано (≈ {round(spent_ratio*100)}%). Свободный остаток направляй в «Овернайт» "
+                f"или «Выгодный», чтобы деньги не лежали без дела; платежи веди через тарифный пакет М.")
+    else:
+        return (f"Отличный запас (≈ {round(spent_ratio*100)}%). Ускорь рост подушки — часть кэша ежедневно размещай в «Овернайт», "
+                f"для операций — бизнес-карта (кэшбэк), для платежей — подходящий тариф РКО.")
+
+
+def user_analytics(
+    user_id: int,
+    end_date: Optional[str] = None
+) -> Dict[str, Any]:
+    # Период 3 месяца до end_date
+    period, d0, d1 = user_period(user_id, end_date)
+
+    # Базовые метрики
+    salary_m = int(period["salary"].iloc[0])  # зарплата в месяц
+    spent_3m = int(period["amount"].sum())
+    spent_m = monthify_sum_3m(spent_3m)
+    salary_3m = salary_m * 3
+    spent_ratio = float(spent_3m / salary_3m) if salary_3m > 0 else 0.0
+    free_cash_3m = salary_3m - spent_3m
+    free_cash_m = max(0.0, monthify_sum_3m(free_cash_3m))
+
+    # Категории
+    grouped = category_totals(period)
+    total = int(grouped.sum()) or 1
+    cats = [{"category": c, "amount": int(grouped[c]), "share": round(int(grouped[c]) / total, 4)} for c in CATEGORIES]
+    cats_share = {c["category"]: c["share"] for c in cats}
+    grouped_amounts = {c: int(grouped[c]) for c in CATEGORIES}
+    top3 = sorted(cats, key=lambda x: x["amount"], reverse=True)[:3]
+
+    # >>> ПЕРЕНЕСЕНО ВВЕРХ <<<
+    tx_count = int(period.shape[0])
+    avg_ticket = int(period["amount"].mean())
+    days = (d1 - d0).days
+    tx_per_day = round(tx_count / max(1, days), 2)
+    # >>> ПЕРЕНЕСЕНО ВВЕРХ ^^^ <<<
+
+    # Тип пользователя и рекомендации/бизнес-продукты
+    forecast = forecast_for(user_id, d1)
+    products = pick_products_business(salary_m, free_cash_m, spent_ratio, period, cats_share, tx_count, forecast)
+
+    # Интересные факты (как раньше)
+    insights: List[str] = []
+    dining = period[period["category"] == "Кофе и рестораны"]["amount"]
+    if not dining.empty:
+        insights.append(f"Средний чек в «Кофе и рестораны»: {int(dining.mean()):,} ₸".replace(",", " "))
+    else:
+        insights.append("В категории «Кофе и рестораны» не было покупок за период.")
+
+    by_day = period.copy()
+    by_day["weekday"] = by_day["date"].dt.weekday
+    wd_avg = by_day.groupby("weekday")["amount"].mean()
+    if not wd_avg.empty:
+        from_week = {0:"Понедельник",1:"Вторник",2:"Среда",3:"Четверг",4:"Пятница",5:"Суббота",6:"Воскресенье"}
+        wd = int(wd_avg.idxmax())
+        insights.append(f"Самый затратный день недели: {from_week[wd]} (средний чек {int(wd_avg.max()):,} ₸)".replace(",", " "))
+
+    top_cat = max(cats, key=lambda x: x["amount"]) if cats else None
+    if top_cat:
+        insights.append(f"Топ-категория: {top_cat['category']} — {round(top_cat['share'] * 100, 1)}% всех трат.")
+
+    idx = period["amount"].idxmax()
+    if pd.notna(idx):
+        row = period.loc[idx]
+        insights.append(f"Макс. транзакция: {int(row['amount']):,} ₸ — {row['category']} — {row['date'].date()}".replace(",", " "))
+
+    # Необычные траты периода (онлайн-статистика по категориям, src/utils/anomalies.py)
+    insights.extend(anomaly_insights(user_id, d0, d1))
+
+    # Сравнение с похожими клиентами по квантильным скетчам (src/utils/peers.py)
+    peers = peer_comparison(salary_m, grouped_amounts)
+    insights.extend(peers["insights"])
+
+    # Совет (бизнес-версия)
+    advice = make_advice_business(salary_m, spent_ratio, cats_share, grouped_amounts, free_cash_m)
+
+    return {
+        "user_id": user_id,
+        "period": {
+            "start_date": d0.isoformat(),
+            "end_date": d1.isoformat(),
+            "days": days
+        },
+        "profile": {
+            "salary_monthly": salary_m,
+            "spent_3m": spent_3m,
+            "spent_monthly": int(spent_m),
+            "spent_ratio": round(spent_ratio, 3),
+            "balance_left_3m": int(free_cash_3m),
+            "balance_left_monthly": int(free_cash_m),
+            "financial_type": financial_type(spent_ratio)
+        },
+        "activity": {
+            "transactions_count": tx_count,
+            "avg_ticket": avg_ticket,
+            "tx_per_day": tx_per_day
+        },
+        "categories": {
+            "breakdown": cats,
+            "top3": top3
+        },
+        "recommendations": products,
+        "insights": insights,
+        "peers": {"group": peers["peers"], "percentiles": peers["percentiles"]},
+        "forecast": forecast and {k: forecast[k] for k in FORECAST_FIELDS},
+        "advice": advice
+    }
@@ -0,0 +1,195 @@
+"""
+Process pool for the CPU-heavy analytics endpoints.
+
+pandas work holds the GIL, so sync endpoints in Starlette's thread pool
+serialise across requests. With ANALYTICS_WORKERS=N the computations from
+`src.utils.analytics` / `src.utils.analytics_SME` run in N processes instead.
+
+The transaction columns are published once into `multiprocessing.shared_memory`
+blocks; workers attach to them at start and build a zero-copy DataFrame, so
+no DataFrame is ever pickled: a task is just (function, user_id, end_date).
+
+ANALYTICS_WORKERS=0 (the default) keeps the old behaviour: the computation
+runs in the thread pool of the current process. Profiled requests
+(src/utils/profiling.py) also run there, so the sampler sees the work.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from src.utils.metrics import register_metrics
+from src.utils.profiling import is_profiled
+from src.utils.singleflight import SingleFlight
+from src.utils.transactions import load_transactions, install_transactions
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+ANALYTICS_WORKERS = int(os.getenv("ANALYTICS_WORKERS", "0"))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_size = 0
+_shared: Optional["SharedDataset"] = None
+_worker_blocks: List[SharedMemory] = []
+_stats = {"in_flight": 0, "completed": 0, "failed": 0}
+_analytics_flight = SingleFlight("analytics")
+
+
+class SharedDataset:
+    """Transaction columns copied into shared memory blocks (one per column)."""
+
+    def __init__(self, df: "pd.DataFrame"):
+        # numpy/pandas — только при публикации датасета, не при импорте приложения
+        import numpy as np
+        import pandas as pd
+
+        self.owner_pid = os.getpid()
+        self.blocks: List[SharedMemory] = []
+        self.spec: Dict[str, Any] = {"length": len(df), "columns": []}
+
+        for name in df.columns:
+            series = df[name]
+            if series.dtype == object:
+                series = series.astype("category")
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                values = series.cat.codes.to_numpy()
+                categories = list(series.cat.categories)
+            else:
+                values = series.to_numpy()
+                categories = None
+
+            shm = SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype=values.dtype, buffer=shm.buf)[:] = values
+            self.blocks.append(shm)
+            self.spec["columns"].append((name, shm.name, values.dtype.str, categories))
+
+    def close(self) -> None:
+        for shm in self.blocks:
+            shm.close()
+            if os.getpid() == self.owner_pid:
+                shm.unlink()
+        self.blocks = []
+
+
+def attach_dataset(spec: Dict[str, Any]) -> Tuple["pd.DataFrame", List[SharedMemory]]:
+    """Builds a DataFrame whose columns are views over the shared memory blocks."""
+    import numpy as np
+    import pandas as pd
+
+    blocks, columns = [], {}
+    for name, shm_name, dtype, categories in spec["columns"]:
+        # Воркеры делят resource_tracker с родителем, так что блоки переживут их выход
+        shm = SharedMemory(name=shm_name)
+        blocks.append(shm)
+        values = np.ndarray((spec["length"],), dtype=np.dtype(dtype), buffer=shm.buf)
+        if categories is not None:
+            columns[name] = pd.Categorical.from_codes(values, categories=categories)
+        else:
+            columns[name] = values
+    return pd.DataFrame(columns, copy=False), blocks
+
+
+def _init_worker(spec: Dict[str, Any]) -> None:
+    global _worker_blocks
+    df, _worker_blocks = attach_dataset(spec)
+    install_transactions(df)
+
+
+def _call(fn: Callable, args: tuple):
+    # HTTPException не переживает pickle, поэтому передаём статус и detail отдельно
+    try:
+        return True, fn(*args)
+    except HTTPException as e:
+        return False, (e.status_code, e.detail)
+
+
+def publish_dataset() -> SharedDataset:
+    """Copies the dataset into shared memory once per process tree.
+
+    server.py calls this in the parent before forking, so every uvicorn worker
+    (and every analytics pool under it) attaches to the same blocks.
+    """
+    global _shared
+    if _shared is None:
+        _shared = SharedDataset(load_transactions())
+    return _shared
+
+
+def start_analytics_pool(workers: int = ANALYTICS_WORKERS) -> None:
+    global _pool, _pool_size
+    if workers <= 0 or _pool is not None:
+        return
+    shared = publish_dataset()
+    _pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(shared.spec,),
+    )
+    _pool_size = workers
+
+
+def shutdown_analytics_pool() -> None:
+    global _pool, _pool_size, _shared
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool, _pool_size = None, 0
+    if _shared is not None and _shared.owner_pid == os.getpid():
+        _shared.close()
+        _shared = None
+
+
+async def run_analytics(fn: Callable, *args) -> Any:
+    """
+    Runs `fn(*args)` in the process pool, or in the thread pool if it's disabled.
+    Concurrent calls with the same function and arguments share one computation.
+    """
+    if is_profiled():
+        # Профайлер видит только потоки этого процесса — считаем здесь и без чужого single-flight
+        return await run_in_threadpool(fn, *args)
+    key = (fn.__module__, fn.__qualname__, args)
+    try:
+        hash(key)
+    except TypeError:
+        return await _run(fn, *args)
+    return await _analytics_flight.do(key, _run, fn, *args)
+
+
+async def _run(fn: Callable, *args) -> Any:
+    if _pool is None:
+        return await run_in_threadpool(fn, *args)
+
+    _stats["in_flight"] += 1
+    try:
+        ok, result = await asyncio.wrap_future(_pool.submit(_call, fn, args))
+    except Exception:
+        _stats["failed"] += 1
+        raise
+    else:
+        _stats["completed"] += 1
+    finally:
+        _stats["in_flight"] -= 1
+
+    if not ok:
+        status_code, detail = result
+        raise HTTPException(status_code=status_code, detail=detail)
+    return result
+
+
+def pool_metrics() -> Dict[str, Any]:
+    return {
+        "workers": _pool_size,
+        "in_flight": _stats["in_flight"],
+        "queue_depth": max(0, _stats["in_flight"] - _pool_size),
+        "completed": _stats["completed"],
+        "failed": _stats["failed"],
+    }
+
+
+register_metrics("analytics_pool", pool_metrics)
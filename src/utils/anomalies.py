@@ -0,0 +1,219 @@
+"""
+Online spending-anomaly detection with constant memory per user.
+
+For every (user, category) the store keeps running statistics of transaction
+amounts in flat numpy arrays: count, Welford mean and M2 (for the variance)
+and an EWMA of the "usual" amount. A new transaction is checked against the
+statistics *before* it and then folded in, both O(1). It is flagged when it
+is ANOMALY_Z standard deviations above the mean and at least ANOMALY_RATIO
+times the EWMA, e.g. «траты на «Такси» в 3 раза выше обычного».
+
+The store is initialised from the transaction dataset in one vectorised pass
+(cumulative sums per group give each transaction's prior statistics), which
+also yields the anomalies already present in the history. Flagged items are
+kept per user in a bounded deque (ANOMALY_KEEP).
+"""
+import os
+from collections import deque
+from datetime import date
+from typing import Any, Deque, Dict, List, Optional
+
+from fastapi import HTTPException
+
+from src.utils.transactions import CATEGORIES, load_transactions
+
+ANOMALY_Z = float(os.getenv("ANOMALY_Z", "3"))
+ANOMALY_RATIO = float(os.getenv("ANOMALY_RATIO", "2"))
+# Пока трат в категории меньше — «обычного» ещё нет, ничего не отмечаем
+ANOMALY_MIN_COUNT = int(os.getenv("ANOMALY_MIN_COUNT", "5"))
+ANOMALY_EWMA_ALPHA = float(os.getenv("ANOMALY_EWMA_ALPHA", "0.2"))
+ANOMALY_KEEP = int(os.getenv("ANOMALY_KEEP", "50"))
+
+_CATEGORY_INDEX = {c: i for i, c in enumerate(CATEGORIES)}
+
+_store: Optional["AnomalyStore"] = None
+
+
+class AnomalyStore:
+    """Running per-(user, category) statistics in (users x categories) arrays."""
+
+    def __init__(self, capacity: int = 64):
+        import numpy as np
+
+        shape = (capacity, len(CATEGORIES))
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.ewma = np.zeros(shape)
+        self.rows: Dict[int, int] = {}
+        self.flagged: Dict[int, Deque[Dict[str, Any]]] = {}
+
+    def _row(self, user_id: int) -> int:
+        import numpy as np
+
+        row = self.rows.get(user_id)
+        if row is None:
+            row = self.rows[user_id] = len(self.rows)
+            if row >= self.count.shape[0]:
+                # Растим массивы вдвое — амортизированно O(1) на нового пользователя
+                for name in ("count", "mean", "m2", "ewma"):
+                    array = getattr(self, name)
+                    setattr(self, name, np.concatenate([array, np.zeros_like(array)]))
+        return row
+
+    def observe(self, user_id: int, category: str, amount: float, day: date) -> Optional[Dict[str, Any]]:
+        """Checks one incoming transaction against the user's usual spend, then folds it in."""
+        col = _CATEGORY_INDEX.get(category)
+        if col is None:
+            return None
+        row = self._row(user_id)
+        n, mean, ewma = int(self.count[row, col]), float(self.mean[row, col]), float(self.ewma[row, col])
+
+        anomaly = None
+        if n >= ANOMALY_MIN_COUNT:
+            std = (self.m2[row, col] / (n - 1)) ** 0.5
+            if _is_anomaly(amount, mean, std, ewma):
+                anomaly = _flag(self, user_id, category, amount, day, ewma, (amount - mean) / std)
+
+        # Welford
+        n += 1
+        delta = amount - mean
+        mean += delta / n
+        self.count[row, col] = n
+        self.mean[row, col] = mean
+        self.m2[row, col] += delta * (amount - mean)
+        self.ewma[row, col] = amount if n == 1 else ewma + ANOMALY_EWMA_ALPHA * (amount - ewma)
+        return anomaly
+
+    def anomalies(self, user_id: int, start: Optional[date] = None, end: Optional[date] = None) -> List[Dict[str, Any]]:
+        """Flagged transactions of the user in [start, end], newest first."""
+        items = self.flagged.get(user_id, ())
+        return [
+            a for a in reversed(items)
+            if (start is None or a["date"] >= start.isoformat()) and (end is None or a["date"] <= end.isoformat())
+        ]
+
+    def usual(self, user_id: int) -> Dict[str, Dict[str, float]]:
+        """Current running statistics of the user per category."""
+        row = self.rows.get(user_id)
+        if row is None:
+            return {}
+        stats = {}
+        for category, col in _CATEGORY_INDEX.items():
+            n = int(self.count[row, col])
+            if n:
+                std = (self.m2[row, col] / (n - 1)) ** 0.5 if n > 1 else 0.0
+                stats[category] = {"count": n, "mean": round(float(self.mean[row, col])),
+                                   "std": round(float(std)), "ewma": round(float(self.ewma[row, col]))}
+        return stats
+
+
+def _is_anomaly(amount: float, mean: float, std: float, ewma: float) -> bool:
+    return std > 0 and amount >= mean + ANOMALY_Z * std and amount >= ANOMALY_RATIO * ewma
+
+
+def _flag(store: AnomalyStore, user_id: int, category: str, amount: float, day: date,
+          ewma: float, z: float) -> Dict[str, Any]:
+    anomaly = {
+        "date": day.isoformat(),
+        "category": category,
+        "amount": int(amount),
+        "usual": int(round(ewma)),
+        "ratio": round(amount / ewma, 1),
+        "z": round(float(z), 1),
+    }
+    store.flagged.setdefault(user_id, deque(maxlen=ANOMALY_KEEP)).append(anomaly)
+    return anomaly
+
+
+def _build() -> AnomalyStore:
+    import numpy as np
+
+    df = load_transactions()
+    df = df[df["category"].isin(CATEGORIES)].dropna(subset=["date"])
+    df = df.sort_values(["id", "category", "date"], kind="stable")
+    keys = [df["id"], df["category"]]
+    x = df["amount"].astype(float)
+
+    # Статистика до каждой транзакции: накопленные суммы группы минус сама транзакция
+    n_prev = df.groupby(keys, observed=True).cumcount().to_numpy()
+    s_prev = (x.groupby(keys, observed=True).cumsum() - x).to_numpy()
+    sq_prev = ((x * x).groupby(keys, observed=True).cumsum() - x * x).to_numpy()
+    ewma = (
+        x.groupby(keys, observed=True).ewm(alpha=ANOMALY_EWMA_ALPHA, adjust=False).mean()
+        .reset_index(level=[0, 1], drop=True).reindex(x.index)
+    )
+    ewma_prev = ewma.groupby(keys, observed=True).shift(1).to_numpy()
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_prev = s_prev / n_prev
+        std_prev = np.sqrt(np.maximum(sq_prev - n_prev * mean_prev ** 2, 0) / (n_prev - 1))
+        amounts = x.to_numpy()
+        flags = (
+            (n_prev >= ANOMALY_MIN_COUNT) & (std_prev > 0)
+            & (amounts >= mean_prev + ANOMALY_Z * std_prev) & (amounts >= ANOMALY_RATIO * ewma_prev)
+        )
+
+    user_ids = df["id"].unique()
+    store = AnomalyStore(capacity=max(64, len(user_ids)))
+    for user_id in user_ids:
+        store._row(int(user_id))
+
+    # Итоговое состояние групп (то же, что дал бы Welford по всем транзакциям)
+    grouped = x.groupby(keys, observed=True)
+    final = grouped.agg(["count", "mean"]).assign(
+        m2=grouped.var(ddof=0) * grouped.count(),
+        ewma=ewma.groupby(keys, observed=True).last(),
+    )
+    rows = np.array([store.rows[int(u)] for u in final.index.get_level_values(0)])
+    cols = np.array([_CATEGORY_INDEX[c] for c in final.index.get_level_values(1)])
+    store.count[rows, cols] = final["count"].to_numpy()
+    store.mean[rows, cols] = final["mean"].to_numpy()
+    store.m2[rows, cols] = final["m2"].to_numpy()
+    store.ewma[rows, cols] = final["ewma"].to_numpy()
+
+    flagged = (
+        df.loc[flags, ["id", "category", "amount", "date"]]
+        .assign(usual=ewma_prev[flags], z=((amounts - mean_prev) / std_prev)[flags])
+        .sort_values("date", kind="stable")
+    )
+    for row in flagged.itertuples(index=False):
+        _flag(store, int(row.id), row.category, row.amount, row.date.date(), row.usual, row.z)
+    return store
+
+
+def get_anomaly_store() -> AnomalyStore:
+    global _store
+    if _store is None:
+        _store = _build()
+    return _store
+
+
+def user_anomalies(user_id: int, start: Optional[str] = None, end: Optional[str] = None) -> Dict[str, Any]:
+    """Flagged transactions of the user (YYYY-MM-DD bounds) and the usual spend per category."""
+    try:
+        bounds = [date.fromisoformat(d) if d else None for d in (start, end)]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный формат даты. Используй YYYY-MM-DD")
+
+    store = get_anomaly_store()
+    return {
+        "user_id": user_id,
+        "thresholds": {"z": ANOMALY_Z, "ratio": ANOMALY_RATIO, "min_count": ANOMALY_MIN_COUNT},
+        "anomalies": store.anomalies(user_id, *bounds),
+        "usual": store.usual(user_id),
+    }
+
+
+def anomaly_insights(user_id: int, start: date, end: date, limit: int = 1) -> List[str]:
+    """Insight lines about the most unusual transactions of the period, for analytics."""
+    found = sorted(get_anomaly_store().anomalies(user_id, start, end), key=lambda a: -a["ratio"])[:limit]
+    return [
+        f"Трата на «{a['category']}» {date.fromisoformat(a['date']).strftime('%d.%m.%Y')} — "
+        f"{_kzt(a['amount'])}, в {a['ratio']} раза выше обычного ({_kzt(a['usual'])})."
+        for a in found
+    ]
+
+
+def _kzt(amount: int) -> str:
+    return f"{amount:,} ₸".replace(",", " ")
@@ -0,0 +1,134 @@
+"""
+Answer cache for generic product questions in the chat.
+
+Questions like «что такое Вакала» or «условия исламской ипотеки» don't depend
+on the user: the answer is determined by products.txt, assistant_prompt.txt
+and the user's segment. Such questions are recognised (no personal markers,
+and the local product index finds matching cards), matched against earlier
+ones by Jaccard similarity of their stemmed words and answered from an LRU.
+A miss is answered by a chat completion that sees only the assistant prompt,
+the product cards and the question — never the user's thread with the
+profile — so nothing personal can end up in a shared answer.
+Entries are keyed by a hash of the catalog and prompt, re-read whenever the
+size or mtime of either file changes, so editing them invalidates the cache
+without a restart. The cache is per process.
+"""
+import hashlib
+import os
+import re
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from src.utils.metrics import register_metrics
+from src.utils.product_index import PRODUCTS_PATH, tokenize
+
+PROMPT_PATH = "assistant_prompt.txt"
+ANSWER_MODEL = os.getenv("ANSWER_MODEL", "gpt-4o")
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.8"))
+
+# Вопрос про себя («я», «мне», «мои траты») кэшировать нельзя — ответ зависит от клиента
+_PERSONAL_RE = re.compile(
+    r"\b(я|мне|меня|мной|мой|моя|мое|мои|моего|моей|моих|моим|нам|наш\w*)\b"
+    r"|потрат|трач|расход|доход(?!н)|зарплат|баланс|остат"
+)
+# Слова, которые не меняют смысл вопроса
+_STOP_STEMS = frozenset(tokenize("что такое какие какой какая как про расскажи подскажи это у в на и или а же ли"))
+
+_entries: "OrderedDict[Tuple[str, Optional[int], FrozenSet[str]], str]" = OrderedDict()
+# (размер, mtime) файлов -> (хэш, текст промпта)
+_content: Optional[Tuple[Tuple[Tuple[int, int], ...], str, str]] = None
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+
+def _load_content() -> Tuple[str, str]:
+    """(hash, prompt text) of the catalog and the assistant prompt; re-read only when a file changed."""
+    global _content
+    signature = tuple((st.st_size, st.st_mtime_ns) for st in map(os.stat, (PRODUCTS_PATH, PROMPT_PATH)))
+    if _content is None or _content[0] != signature:
+        with open(PRODUCTS_PATH, "rb") as f:
+            catalog = f.read()
+        with open(PROMPT_PATH, "rb") as f:
+            prompt = f.read()
+        digest = hashlib.sha1(catalog + prompt).hexdigest()[:12]
+        _content = signature, digest, prompt.decode("utf-8")
+    return _content[1], _content[2]
+
+
+def content_hash() -> str:
+    """Hash of the catalog and the assistant prompt the cached answers were produced from."""
+    return _load_content()[0]
+
+
+def answer_messages(question: str, product_context: str) -> List[Dict[str, str]]:
+    """Chat completion messages for a cacheable question: prompt, product cards and the question only."""
+    return [
+        {"role": "system", "content": f"{_load_content()[1]}\n\n{product_context}"},
+        {"role": "user", "content": question},
+    ]
+
+
+def normalize(question: str) -> FrozenSet[str]:
+    return frozenset(tokenize(question)) - _STOP_STEMS
+
+
+def is_cacheable(question: str, product_context: Optional[str]) -> bool:
+    """
+    Generic product question: nothing personal in it and the catalog has cards for it
+    (`product_context` — what get_product_index().context_for() found for the question).
+    lookup() and store() trust this check, the caller makes it once per message.
+    """
+    text = question.lower().replace("ё", "е")
+    if not text or len(text) > 300 or _PERSONAL_RE.search(text):
+        return False
+    return product_context is not None
+
+
+def _similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def lookup(question: str, segment: Optional[int]) -> Optional[str]:
+    """Cached answer to a cacheable question (or a close enough one), None on a miss."""
+    version, terms = content_hash(), normalize(question)
+    key = (version, segment, terms)
+    if key not in _entries:
+        best, best_score = None, ANSWER_CACHE_SIMILARITY
+        for candidate in _entries:
+            if candidate[0] == version and candidate[1] == segment:
+                score = _similarity(terms, candidate[2])
+                if score >= best_score:
+                    best, best_score = candidate, score
+        key = best
+
+    if key is None:
+        _stats["misses"] += 1
+        return None
+    _stats["hits"] += 1
+    _entries.move_to_end(key)
+    return _entries[key]
+
+
+def store(question: str, segment: Optional[int], answer: str) -> None:
+    if not answer.strip():
+        return
+    key = (content_hash(), segment, normalize(question))
+    _entries[key] = answer
+    _entries.move_to_end(key)
+    _stats["stores"] += 1
+    while len(_entries) > ANSWER_CACHE_SIZE:
+        _entries.popitem(last=False)
+        _stats["evictions"] += 1
+
+
+def cache_metrics() -> Dict[str, Any]:
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        "size": len(_entries),
+        "capacity": ANSWER_CACHE_SIZE,
+        **_stats,
+        "hit_rate": round(_stats["hits"] / lookups, 3) if lookups else 0.0,
+    }
+
+
+register_metrics("answer_cache", cache_metrics)
@@ -0,0 +1,186 @@
+"""
+Function tools of the assistant, served locally from the transaction store.
+
+The assistant asks for the data it needs (summary, category breakdown,
+recommendations, raw transactions, goal plans) and chat_websocket answers
+through the tool-output submission flow, so neither the transaction file
+upload nor a code_interpreter sandbox is needed.
+"""
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from fastapi import HTTPException
+
+from src.utils.transactions import CATEGORIES, load_transactions
+
+# Сколько строк максимум отдаём модели за один вызов get_transactions
+MAX_TOOL_TRANSACTIONS = 200
+
+_END_DATE = {
+    "type": "string",
+    "description": "Конец периода, YYYY-MM-DD. По умолчанию — сегодня.",
+}
+
+ASSISTANT_TOOLS: List[Dict[str, Any]] = [
+    {
+        "type": "function",
+        "function": {
+            "name": "get_spending_summary",
+            "description": "Сводка клиента за 3 месяца: зарплата, сумма трат, остаток и траты по всем категориям.",
+            "parameters": {
+                "type": "object",
+                "properties": {"end_date": _END_DATE},
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_category_breakdown",
+            "description": "Траты клиента по категориям (сумма и доля) за произвольное число дней до end_date.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "days": {"type": "integer", "description": "Длина периода в днях, по умолчанию 30."},
+                    "end_date": _END_DATE,
+                },
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_recommendations",
+            "description": "Финансовый профиль клиента, подходящие продукты банка, интересные факты и персональный совет.",
+            "parameters": {
+                "type": "object",
+                "properties": {"end_date": _END_DATE},
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_transactions",
+            "description": (
+                f"Транзакции клиента за период (не больше {MAX_TOOL_TRANSACTIONS} последних), "
+                "опционально только одной категории."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "start_date": {"type": "string", "description": "Начало периода, YYYY-MM-DD."},
+                    "end_date": {"type": "string", "description": "Конец периода, YYYY-MM-DD."},
+                    "category": {"type": "string", "enum": CATEGORIES},
+                },
+                "required": ["start_date", "end_date"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "plan_goal",
+            "description": (
+                "План накопления на цель (жильё, хадж, образование...): вероятность собрать сумму к каждому "
+                "месяцу с продуктами банка и без вложений. Взнос по умолчанию — свободный остаток клиента."
+            ),
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "target_amount": {"type": "integer", "description": "Стоимость цели, ₸."},
+                    "months": {"type": "integer", "description": "Желаемый срок в месяцах, если клиент его назвал."},
+                    "monthly_contribution": {"type": "integer", "description": "Взнос в месяц, если клиент его назвал."},
+                    "initial_amount": {"type": "integer", "description": "Уже накоплено, ₸."},
+                },
+                "required": ["target_amount"],
+            },
+        },
+    },
+]
+
+
+def get_category_breakdown(user_id: int, days: int = 30, end_date: str = None) -> Dict[str, Any]:
+    from src.utils import analytics
+
+    period, d0, d1 = analytics.user_period(user_id, end_date, days=max(1, min(int(days), 365)))
+    grouped = analytics.category_totals(period)
+    total = int(grouped.sum())
+    return {
+        "period": {"start_date": d0.isoformat(), "end_date": d1.isoformat()},
+        "total_spent": total,
+        "categories": [
+            {"category": cat, "amount": int(amount), "share": round(int(amount) / total, 4) if total else 0.0}
+            for cat, amount in grouped.items() if amount
+        ],
+    }
+
+
+def get_recommendations(user_id: int, type_id: int, end_date: str = None) -> Dict[str, Any]:
+    from src.utils import analytics, analytics_SME
+
+    module = analytics_SME if type_id == 2 else analytics
+    result = module.user_analytics(user_id, end_date)
+    return {key: result[key] for key in ("profile", "recommendations", "insights", "advice")}
+
+
+def get_transactions(user_id: int, start_date: str, end_date: str, category: str = None) -> Dict[str, Any]:
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)
+
+    df = load_transactions()
+    rows = df[(df["id"] == user_id) & (df["date"] >= start) & (df["date"] < end)]
+    if category:
+        rows = rows[rows["category"] == category]
+    rows = rows.sort_values("date")
+
+    latest = rows.tail(MAX_TOOL_TRANSACTIONS)
+    return {
+        "count": int(rows.shape[0]),
+        "total_amount": int(rows["amount"].sum()),
+        "truncated": rows.shape[0] > MAX_TOOL_TRANSACTIONS,
+        "transactions": [
+            {"date": d.strftime("%Y-%m-%d"), "category": c, "amount": int(a), "status": s}
+            for d, c, a, s in zip(latest["date"], latest["category"], latest["amount"], latest["status"])
+        ],
+    }
+
+
+def plan_goal(user_id: int, type_id: int, args: Dict[str, Any]) -> Dict[str, Any]:
+    from src.utils import goals
+
+    plan = goals.plan_goal(
+        user_id, type_id, args["target_amount"], args.get("months"),
+        args.get("monthly_contribution"), args.get("initial_amount", 0),
+    )
+    # Модели хватит итогов: полные кривые нужны только графикам
+    for option in plan["options"]:
+        option.pop("curve")
+    return plan
+
+
+def call_tool(user_id: int, type_id: int, name: str, arguments: str) -> str:
+    """Runs one tool call of the assistant; returns the JSON string for submit_tool_outputs."""
+    # Аналитика (pandas) нужна только при вызове, а не при импорте схемы инструментов
+    from src.utils import analytics
+
+    try:
+        args = json.loads(arguments or "{}")
+        if name == "get_spending_summary":
+            result = analytics.spending_summary_3m(user_id, args.get("end_date"))
+        elif name == "get_category_breakdown":
+            result = get_category_breakdown(user_id, args.get("days", 30), args.get("end_date"))
+        elif name == "get_recommendations":
+            result = get_recommendations(user_id, type_id, args.get("end_date"))
+        elif name == "get_transactions":
+            result = get_transactions(user_id, args["start_date"], args["end_date"], args.get("category"))
+        elif name == "plan_goal":
+            result = plan_goal(user_id, type_id, args)
+        else:
+            result = {"error": f"Неизвестная функция {name}"}
+    except HTTPException as e:
+        result = {"error": e.detail}
+    except (ValueError, KeyError, TypeError) as e:
+        result = {"error": f"Некорректные аргументы: {e}"}
+    return json.dumps(result, ensure_ascii=False)
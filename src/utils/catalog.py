@@ -0,0 +1,247 @@
+"""
+Product catalog: products.csv -> products_table and an in-memory eligibility index.
+
+products.csv is the one source of product terms: the recommendation code
+(analytics / analytics_SME), the goal planner and GET /products/eligible all
+read it through get_catalog() at call time; on startup the rows are written
+to products_table. Text ranges ("от 300 тенге", "не ограничена", "30 дней")
+are parsed into numbers. get_catalog() re-reads the file when its size or
+mtime changes, so edits reach every process — analytics pool workers
+included — without a restart; /load/products also refreshes products_table.
+
+Eligibility is an interval lookup per parameter. For the sum, the term and
+the client age the endpoints of all product ranges split the axis into
+elementary segments, and every segment stores the bitmask of the products
+whose range covers it. A query is a bisect per given parameter and an AND of
+the masks; the product list of each resulting mask is built once and reused,
+so a lookup takes microseconds and does not grow with the number of queries.
+
+A product without a sum (or term) range does not take that parameter and
+never matches a query for it; a product without age limits fits any age.
+"""
+import csv
+import math
+import os
+import re
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.utils.product_index import SEGMENT_BUSINESS, SEGMENT_PERSONAL
+
+CATALOG_PATH = os.getenv("CATALOG_PATH", "products.csv")
+
+_SEGMENTS = {"физлица": SEGMENT_PERSONAL, "бизнес": SEGMENT_BUSINESS}
+_NUMBER_RE = re.compile(r"\d[\d\s]*")
+# Месяц срока в днях — для продуктов со сроком в днях (овердрафт)
+DAYS_PER_MONTH = 30
+
+Interval = Optional[Tuple[float, float]]
+
+
+def parse_number(text: str) -> Optional[int]:
+    """First number in a cell ("от 6 000 тенге" -> 6000); None if there is none ("не ограничена", "")."""
+    match = _NUMBER_RE.search(text or "")
+    return int(re.sub(r"\s", "", match.group())) if match else None
+
+
+def parse_term(text: str) -> Tuple[Optional[int], Optional[int]]:
+    """(months, days) of a term cell: "12 месяцев" -> (12, None), "30 дней" -> (None, 30)."""
+    value = parse_number(text)
+    if value is None:
+        return None, None
+    if "дн" in text or "день" in text:
+        return None, value
+    return value, None
+
+
+def parse_row(row: Dict[str, str]) -> Dict[str, Any]:
+    min_term_m, min_term_d = parse_term(row["Минимальный срок"])
+    max_term_m, max_term_d = parse_term(row["Максимальный срок"])
+    return {
+        "code": row["Код"].strip(),
+        "segment": _SEGMENTS[row["Сегмент"].strip().lower()],
+        "name": row["Название продукта"].strip(),
+        "type": row["Тип продукта"].strip(),
+        "markup_from": parse_number(row["Размер наценки"]),
+        "expected_yield": row["Ожидаемая доходность"].strip() or None,
+        "min_sum": parse_number(row["Минимальная сумма"]),
+        "max_sum": parse_number(row["Максимальная сумма"]),
+        "min_term_m": min_term_m, "max_term_m": max_term_m,
+        "min_term_d": min_term_d, "max_term_d": max_term_d,
+        "min_age": parse_number(row["Минимальный возраст"]),
+        "max_age": parse_number(row["Максимальный возраст"]),
+    }
+
+
+def load_products(path: str = CATALOG_PATH) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        return [parse_row(row) for row in csv.DictReader(f) if row.get("Код")]
+
+
+def _range(low: Optional[float], high: Optional[float], required: bool) -> Interval:
+    """Closed interval of a product parameter; None if the product does not take it."""
+    if low is None and high is None:
+        return None if required else (-math.inf, math.inf)
+    return (0 if low is None else low), (math.inf if high is None else high)
+
+
+def _term_months(months: Optional[int], days: Optional[int]) -> Optional[float]:
+    return months if days is None else math.ceil(days / DAYS_PER_MONTH)
+
+
+class IntervalIndex:
+    """Bitmask of the intervals containing a value, by bisect over the interval endpoints."""
+
+    def __init__(self, intervals: List[Interval]):
+        self.keys = sorted({b for interval in intervals if interval for b in interval if math.isfinite(b)})
+        # Отрезки оси: 2j — между keys[j-1] и keys[j], 2j+1 — ровно keys[j]
+        points = []
+        for j in range(len(self.keys) + 1):
+            low = self.keys[j - 1] if j else None
+            high = self.keys[j] if j < len(self.keys) else None
+            if low is None and high is None:
+                points.append(0.0)
+            elif low is None:
+                points.append(high - 1)
+            elif high is None:
+                points.append(low + 1)
+            else:
+                points.append((low + high) / 2)
+            if high is not None:
+                points.append(high)
+        self.masks = [
+            sum(1 << i for i, interval in enumerate(intervals) if interval and interval[0] <= x <= interval[1])
+            for x in points
+        ]
+
+    def lookup(self, value: float) -> int:
+        j = bisect_left(self.keys, value)
+        exact = j < len(self.keys) and self.keys[j] == value
+        return self.masks[2 * j + 1 if exact else 2 * j]
+
+
+class Catalog:
+    """Products of products.csv with eligibility lookup by sum, term, age and segment."""
+
+    def __init__(self, products: List[Dict[str, Any]], signature: Optional[Tuple[int, int]] = None):
+        # (размер, mtime) файла, из которого прочитан каталог
+        self.signature = signature
+        self.products = products
+        self.by_code = {p["code"]: p for p in products}
+        self.positions = {p["code"]: i for i, p in enumerate(products)}
+        self.everything = (1 << len(products)) - 1
+        self.amount = IntervalIndex([_range(p["min_sum"], p["max_sum"], True) for p in products])
+        self.term = IntervalIndex([
+            _range(_term_months(p["min_term_m"], p["min_term_d"]),
+                   _term_months(p["max_term_m"], p["max_term_d"]), True)
+            for p in products
+        ])
+        self.age = IntervalIndex([_range(p["min_age"], p["max_age"], False) for p in products])
+        self.segments: Dict[int, int] = {}
+        for i, p in enumerate(products):
+            self.segments[p["segment"]] = self.segments.get(p["segment"], 0) | 1 << i
+        self._answers: Dict[int, List[Dict[str, Any]]] = {}
+
+    def mask(self, amount: Optional[float] = None, term_m: Optional[float] = None,
+             age: Optional[float] = None, segment: Optional[int] = None) -> int:
+        mask = self.everything
+        if amount is not None:
+            mask &= self.amount.lookup(amount)
+        if term_m is not None:
+            mask &= self.term.lookup(term_m)
+        if age is not None:
+            mask &= self.age.lookup(age)
+        if segment is not None:
+            mask &= self.segments.get(segment, 0)
+        return mask
+
+    def eligible(self, **params) -> List[Dict[str, Any]]:
+        """Products whose terms admit the given parameters (see mask()) — copies, the catalog stays intact."""
+        mask = self.mask(**params)
+        answer = self._answers.get(mask)
+        if answer is None:
+            answer = self._answers[mask] = [p for i, p in enumerate(self.products) if mask >> i & 1]
+        return [dict(p) for p in answer]
+
+    def is_eligible(self, code: str, **params) -> bool:
+        return bool(self.mask(**params) >> self.positions[code] & 1)
+
+    def segment_products(self, segment: int) -> Dict[str, Dict[str, Any]]:
+        """{code: terms} of a segment — copies, callers may add their own fields."""
+        return {p["code"]: dict(p) for p in self.products if p["segment"] == segment}
+
+
+_catalog: Optional[Catalog] = None
+
+
+def _signature(path: str = CATALOG_PATH) -> Tuple[int, int]:
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def get_catalog() -> Catalog:
+    """The catalog of products.csv; re-read if the file changed since the last call."""
+    if _catalog is None or _catalog.signature != _signature():
+        return reload_catalog()
+    return _catalog
+
+
+def reload_catalog() -> Catalog:
+    """Re-reads products.csv unconditionally."""
+    global _catalog
+    signature = _signature()
+    _catalog = Catalog(load_products(), signature)
+    return _catalog
+
+
+def drop_stale_products_table(engine) -> None:
+    """
+    Drops products_table if its columns differ from the model (databases created
+    before the catalog); it only holds catalog rows and is refilled by store_catalog.
+    A table already dropped by a process starting alongside is not an error.
+    """
+    from sqlalchemy import inspect
+    from sqlalchemy.exc import OperationalError
+
+    from src.models.products import products_table
+
+    inspector = inspect(engine)
+    if not inspector.has_table(products_table.name):
+        return
+    columns = {c["name"] for c in inspector.get_columns(products_table.name)}
+    if columns != set(products_table.columns.keys()):
+        try:
+            products_table.drop(bind=engine, checkfirst=True)
+        except OperationalError:
+            # Параллельный старт другого процесса успел удалить таблицу раньше
+            pass
+
+
+def _table_rows(catalog: Catalog) -> List[Dict[str, Any]]:
+    return [
+        {**{k: v for k, v in p.items() if k != "type"}, "id": i + 1, "category": p["type"]}
+        for i, p in enumerate(catalog.products)
+    ]
+
+
+def write_catalog(engine, catalog: Optional[Catalog] = None) -> int:
+    """store_catalog() through a synchronous engine — for startup, before the event loop serves requests."""
+    from src.models.products import products_table
+
+    catalog = catalog or get_catalog()
+    with engine.begin() as conn:
+        conn.execute(products_table.delete())
+        conn.execute(products_table.insert(), _table_rows(catalog))
+    return len(catalog.products)
+
+
+async def store_catalog(catalog: Optional[Catalog] = None) -> int:
+    """Replaces the rows of products_table with the catalog; returns the number of products."""
+    from src.models.products import products_table
+    from src.utils.db import database
+
+    catalog = catalog or get_catalog()
+    async with database.transaction():
+        await database.execute(products_table.delete())
+        await database.execute_many(products_table.insert(), _table_rows(catalog))
+    return len(catalog.products)
@@ -0,0 +1,150 @@
+"""
+Provisioning and caching of users' assistant threads.
+
+Creating a thread (seed messages, profile, DB update) or checking an existing
+one takes several upstream calls, so it runs as a background task started at
+login or on websocket connect; the chat keeps accepting messages meanwhile and
+awaits the thread only when it needs it. Ready threads are cached per process,
+so a returning user's connect costs no upstream call at all.
+
+The profile can only change when the transaction dataset is reloaded, i.e.
+after a restart, when this cache is cold anyway, so the profile refresh is
+part of provisioning.
+"""
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import select, update
+
+from src.models.user import users_table
+from src.utils import resilience
+from src.utils.analytics_pool import run_analytics
+from src.utils.db import database
+from src.utils.openai_client import get_async_client
+from src.utils.run_scheduler import run_scheduler
+from src.utils.singleflight import SingleFlight
+
+THREAD_HANDLE_CACHE = int(os.getenv("THREAD_HANDLE_CACHE", "10000"))
+
+_handles: "OrderedDict[int, Any]" = OrderedDict()
+_provisioning = SingleFlight("thread_provisioning")
+
+
+async def thread_seed(user_id: int, type_id: Optional[int]) -> Tuple[list, dict]:
+    """Messages and metadata a fresh thread of the user starts with: segment and profile."""
+    type_message = ''
+
+    if type_id == 1:
+        type_message = '[RINAT] Этот пользователь - физическое лицо. Ему нужно предлагать только продукты для физических лиц.'
+    elif type_id == 2:
+        type_message = '[RINAT] Этот пользователь - юридическое лицо. Ему нужно предлагать только продукты для юридических лиц.'
+
+    from src.utils.profile import build_profile
+
+    messages = [{'role': 'user', 'content': type_message}] if type_message else []
+    metadata = {}
+    built = await run_analytics(build_profile, user_id, type_id)
+    if built:
+        version, profile_text = built
+        messages.append({'role': 'user', 'content': profile_text})
+        metadata['profile_version'] = version
+    return messages, metadata
+
+
+async def _refresh_profile(thread: Any, user_id: int, type_id: Optional[int]) -> Any:
+    """Posts a new profile if the user's data changed since the last one."""
+    # profile тянет за собой pandas — импортируем при первой подготовке треда
+    from src.utils.profile import build_profile, profile_version
+
+    known_version = (thread.metadata or {}).get("profile_version")
+    if known_version == await run_analytics(profile_version, user_id, type_id):
+        return thread
+    built = await run_analytics(build_profile, user_id, type_id)
+    if not built:
+        return thread
+
+    version, profile_text = built
+    async with run_scheduler.thread(thread.id, user_id):
+        await resilience.call(
+            get_async_client().beta.threads.messages.create,
+            thread_id=thread.id, role="user", content=profile_text, idempotent=False,
+        )
+        return await resilience.call(
+            get_async_client().beta.threads.update, thread.id,
+            metadata={**(thread.metadata or {}), "profile_version": version},
+        )
+
+
+async def _provision(user: Dict[str, Any]) -> Any:
+    user_id, type_id = user["id"], user.get("type_id")
+    if user.get("thread_id"):
+        thread = await resilience.call(get_async_client().beta.threads.retrieve, user["thread_id"])
+        thread = await _refresh_profile(thread, user_id, type_id)
+    else:
+        messages, metadata = await thread_seed(user_id, type_id)
+        thread_options = {'metadata': metadata} if metadata else {}
+
+        thread = await resilience.call(
+            get_async_client().beta.threads.create, messages=messages, idempotent=False, **thread_options,
+        )
+        # Пишем, только если тред ещё никто не записал: вкладка в другом воркере могла
+        # успеть раньше — тогда берём её тред, а свой удаляем
+        await database.execute(
+            update(users_table)
+            .where(users_table.c.id == user_id, users_table.c.thread_id.is_(None))
+            .values(thread_id=thread.id, transactions_file_id=None)
+        )
+        winner = await database.fetch_val(
+            select(users_table.c.thread_id).where(users_table.c.id == user_id)
+        )
+        if winner != thread.id:
+            try:
+                await resilience.call(get_async_client().beta.threads.delete, thread.id)
+            except Exception:
+                # Пустой лишний тред никому не мешает
+                pass
+            thread = await resilience.call(get_async_client().beta.threads.retrieve, winner)
+    remember_thread(user_id, thread)
+    return thread
+
+
+def cached_thread(user: Dict[str, Any]) -> Optional[Any]:
+    thread = _handles.get(user["id"])
+    # Тред мог смениться в другом процессе (сжатие) — верим БД
+    if thread is None or (user.get("thread_id") and thread.id != user["thread_id"]):
+        return None
+    _handles.move_to_end(user["id"])
+    return thread
+
+
+def remember_thread(user_id: int, thread: Any) -> None:
+    _handles[user_id] = thread
+    _handles.move_to_end(user_id)
+    while len(_handles) > THREAD_HANDLE_CACHE:
+        _handles.popitem(last=False)
+
+
+def start_provisioning(user: Dict[str, Any]) -> Optional[asyncio.Task]:
+    """Starts preparing the user's thread in the background; None if it's already cached."""
+    if cached_thread(user) is not None:
+        return None
+    # Две вкладки одного пользователя получают одну и ту же подготовку
+    return _provisioning.start(user["id"], _provision, user)
+
+
+async def get_thread(user: Dict[str, Any]) -> Any:
+    """
+    The user's thread: from the cache, from the running provisioning, or provisioned now.
+    users.thread_id is re-read first: another tab or worker may have compacted the thread
+    since `user` was loaded, and the stale id must not replace the new thread in the cache.
+    """
+    user["thread_id"] = await database.fetch_val(
+        select(users_table.c.thread_id).where(users_table.c.id == user["id"])
+    )
+    task = start_provisioning(user)
+    if task is None:
+        return cached_thread(user)
+    # shield: если клиент отключится, подготовка треда всё равно доживёт до кэша
+    return await asyncio.shield(task)
@@ -0,0 +1,220 @@
+"""
+Response encodings: compression and content negotiation.
+
+CompressionMiddleware compresses complete responses of at least
+COMPRESS_MIN_BYTES with brotli (if the `brotli` package is installed) or gzip,
+whichever the client prefers in Accept-Encoding. Streamed bodies (statement
+exports), range responses and already compressed media pass through as is,
+so Content-Length and Range keep their meaning.
+
+Listings can also be negotiated with the Accept header:
+  * application/json — list of records (default);
+  * application/vnd.columnar+json — one array per field instead of records:
+    keys are sent once, not once per row;
+  * application/msgpack, application/vnd.columnar+msgpack — the same two
+    layouts in MessagePack (needs the optional `msgpack` package).
+"""
+import asyncio
+import gzip
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "1").lower() in ("1", "true", "yes")
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+# Крупные тела сжимаем в потоке, чтобы не держать event loop
+COMPRESS_THREAD_BYTES = 256 * 1024
+
+JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.columnar+json"
+MSGPACK = "application/msgpack"
+COLUMNAR_MSGPACK = "application/vnd.columnar+msgpack"
+# media type -> (кодек, раскладка)
+MEDIA_TYPES: Dict[str, Tuple[str, str]] = {
+    JSON: ("json", "records"),
+    COLUMNAR_JSON: ("json", "columnar"),
+    MSGPACK: ("msgpack", "records"),
+    "application/x-msgpack": ("msgpack", "records"),
+    COLUMNAR_MSGPACK: ("msgpack", "columnar"),
+}
+# Уже сжатые форматы — не трогаем
+_INCOMPRESSIBLE = (
+    "image/", "audio/", "video/", "application/zip", "application/vnd.openxmlformats",
+)
+
+_available: Dict[str, bool] = {}
+
+
+def has_module(name: str) -> bool:
+    """Whether an optional package is installed (checked once)."""
+    if name not in _available:
+        try:
+            __import__(name)
+            _available[name] = True
+        except ImportError:
+            _available[name] = False
+    return _available[name]
+
+
+def _preferences(header: str) -> List[Tuple[str, float]]:
+    """Items of an Accept / Accept-Encoding header with their q, best first, q=0 dropped."""
+    items = []
+    for position, part in enumerate(header.split(",")):
+        value, *params = [p.strip() for p in part.split(";")]
+        if not value:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, number = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(number)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            items.append((value.lower(), q, position))
+    return [(value, q) for value, q, _ in sorted(items, key=lambda item: (-item[1], item[2]))]
+
+
+def negotiate(accept: Optional[str]) -> Tuple[str, str, str]:
+    """(media type, codec, layout) for the Accept header; 406 if nothing offered is acceptable."""
+    if not accept:
+        return JSON, "json", "records"
+    for value, _ in _preferences(accept):
+        if value in ("*/*", "application/*"):
+            return JSON, "json", "records"
+        if value in MEDIA_TYPES:
+            codec, layout = MEDIA_TYPES[value]
+            if codec != "msgpack" or has_module("msgpack"):
+                return value, codec, layout
+    raise HTTPException(status_code=406, detail=f"Поддерживаемые форматы: {', '.join(_offered())}")
+
+
+def _offered() -> List[str]:
+    return [m for m, (codec, _) in MEDIA_TYPES.items() if codec != "msgpack" or has_module("msgpack")]
+
+
+def frame_records(df) -> List[Dict[str, Any]]:
+    """Rows of a frame as records, datetimes as ISO strings (as FastAPI renders them)."""
+    return _plain(df).to_dict(orient="records")
+
+
+def frame_columns(df) -> Dict[str, List[Any]]:
+    """A frame as {field: [values]} — the columnar layout."""
+    plain = _plain(df)
+    return {column: plain[column].tolist() for column in plain.columns}
+
+
+def _plain(df):
+    import pandas as pd
+
+    converted = {
+        c: df[c].dt.strftime("%Y-%m-%dT%H:%M:%S")
+        for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])
+    }
+    return df.assign(**converted) if converted else df
+
+
+def encoded_response(payload: Dict[str, Any], media_type: str, codec: str) -> Response:
+    """Response with the payload in the negotiated codec."""
+    if codec == "msgpack":
+        import msgpack
+
+        body = msgpack.packb(payload, use_bin_type=True)
+    else:
+        body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
+
+
+def _choose_encoding(header: str) -> Optional[str]:
+    for value, _ in _preferences(header):
+        if value == "br" and has_module("brotli"):
+            return "br"
+        if value in ("gzip", "*"):
+            return "gzip"
+    return None
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        import brotli
+
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """ASGI middleware: brotli/gzip for complete responses of at least COMPRESS_MIN_BYTES."""
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers", []))
+        encoding = _choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start: Optional[Dict[str, Any]] = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                start = message
+                response_headers = {k.lower(): v for k, v in message.get("headers", [])}
+                content_type = response_headers.get(b"content-type", b"").decode("latin-1")
+                passthrough = (
+                    message["status"] == 206
+                    or b"content-encoding" in response_headers
+                    or content_type.startswith(_INCOMPRESSIBLE)
+                )
+                if passthrough:
+                    await send(message)
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            # Потоковый ответ или маленькое тело — отдаём как есть
+            passthrough = message.get("more_body", False) or len(body) < self.minimum_size
+            if passthrough:
+                await send(start)
+                await send(message)
+                return
+
+            if len(body) >= COMPRESS_THREAD_BYTES:
+                compressed = await asyncio.to_thread(_compress, body, encoding)
+            else:
+                compressed = _compress(body, encoding)
+            response_headers = [
+                (k, v) for k, v in start.get("headers", [])
+                if k.lower() not in (b"content-length", b"vary")
+            ]
+            vary = [v for k, v in start.get("headers", []) if k.lower() == b"vary"]
+            response_headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(compressed)).encode()),
+                (b"vary", b", ".join(vary + [b"Accept-Encoding"])),
+            ]
+            await send({**start, "headers": response_headers})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_compressed)
+
+
+def install_compression(app) -> None:
+    """Adds CompressionMiddleware unless COMPRESSION_ENABLED is off."""
+    if COMPRESSION_ENABLED:
+        app.add_middleware(CompressionMiddleware)
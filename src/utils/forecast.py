@@ -0,0 +1,201 @@
+"""
+Month-end balance forecast for all users at once.
+
+The model is deliberately simple so every number can be explained to the
+client:
+  * daily spend of the last FORECAST_HISTORY_WEEKS weeks forms a
+    (users x days) matrix;
+  * weekday profile — mean spend per weekday relative to the user's mean day;
+  * trend — least-squares slope of the weekly totals, the projected week
+    kept within ±FORECAST_TREND_CAP of the mean week;
+  * each remaining day of the month = trend level / 7 x weekday factor.
+
+Month-end balance follows /analytics' notion of balance: monthly salary minus
+the month's spend (spent so far + forecast for the rest of the month); the
+expected category spend splits the month's spend by the user's category
+shares. Everything is NumPy over the whole matrix, so the table for all users
+is computed once per anchor date and cached until the dataset is replaced.
+"""
+import calendar
+import os
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+from src.utils.transactions import CATEGORIES, load_transactions
+
+FORECAST_HISTORY_WEEKS = int(os.getenv("FORECAST_HISTORY_WEEKS", "12"))
+FORECAST_TREND_CAP = float(os.getenv("FORECAST_TREND_CAP", "0.5"))
+FORECAST_CACHE = int(os.getenv("FORECAST_CACHE", "8"))
+# z для 80% интервала
+_Z80 = 1.2816
+
+# Краткий прогноз в ответе /analytics и в пакетном /forecast
+FORECAST_FIELDS = ("month_end", "forecast_month_spend", "month_end_balance", "shortfall_date")
+
+WEEKDAYS = ["Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье"]
+
+_tables: "OrderedDict[tuple, ForecastTable]" = OrderedDict()
+
+
+class ForecastTable:
+    """Forecast columns for every user with spending history before `as_of`."""
+
+    def __init__(self, as_of: date):
+        import numpy as np
+        import pandas as pd
+
+        df = load_transactions()
+        n_days = FORECAST_HISTORY_WEEKS * 7
+        start = as_of - timedelta(days=n_days - 1)
+        day = df["date"].dt.normalize()
+        mask = (day >= pd.Timestamp(start)) & (day <= pd.Timestamp(as_of))
+        history = df.loc[mask]
+
+        self.as_of = as_of
+        self.month_end = as_of.replace(day=calendar.monthrange(as_of.year, as_of.month)[1])
+        self.user_ids = np.unique(history["id"].to_numpy())
+        rows = np.searchsorted(self.user_ids, history["id"].to_numpy())
+        n_users = len(self.user_ids)
+
+        # Матрица дневных трат (пользователи x дни) и суммы по категориям
+        day_index = (day[mask] - pd.Timestamp(start)).dt.days.to_numpy()
+        amounts = history["amount"].to_numpy(dtype=float)
+        daily = np.zeros((n_users, n_days))
+        np.add.at(daily, (rows, day_index), amounts)
+        by_category = np.zeros((n_users, len(CATEGORIES)))
+        codes = pd.Categorical(history["category"], categories=CATEGORIES).codes
+        known = codes >= 0
+        np.add.at(by_category, (rows[known], codes[known]), amounts[known])
+        totals = by_category.sum(axis=1, keepdims=True)
+        self.shares = np.divide(by_category, totals, out=np.zeros_like(by_category), where=totals > 0)
+
+        salary = history.groupby("id", observed=True)["salary"].first()
+        self.salary = salary.reindex(self.user_ids).to_numpy(dtype=float)
+
+        # Профиль по дням недели: средний день недели / средний день
+        weekday_of = np.array([(start + timedelta(days=i)).weekday() for i in range(n_days)])
+        weekday_mean = np.stack([daily[:, weekday_of == k].mean(axis=1) for k in range(7)], axis=1)
+        mean_day = daily.mean(axis=1, keepdims=True)
+        self.weekday_profile = np.divide(weekday_mean, mean_day, out=np.ones_like(weekday_mean), where=mean_day > 0)
+
+        # Тренд: МНК по недельным суммам (недели отсчитываются от start)
+        weekly = daily.reshape(n_users, FORECAST_HISTORY_WEEKS, 7).sum(axis=2)
+        t = np.arange(FORECAST_HISTORY_WEEKS) - (FORECAST_HISTORY_WEEKS - 1) / 2
+        mean_week = weekly.mean(axis=1)
+        self.trend = (weekly * t).sum(axis=1) / (t * t).sum()
+        residuals = weekly - (mean_week[:, None] + self.trend[:, None] * t)
+        sigma_week = np.sqrt((residuals ** 2).sum(axis=1) / max(1, FORECAST_HISTORY_WEEKS - 2))
+
+        # Оставшиеся дни месяца
+        horizon = (self.month_end - as_of).days
+        ahead = np.arange(1, horizon + 1)
+        week_level = mean_week[:, None] + self.trend[:, None] * (t[-1] + ahead / 7)
+        week_level = np.clip(
+            week_level,
+            (1 - FORECAST_TREND_CAP) * mean_week[:, None],
+            (1 + FORECAST_TREND_CAP) * mean_week[:, None],
+        )
+        ahead_weekdays = [(as_of + timedelta(days=int(d))).weekday() for d in ahead]
+        forecast_daily = week_level / 7 * self.weekday_profile[:, ahead_weekdays]
+
+        month_start_index = (as_of.replace(day=1) - start).days
+        self.spent_to_date = daily[:, max(0, month_start_index):].sum(axis=1)
+        self.remaining = forecast_daily.sum(axis=1)
+        self.month_spend = self.spent_to_date + self.remaining
+        self.balance = self.salary - self.month_spend
+        self.margin = _Z80 * sigma_week * np.sqrt(horizon / 7)
+
+        # Первый день, когда прогнозный остаток месяца уходит в минус
+        running = self.salary[:, None] - self.spent_to_date[:, None] - np.cumsum(forecast_daily, axis=1)
+        negative = running < 0
+        self.shortfall_day = np.where(negative.any(axis=1), negative.argmax(axis=1) + 1, -1) if horizon else \
+            np.full(n_users, -1)
+
+    def row(self, user_id: int) -> Optional[int]:
+        import numpy as np
+
+        i = int(np.searchsorted(self.user_ids, user_id))
+        return i if i < len(self.user_ids) and self.user_ids[i] == user_id else None
+
+    def summary(self, i: int) -> Dict[str, Any]:
+        shortfall = int(self.shortfall_day[i])
+        return {
+            "user_id": int(self.user_ids[i]),
+            "month_end": self.month_end.isoformat(),
+            "forecast_month_spend": int(self.month_spend[i]),
+            "month_end_balance": int(self.balance[i]),
+            "shortfall_date": (self.as_of + timedelta(days=shortfall)).isoformat() if shortfall > 0 else None,
+        }
+
+    def details(self, i: int) -> Dict[str, Any]:
+        return {
+            **self.summary(i),
+            "as_of": self.as_of.isoformat(),
+            "salary_monthly": int(self.salary[i]),
+            "spent_to_date": int(self.spent_to_date[i]),
+            "forecast_remaining": int(self.remaining[i]),
+            "month_end_balance_80": [int(self.balance[i] - self.margin[i]), int(self.balance[i] + self.margin[i])],
+            "model": {
+                "history_weeks": FORECAST_HISTORY_WEEKS,
+                "trend_per_week": int(self.trend[i]),
+                "weekday_profile": {WEEKDAYS[k]: round(float(self.weekday_profile[i, k]), 2) for k in range(7)},
+            },
+            "categories": {c: int(self.shares[i, k] * self.month_spend[i]) for k, c in enumerate(CATEGORIES)},
+        }
+
+
+def _as_of(end_date: Optional[str]) -> date:
+    if not end_date:
+        # По умолчанию — последний день датасета, как у /segments
+        return load_transactions()["date"].max().date()
+    try:
+        return datetime.strptime(end_date, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректный формат end_date. Используй YYYY-MM-DD")
+
+
+def get_forecast_table(as_of: date) -> ForecastTable:
+    # id датасета в ключе: подменили фрейм (install_transactions) — пересчитываем
+    key = (as_of, id(load_transactions()))
+    table = _tables.get(key)
+    if table is None:
+        table = ForecastTable(as_of)
+        _tables[key] = table
+        while len(_tables) > FORECAST_CACHE:
+            _tables.popitem(last=False)
+    _tables.move_to_end(key)
+    return table
+
+
+def forecast_for(user_id: int, as_of: date) -> Optional[Dict[str, Any]]:
+    """Forecast of one user, None if there's no spending history before as_of."""
+    table = get_forecast_table(as_of)
+    i = table.row(user_id)
+    return table.details(i) if i is not None else None
+
+
+def user_forecast(user_id: int, end_date: Optional[str] = None) -> Dict[str, Any]:
+    forecast = forecast_for(user_id, _as_of(end_date))
+    if forecast is None:
+        raise HTTPException(status_code=404, detail="Нет транзакций для прогноза")
+    return forecast
+
+
+def batch_forecast(end_date: Optional[str] = None, offset: int = 0, limit: int = 100,
+                   shortfall_only: bool = False) -> Dict[str, Any]:
+    """Month-end forecasts of all users (page), optionally only those expected to run short."""
+    import numpy as np
+
+    table = get_forecast_table(_as_of(end_date))
+    rows = np.flatnonzero(table.balance < 0) if shortfall_only else np.arange(len(table.user_ids))
+    return {
+        "as_of": table.as_of.isoformat(),
+        "month_end": table.month_end.isoformat(),
+        "total": int(rows.size),
+        "offset": offset,
+        "limit": limit,
+        "items": [table.summary(int(i)) for i in rows[offset:offset + limit]],
+    }
@@ -0,0 +1,208 @@
+"""
+Goal planning: Monte Carlo projections of savings towards a target amount.
+
+The monthly contribution is the user's free cash flow from the transaction
+data — salary minus spend in each of the last three 30-day months — drawn per
+path from a normal distribution with that mean and spread (or a fixed amount
+the client names). A month that overspends takes money out of the savings;
+only the balance itself can't go below zero. Three months are too few to
+estimate the spread, so it is capped at GOAL_STD_CAP x |mean|. Every savings product of the catalog in the user's segment
+(Копилка and Вакала for individuals, the «Овернайт» and «Выгодный» deposits
+for businesses) is simulated side by side with keeping the money as is:
+  * annual yield per path — uniform in [GOAL_YIELD_FLOOR x X, X] for «до X%»,
+    exactly X for a fixed rate;
+  * income accrues only on the part between min_sum and max_sum;
+  * the money can't be taken before min_term_m; deposits are assumed to be
+    rolled over at maturity.
+
+All paths and products advance together as (products x paths) NumPy arrays,
+one step per month, so a 20-year plan takes milliseconds. The result is the
+probability of having reached the goal by each month.
+"""
+import os
+import re
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from src.utils.catalog import SEGMENT_BUSINESS, get_catalog
+from src.utils.transactions import load_transactions
+
+GOAL_PATHS = int(os.getenv("GOAL_PATHS", "2000"))
+GOAL_MAX_MONTHS = int(os.getenv("GOAL_MAX_MONTHS", "360"))
+# Доходность «до X%» — равномерно от GOAL_YIELD_FLOOR·X до X
+GOAL_YIELD_FLOOR = float(os.getenv("GOAL_YIELD_FLOOR", "0.5"))
+# Разброс взноса — не больше GOAL_STD_CAP·|среднее|: оценка по трём месяцам слишком шумная
+GOAL_STD_CAP = float(os.getenv("GOAL_STD_CAP", "1.0"))
+# Фиксированное зерно: одинаковые вопросы — одинаковые ответы (и single-flight)
+GOAL_SEED = int(os.getenv("GOAL_SEED", "42"))
+# Сколько точек кривой вероятности отдаём
+CURVE_POINTS = 24
+
+NO_PRODUCT = "Без вложений"
+PERSONAL_PRODUCTS = ("SAVINGS", "WAKALA")
+BUSINESS_PRODUCTS = ("BIZ_OVERNIGHT", "BIZ_PROFIT")
+
+
+def _yield_range(expected_yield: str) -> Tuple[float, float]:
+    match = re.search(r"(\d+(?:[.,]\d+)?)\s*%", expected_yield or "")
+    if not match:
+        return 0.0, 0.0
+    top = float(match.group(1).replace(",", ".")) / 100
+    return (GOAL_YIELD_FLOOR * top if "до" in expected_yield else top), top
+
+
+def savings_products(type_id: Optional[int]) -> List[Dict[str, Any]]:
+    """Savings products of the segment with parsed yield ranges and limits."""
+    catalog = get_catalog()
+    keys = BUSINESS_PRODUCTS if type_id == SEGMENT_BUSINESS else PERSONAL_PRODUCTS
+
+    products = [{"name": NO_PRODUCT, "yield": (0.0, 0.0), "min_sum": 0, "max_sum": None, "min_term_m": 0}]
+    for key in keys:
+        p = catalog.by_code[key]
+        products.append({
+            "name": p["name"],
+            "yield": _yield_range(p.get("expected_yield")),
+            "min_sum": p.get("min_sum") or 0,
+            "max_sum": p.get("max_sum"),
+            "min_term_m": p.get("min_term_m") or 0,
+        })
+    return products
+
+
+def free_cash_flow(user_id: int, end_date: Optional[str] = None) -> Tuple[float, float, str]:
+    """
+    (mean, std) of the monthly free cash over the 3 months up to end_date
+    (by default the user's last transaction) and the period end; std is capped
+    at GOAL_STD_CAP x |mean|.
+    """
+    import numpy as np
+    import pandas as pd
+
+    df = load_transactions()
+    user_df = df[df["id"] == user_id]
+    if user_df.empty:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    if end_date:
+        try:
+            end = pd.Timestamp(end_date).normalize()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректный формат end_date. Используй YYYY-MM-DD")
+    else:
+        end = user_df["date"].max().normalize()
+
+    day = user_df["date"].dt.normalize()
+    period = user_df[(day > end - timedelta(days=90)) & (day <= end)]
+    if period.empty:
+        raise HTTPException(status_code=404, detail="Нет транзакций за последние 3 месяца")
+
+    # Три «месяца» по 30 дней, считая назад от end
+    month = ((end - period["date"].dt.normalize()).dt.days // 30).clip(upper=2).to_numpy()
+    spent = np.bincount(month, weights=period["amount"].to_numpy(dtype=float), minlength=3)
+    free = float(period["salary"].iloc[0]) - spent
+    mean = float(free.mean())
+    std = min(float(free.std(ddof=1)), GOAL_STD_CAP * abs(mean))
+    return mean, std, end.date().isoformat()
+
+
+def simulate_goal(target_amount: float, months: int, monthly_mean: float, monthly_std: float,
+                  initial_amount: float, products: List[Dict[str, Any]],
+                  paths: int = GOAL_PATHS, stop_at: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Runs the projection; returns per product the probability of having reached
+    target_amount by each month (months x products) and the final balances.
+    With stop_at it ends early, once every product has reached that probability.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(GOAL_SEED)
+    n_products = len(products)
+    low = np.array([p["yield"][0] for p in products])[:, None]
+    high = np.array([p["yield"][1] for p in products])[:, None]
+    annual = low + (high - low) * rng.random((n_products, paths))
+    monthly_rate = (1 + annual) ** (1 / 12) - 1
+    min_sum = np.array([p["min_sum"] for p in products], dtype=float)[:, None]
+    max_sum = np.array([p["max_sum"] or np.inf for p in products], dtype=float)[:, None]
+    min_term = np.array([p["min_term_m"] for p in products])
+
+    # Взносы одни и те же для всех продуктов — сравниваем только продукты.
+    # Отрицательный взнос (месяц в минус) забирает деньги из накоплений
+    contributions = rng.normal(monthly_mean, monthly_std, (months, paths))
+    balance = np.full((n_products, paths), float(initial_amount))
+    reached = np.zeros((n_products, paths), dtype=bool)
+    curve = np.zeros((months, n_products))
+    invested = np.empty_like(balance)
+    for m in range(months):
+        # Доход — только на часть в пределах [min_sum, max_sum]; операции на месте, без временных массивов
+        np.minimum(balance, max_sum, out=invested)
+        invested *= balance >= min_sum
+        invested *= monthly_rate
+        balance += invested
+        balance += contributions[m]
+        np.maximum(balance, 0.0, out=balance)
+        reached |= (balance >= target_amount) & (m + 1 >= min_term)[:, None]
+        curve[m] = reached.mean(axis=1)
+        if stop_at is not None and curve[m].min() >= stop_at:
+            return {"curve": curve[:m + 1], "balance": balance}
+    return {"curve": curve, "balance": balance}
+
+
+def plan_goal(user_id: int, type_id: Optional[int], target_amount: float, months: Optional[int] = None,
+              monthly_contribution: Optional[float] = None, initial_amount: float = 0,
+              end_date: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Goal plan of the user: chance to collect target_amount with each savings
+    product within `months` (by default — until the goal is ~certain, at most GOAL_MAX_MONTHS).
+    """
+    import numpy as np
+
+    if target_amount <= 0:
+        raise HTTPException(status_code=400, detail="Сумма цели должна быть больше нуля")
+    horizon = min(int(months or GOAL_MAX_MONTHS), GOAL_MAX_MONTHS)
+    if months is not None and horizon < 1:
+        raise HTTPException(status_code=400, detail="Срок цели — от 1 месяца")
+
+    if monthly_contribution is not None:
+        mean, std, as_of, source = float(monthly_contribution), 0.0, None, "given"
+    else:
+        mean, std, as_of = free_cash_flow(user_id, end_date)
+        source = "transactions"
+
+    products = savings_products(type_id)
+    # Без срока — считаем, пока цель не станет почти верной (90%) для всех продуктов
+    result = simulate_goal(target_amount, horizon, mean, std, initial_amount, products,
+                           stop_at=None if months else 0.9)
+    curve, balance = result["curve"], result["balance"]
+    horizon = len(curve)
+
+    step = max(1, horizon // CURVE_POINTS)
+    checkpoints = sorted(set(range(step, horizon + 1, step)) | {horizon})
+    options = []
+    for i, product in enumerate(products):
+        def month_with(probability: float) -> Optional[int]:
+            hit = np.flatnonzero(curve[:, i] >= probability)
+            return int(hit[0]) + 1 if hit.size else None
+
+        options.append({
+            "product": product["name"],
+            "annual_yield": [round(product["yield"][0], 3), round(product["yield"][1], 3)],
+            "probability": round(float(curve[-1, i]), 3),
+            "months_to_goal": {"p50": month_with(0.5), "p90": month_with(0.9)},
+            "median_balance": int(np.median(balance[i])),
+            "curve": [{"month": m, "probability": round(float(curve[m - 1, i]), 3)} for m in checkpoints],
+        })
+    options.sort(key=lambda o: (-o["probability"], o["months_to_goal"]["p50"] or horizon + 1))
+
+    return {
+        "user_id": user_id,
+        "goal": {"target_amount": int(target_amount), "months": horizon, "initial_amount": int(initial_amount)},
+        "cash_flow": {
+            "source": source,
+            "as_of": as_of,
+            "monthly_mean": int(mean),
+            "monthly_std": int(std),
+        },
+        "paths": GOAL_PATHS,
+        "options": options,
+    }
@@ -0,0 +1,162 @@
+"""
+Fast path for simple analytic chat questions.
+
+Questions like «сколько я потратил на такси за 3 месяца» or «какой у меня топ
+категорий» are recognised with regular expressions and answered straight from
+the analytics computations (the same ones behind /spending/3m and /analytics),
+without starting an assistant run. Only questions about the user's own money
+(a first-person marker) that don't mention a bank product qualify; anything
+else goes to the assistant.
+"""
+import re
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+from src.utils.transactions import CATEGORIES
+
+# Ключевые основы слов -> категория датасета
+CATEGORY_KEYWORDS = [
+    (r"такси", "Такси"),
+    (r"азс|бензин|заправк|топлив", "АЗС"),
+    (r"доставк", "Доставка еды"),
+    (r"\bкоф|\bкафе|ресторан", "Кофе и рестораны"),
+    (r"кино", "Кино"),
+    (r"\bотел|гостиниц", "Отели"),
+    (r"продукт\w* питан|продукты\b|супермаркет", "Продукты питания"),
+    (r"путешеств|поездк|перелет|авиабилет", "Путешествия"),
+    (r"развлечен", "Развлечения"),
+    (r"\bигр", "Играем дома"),
+    (r"отдых\w* дома", "Отдых дома"),
+]
+
+_NUMBER_WORDS = {"один": 1, "одну": 1, "два": 2, "две": 2, "три": 3, "четыре": 4, "пять": 5, "шесть": 6}
+_UNIT_DAYS = {"д": 1, "н": 7, "м": 30, "г": 365, "л": 365}
+# Единицы — целыми словами: «в денежном выражении» не период. «В месяц», «в день» — темп,
+# а не период, поэтому «в» — только с «последний»
+_PERIOD_RE = re.compile(
+    r"(?:за|в\s+последн\w+)\s+(?:последн\w+\s+)?(?:(\d+|один|одну|два|две|три|четыре|пять|шесть)\s+)?"
+    r"\b(день|дня|дней|неделю|недели|недель|месяц|месяца|месяцев|год|года|лет)\b"
+)
+
+_RATIO_RE = re.compile(
+    r"(процент|дол[яюи]|част[ьи]).{0,30}(зарплат|доход)|(зарплат|доход).{0,30}(процент|дол[яюи]|част[ьи])"
+    r"|финансов\w* тип|тип\w* трат"
+)
+_BIGGEST_RE = re.compile(r"(сам\w*|максимальн\w*|крупн\w*)\s+(больш\w*\s+)?(покупк|транзакц|трат|платеж|расход)")
+_TOP_RE = re.compile(r"\bтоп\b|больше всего (я )?трач|на что (я )?(больше всего|чаще всего|в основном) трач")
+_SPEND_RE = re.compile(r"сколько.{0,40}(потрат|трач|ушло|расход)")
+# Вопрос должен быть о своих деньгах: «сколько я потратил», «мой топ», «у меня ушло»
+_FIRST_PERSON_RE = re.compile(
+    r"\b(я|мы|мне|меня|мной|нас|нам|мой|моя|мое|мои|моих|моим|моей|наш\w*)\b|потратил|трачу|тратим"
+)
+# «Потратил на шкаф»: трата на то, чего нет среди категорий, — не общая сумма трат
+_TARGET_RE = re.compile(r"\bна\s+\w+")
+# «Платёж по ипотеке», «доля дохода на кредит» — вопрос о продукте, его отвечает ассистент
+_PRODUCT_RE = re.compile(r"ипотек|кредит|рассрочк|bnpl|финансир|овердрафт|депозит|вклад|копилк|вакал|карт")
+
+
+def _period_days(text: str) -> int:
+    if "полгода" in text:
+        return 180
+    match = _PERIOD_RE.search(text)
+    if not match:
+        return 90
+    amount, word = match.groups()
+    unit = "н" if word.startswith("нед") else word[0]
+    if amount is None:
+        count = 1
+    elif amount.isdigit():
+        count = int(amount)
+    else:
+        count = _NUMBER_WORDS[amount]
+    return max(1, min(count * _UNIT_DAYS[unit], 365))
+
+
+def _category(text: str) -> Optional[str]:
+    for pattern, category in CATEGORY_KEYWORDS:
+        if re.search(pattern, text):
+            return category
+    return None
+
+
+def match_intent(message: str) -> Optional[Dict[str, Any]]:
+    """Recognises an analytic question; returns None if the assistant should answer it."""
+    text = message.lower().replace("ё", "е").strip()
+    if not text or len(text) > 200:
+        return None
+
+    if _PRODUCT_RE.search(text) or not _FIRST_PERSON_RE.search(text):
+        return None
+
+    days = _period_days(text)
+    if _RATIO_RE.search(text):
+        return {"intent": "spending_ratio"}
+    if _BIGGEST_RE.search(text):
+        return {"intent": "biggest_transaction", "days": days}
+    if _TOP_RE.search(text):
+        return {"intent": "top_categories", "days": days}
+    if _SPEND_RE.search(text):
+        category = _category(text)
+        if category is None and _TARGET_RE.search(text):
+            return None
+        return {"intent": "category_spend", "category": category, "days": days}
+    return None
+
+
+_PERIOD_LABELS = {7: "за последнюю неделю", 30: "за последний месяц", 90: "за последние 3 месяца", 365: "за последний год"}
+
+
+def _period_label(days: int) -> str:
+    if days in _PERIOD_LABELS:
+        return _PERIOD_LABELS[days]
+    if days % 30 == 0:
+        return f"за последние {days // 30} мес."
+    return f"за последние {days} дн."
+
+
+def answer_intent(user_id: int, intent: Dict[str, Any]) -> Optional[str]:
+    """Text answer for a recognised intent, or None if there's no data for it."""
+    # match_intent работает без pandas; аналитику грузим, только когда отвечаем
+    from src.utils.analytics import user_period, category_totals, user_analytics, format_kzt
+
+    try:
+        if intent["intent"] == "spending_ratio":
+            profile = user_analytics(user_id)["profile"]
+            return (
+                f"За последние 3 месяца вы тратите {round(profile['spent_ratio'] * 100)}% зарплаты: "
+                f"в среднем {format_kzt(profile['spent_monthly'])} в месяц при доходе "
+                f"{format_kzt(profile['salary_monthly'])}. Свободно остаётся около "
+                f"{format_kzt(profile['balance_left_monthly'])} в месяц. "
+                f"Ваш финансовый тип — «{profile['financial_type']}»."
+            )
+
+        period, _, _ = user_period(user_id, days=intent["days"])
+        label = _period_label(intent["days"])
+
+        if intent["intent"] == "biggest_transaction":
+            row = period.loc[period["amount"].idxmax()]
+            return (
+                f"Самая крупная трата {label}: {format_kzt(row['amount'])} — "
+                f"«{row['category']}», {row['date'].date().strftime('%d.%m.%Y')}."
+            )
+
+        grouped = category_totals(period)
+        total = int(grouped.sum())
+
+        if intent["intent"] == "top_categories":
+            top = grouped.sort_values(ascending=False).head(3)
+            lines = [
+                f"{i}. {cat} — {format_kzt(amount)} ({round(amount / total * 100, 1) if total else 0}%)"
+                for i, (cat, amount) in enumerate(top.items(), start=1)
+            ]
+            return f"Топ категорий {label}:\n" + "\n".join(lines)
+
+        category = intent.get("category")
+        if category is None:
+            return f"{label.capitalize()} вы потратили {format_kzt(total)}."
+        amount = int(grouped[category]) if category in CATEGORIES else 0
+        share = round(amount / total * 100, 1) if total else 0
+        return f"{label.capitalize()} на «{category}» вы потратили {format_kzt(amount)} — это {share}% всех трат."
+    except HTTPException:
+        return None
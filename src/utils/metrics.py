@@ -0,0 +1,12 @@
+from typing import Any, Callable, Dict
+
+_collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register_metrics(name: str, collector: Callable[[], Dict[str, Any]]) -> None:
+    """Registers a section for GET /metrics; `collector` returns a JSON-able dict."""
+    _collectors[name] = collector
+
+
+def collect_metrics() -> Dict[str, Any]:
+    return {name: collector() for name, collector in _collectors.items()}
@@ -1,5 +1,18 @@
+"""
+OpenAI clients and the assistant, created on first use.
+
+Importing this module costs nothing: the SDK is imported and the clients are
+built by get_client() / get_async_client(), and the assistant bootstrap
+(products file, vector store, assistant) runs in bootstrap_assistant() —
+server.py calls it in the parent before forking, main.py's lifespan in the
+background behind /ready, and get_assistant() as a last resort.
+"""
+import asyncio
+import os
+import threading
+from typing import Any
+
 import httpx
-from openai import OpenAI
 from dotenv import load_dotenv
 
 # ✅ Load environment variables from .env
@@ -11,37 +24,110 @@ api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     raise ValueError("OPENAI_API_KEY not found in .env file")
 
-# Initialize client with API key and disable SSL verification (for local dev)
-client = OpenAI(
-    api_key=api_key,
-    http_client=httpx.Client(verify=False)
+# Таймауты HTTP; дедлайны операций и повторы — в src/utils/resilience.py
+OPENAI_TIMEOUT = httpx.Timeout(
+    float(os.getenv("OPENAI_TIMEOUT", "60")),
+    connect=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5")),
 )
 
-product_file = client.files.create(
-    file=open('products.txt', 'rb'),
-    purpose='assistants'
-)
+_client = None
+_async_client = None
+_assistant = None
+_bootstrap_lock = threading.Lock()
 
-vector_store = client.vector_stores.create(
-    name="bank_products_knowledge",
-)
 
-vector_store_file = client.vector_stores.files.create_and_poll(
-    file_id=product_file.id,
-    vector_store_id=vector_store.id,
-)
+def get_client():
+    """Sync client (assistant bootstrap, scripts)."""
+    global _client
+    if _client is None:
+        from openai import OpenAI
 
-with open('assistant_prompt.txt', 'r', encoding='utf-8') as f:
-    prompt_text = '\n'.join(f.readlines())
-
-assistant = client.beta.assistants.create(
-    name="ZamanbankGPTWrapper",
-    model="gpt-4o",
-    instructions=prompt_text,
-    tools=[{'type': 'file_search'}, {'type': 'code_interpreter'}],
-    tool_resources={
-        'file_search': {
-            'vector_store_ids': [vector_store.id]
-        }
-    }
-)
+        # Initialize client with API key and disable SSL verification (for local dev).
+        # OPENAI_BASE_URL (читает сам SDK) позволяет направить оба клиента на фейковый сервер
+        _client = OpenAI(
+            api_key=api_key,
+            timeout=OPENAI_TIMEOUT,
+            http_client=httpx.Client(verify=False)
+        )
+    return _client
+
+
+def get_async_client():
+    """Async client for calls from the event loop (chat, voice transcription etc.)."""
+    global _async_client
+    if _async_client is None:
+        from openai import AsyncOpenAI
+
+        # Сам не повторяет запросы: этим занимается resilience.call с бюджетом повторов
+        _async_client = AsyncOpenAI(
+            api_key=api_key,
+            timeout=OPENAI_TIMEOUT,
+            max_retries=0,
+            http_client=httpx.AsyncClient(verify=False)
+        )
+    return _async_client
+
+
+def _reset_http_client() -> None:
+    # Воркеры prod-сервера форкаются после бутстрапа: пул соединений родителя
+    # в дочернем процессе использовать нельзя, поэтому даём каждому свой.
+    if _client is not None:
+        _client._client = httpx.Client(verify=False)
+    if _async_client is not None:
+        _async_client._client = httpx.AsyncClient(verify=False)
+
+
+if hasattr(os, "register_at_fork"):  # нет на Windows
+    os.register_at_fork(after_in_child=_reset_http_client)
+
+
+def bootstrap_assistant() -> Any:
+    """Uploads the product catalog and creates the assistant, once per process tree."""
+    global _assistant
+    with _bootstrap_lock:
+        if _assistant is not None:
+            return _assistant
+
+        from src.utils.assistant_tools import ASSISTANT_TOOLS
+
+        client = get_client()
+        product_file = client.files.create(
+            file=open('products.txt', 'rb'),
+            purpose='assistants'
+        )
+
+        vector_store = client.vector_stores.create(
+            name="bank_products_knowledge",
+        )
+
+        client.vector_stores.files.create_and_poll(
+            file_id=product_file.id,
+            vector_store_id=vector_store.id,
+        )
+
+        with open('assistant_prompt.txt', 'r', encoding='utf-8') as f:
+            prompt_text = '\n'.join(f.readlines())
+
+        _assistant = client.beta.assistants.create(
+            name="ZamanbankGPTWrapper",
+            model="gpt-4o",
+            instructions=prompt_text,
+            tools=[{'type': 'file_search'}, *ASSISTANT_TOOLS],
+            tool_resources={
+                'file_search': {
+                    'vector_store_ids': [vector_store.id]
+                }
+            }
+        )
+        return _assistant
+
+
+def assistant_ready() -> bool:
+    return _assistant is not None
+
+
+async def get_assistant() -> Any:
+    """The assistant; bootstraps it in a thread if startup hasn't finished yet."""
+    if _assistant is not None:
+        return _assistant
+    return await asyncio.to_thread(bootstrap_assistant)
@@ -0,0 +1,193 @@
+"""
+Peer comparison: where a user's spending stands among clients with a similar salary.
+
+For every salary band (and for all clients together) a mergeable quantile
+sketch per category holds the distribution of 3-month spend, plus one for the
+total spend. The sketches are built once per process from the dataset (the
+last 90 days of each client, as in /segments) and take new users
+incrementally via PeerIndex.add_user; indexes built over parts of the data
+combine with PeerIndex.merge. A percentile lookup is a binary search over the
+sketch's cached CDF, so analytics can call it per request.
+"""
+import itertools
+import os
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.utils.transactions import CATEGORIES, load_transactions
+
+# Границы зарплатных групп (₸ в месяц)
+SALARY_BANDS = [500_000, 1_000_000, 1_500_000, 2_000_000]
+# Меньше клиентов в группе — сравниваем со всеми клиентами
+PEER_MIN_USERS = int(os.getenv("PEER_MIN_USERS", "5"))
+SKETCH_K = int(os.getenv("PEER_SKETCH_K", "200"))
+PERIOD_DAYS = 90
+
+TOTAL = "total"
+ALL_BAND = "all"
+
+_index: Optional["PeerIndex"] = None
+
+
+class QuantileSketch:
+    """
+    KLL-style mergeable quantile sketch: level h keeps items of weight 2**h and,
+    when over capacity, is sorted and every other item is promoted to level h+1.
+    Memory stays O(k) whatever the number of values; rank error is ~1/k.
+    """
+
+    def __init__(self, k: int = SKETCH_K):
+        self.k = k
+        self.levels: List[List[float]] = [[]]
+        self.n = 0
+        self._coin = False
+        self._cdf: Optional[Tuple[List[float], List[int]]] = None
+
+    def add(self, value: float) -> None:
+        self.levels[0].append(float(value))
+        self.n += 1
+        self._compress()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for h, items in enumerate(other.levels):
+            self.levels[h].extend(items)
+        self.n += other.n
+        self._compress()
+
+    def _capacity(self, h: int) -> int:
+        depth = len(self.levels) - h - 1
+        return max(2, int(self.k * (2 / 3) ** depth))
+
+    def _compress(self) -> None:
+        self._cdf = None
+        h = 0
+        while h < len(self.levels):
+            level = self.levels[h]
+            if len(level) > self._capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append([])
+                level.sort()
+                keep = [level.pop()] if len(level) % 2 else []
+                # Чередуем чётные/нечётные, чтобы не смещать ранги в одну сторону
+                self._coin = not self._coin
+                self.levels[h + 1].extend(level[int(self._coin)::2])
+                self.levels[h] = keep
+            h += 1
+
+    def rank(self, value: float) -> Tuple[float, float]:
+        """Shares of the values strictly below and strictly above `value`."""
+        if self._cdf is None:
+            pairs = sorted((v, 1 << h) for h, level in enumerate(self.levels) for v in level)
+            self._cdf = ([v for v, _ in pairs], list(itertools.accumulate(w for _, w in pairs)))
+        values, cumulative = self._cdf
+        if not values:
+            return 0.0, 0.0
+        below, not_above = bisect_left(values, value), bisect_right(values, value)
+        total = cumulative[-1]
+        return (
+            cumulative[below - 1] / total if below else 0.0,
+            1 - (cumulative[not_above - 1] / total if not_above else 0.0),
+        )
+
+
+def salary_band(salary_m: float) -> str:
+    return str(bisect_right(SALARY_BANDS, salary_m))
+
+
+class PeerIndex:
+    """Sketches of 3-month spend per (salary band, category) and per band in total."""
+
+    def __init__(self):
+        self.sketches: Dict[Tuple[str, str], QuantileSketch] = {}
+        self.users: Dict[str, int] = {}
+
+    def _sketch(self, band: str, metric: str) -> QuantileSketch:
+        sketch = self.sketches.get((band, metric))
+        if sketch is None:
+            sketch = self.sketches[(band, metric)] = QuantileSketch()
+        return sketch
+
+    def add_user(self, salary_m: float, amounts: Dict[str, float]) -> None:
+        """Adds one client: 3-month spend per category (missing categories count as 0)."""
+        total = sum(amounts.get(c, 0) for c in CATEGORIES)
+        for band in (salary_band(salary_m), ALL_BAND):
+            self.users[band] = self.users.get(band, 0) + 1
+            for category in CATEGORIES:
+                self._sketch(band, category).add(amounts.get(category, 0))
+            self._sketch(band, TOTAL).add(total)
+
+    def merge(self, other: "PeerIndex") -> None:
+        for key, sketch in other.sketches.items():
+            self._sketch(*key).merge(sketch)
+        for band, count in other.users.items():
+            self.users[band] = self.users.get(band, 0) + count
+
+    def percentile(self, salary_m: float, metric: str, value: float) -> Optional[Tuple[float, float, bool]]:
+        """
+        (share of peers spending less than `value` on `metric`, share spending more,
+        compared within the salary band); falls back to all clients if the band is too
+        small, None if there are no data.
+        """
+        band = salary_band(salary_m)
+        in_band = self.users.get(band, 0) >= PEER_MIN_USERS
+        sketch = self.sketches.get((band if in_band else ALL_BAND, metric))
+        if sketch is None or not sketch.n:
+            return None
+        return (*sketch.rank(value), in_band)
+
+
+def _build() -> PeerIndex:
+    df = load_transactions()
+    as_of = df["date"].max()
+    period = df[df["date"].dt.normalize() >= as_of - timedelta(days=PERIOD_DAYS)]
+
+    salaries = period.groupby("id", observed=True)["salary"].first()
+    amounts = (
+        period.groupby(["id", "category"], observed=True)["amount"].sum()
+        .unstack(fill_value=0)
+        .reindex(index=salaries.index, columns=CATEGORIES, fill_value=0)
+    )
+    index = PeerIndex()
+    for salary_m, row in zip(salaries.tolist(), amounts.to_numpy().tolist()):
+        index.add_user(salary_m, dict(zip(CATEGORIES, row)))
+    return index
+
+
+def get_peer_index() -> PeerIndex:
+    global _index
+    if _index is None:
+        _index = _build()
+    return _index
+
+
+def peer_comparison(salary_m: float, grouped_amounts: Dict[str, int]) -> Dict[str, Any]:
+    """
+    Percentiles of the user's 3-month spend per category and in total among peers,
+    plus up to two insights about the categories where the user stands out most.
+    """
+    index = get_peer_index()
+    percentiles: Dict[str, float] = {}
+    more: Dict[str, float] = {}
+    in_band = False
+    for metric, value in (*grouped_amounts.items(), (TOTAL, sum(grouped_amounts.values()))):
+        found = index.percentile(salary_m, metric, value)
+        if found is not None:
+            below, above, in_band = found
+            percentiles[metric] = round(below, 3)
+            if metric != TOTAL and value > 0:
+                more[metric] = above
+
+    peers = "клиентов с похожей зарплатой" if in_band else "клиентов банка"
+    insights: List[str] = []
+    if more:
+        category = max(more, key=lambda c: percentiles[c])
+        if percentiles[category] >= 0.7:
+            insights.append(f"Вы тратите на «{category}» больше, чем {round(percentiles[category] * 100)}% {peers}.")
+        category = max(more, key=more.get)
+        if more[category] >= 0.7:
+            insights.append(f"На «{category}» вы тратите меньше, чем {round(more[category] * 100)}% {peers}.")
+
+    return {"peers": "salary_band" if in_band else "all", "percentiles": percentiles, "insights": insights}
@@ -0,0 +1,121 @@
+"""
+Local BM25 index over the product catalog (products.txt).
+
+The catalog is a dozen short product cards, so a lexical index answers in
+microseconds and lets the chat inject the relevant cards into the run's
+additional instructions instead of paying for a `file_search` tool call.
+When nothing scores above the threshold the run keeps `file_search`.
+"""
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+PRODUCTS_PATH = "products.txt"
+PRODUCT_INDEX_TOP_K = int(os.getenv("PRODUCT_INDEX_TOP_K", "3"))
+PRODUCT_INDEX_MIN_SCORE = float(os.getenv("PRODUCT_INDEX_MIN_SCORE", "1.5"))
+
+# type_id пользователя -> сегмент каталога
+SEGMENT_PERSONAL = 1
+SEGMENT_BUSINESS = 2
+
+_SEGMENT_HEADERS = {
+    "[ПРОДУКТЫ ДЛЯ ФИЗИЧЕСКИХ ЛИЦ]": SEGMENT_PERSONAL,
+    "[ПРОДУКТЫ ДЛЯ ЮРИДИЧИСКИХ ЛИЦ]": SEGMENT_BUSINESS,
+}
+_WORD_RE = re.compile(r"[a-zа-я0-9]+")
+# Грубый стемминг для русского: обрезаем слово до префикса, чтобы «ипотеку» и «ипотека» совпали
+_STEM_LEN = 5
+
+
+def tokenize(text: str) -> List[str]:
+    words = _WORD_RE.findall(text.lower().replace("ё", "е"))
+    return [w[:_STEM_LEN] for w in words if len(w) > 1]
+
+
+def parse_products(text: str) -> List[Tuple[int, str]]:
+    """Splits products.txt into (segment, product card) pairs."""
+    cards: List[Tuple[int, str]] = []
+    segment, current = SEGMENT_PERSONAL, []
+
+    def flush():
+        card = "\n".join(current).strip()
+        if card:
+            cards.append((segment, card))
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped in _SEGMENT_HEADERS:
+            flush()
+            segment, current = _SEGMENT_HEADERS[stripped], []
+        elif stripped.startswith("Продукт "):
+            flush()
+            current = [stripped]
+        elif stripped:
+            current.append(stripped)
+    flush()
+    return cards
+
+
+class ProductIndex:
+    """Okapi BM25 over product cards."""
+
+    def __init__(self, cards: List[Tuple[int, str]], k1: float = 1.5, b: float = 0.75):
+        self.cards = cards
+        self.k1, self.b = k1, b
+        self.doc_terms: List[Counter] = [Counter(tokenize(card)) for _, card in cards]
+        self.doc_len = [sum(terms.values()) for terms in self.doc_terms]
+        self.avg_len = sum(self.doc_len) / max(1, len(self.doc_len))
+
+        df: Counter = Counter()
+        for terms in self.doc_terms:
+            df.update(terms.keys())
+        n = len(cards)
+        self.idf: Dict[str, float] = {t: math.log(1 + (n - f + 0.5) / (f + 0.5)) for t, f in df.items()}
+
+    @classmethod
+    def from_file(cls, path: str = PRODUCTS_PATH) -> "ProductIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(parse_products(f.read()))
+
+    def search(self, query: str, segment: Optional[int] = None,
+               top_k: int = PRODUCT_INDEX_TOP_K) -> List[Tuple[float, str]]:
+        terms = set(tokenize(query)) & self.idf.keys()
+        if not terms:
+            return []
+
+        scored = []
+        for i, (card_segment, card) in enumerate(self.cards):
+            if segment is not None and card_segment != segment:
+                continue
+            tf, length = self.doc_terms[i], self.doc_len[i]
+            score = 0.0
+            for t in terms:
+                f = tf.get(t, 0)
+                if f:
+                    score += self.idf[t] * f * (self.k1 + 1) / (f + self.k1 * (1 - self.b + self.b * length / self.avg_len))
+            if score > 0:
+                scored.append((score, card))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return scored[:top_k]
+
+    def context_for(self, query: str, segment: Optional[int] = None) -> Optional[str]:
+        """Additional instructions with the matching cards, or None to fall back to file_search."""
+        hits = [card for score, card in self.search(query, segment) if score >= PRODUCT_INDEX_MIN_SCORE]
+        if not hits:
+            return None
+        return (
+            "Подходящие к вопросу продукты из products.txt (используй эти условия, "
+            "файл искать не нужно):\n\n" + "\n\n".join(hits)
+        )
+
+
+_index: Optional[ProductIndex] = None
+
+
+def get_product_index() -> ProductIndex:
+    global _index
+    if _index is None:
+        _index = ProductIndex.from_file()
+    return _index
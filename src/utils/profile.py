@@ -0,0 +1,75 @@
+"""
+Compact financial profile of a user for the assistant's thread.
+
+Instead of the raw transaction history the thread gets a short `[RINAT]`
+message with the numbers the model would otherwise re-derive on every
+question: monthly income and spend, category shares, financial type and the
+products the analytics engine picks. The profile is versioned by a fingerprint
+of the user's data, so chat_websocket posts a new one only when it changes.
+"""
+import hashlib
+from typing import Optional, Tuple
+
+from src.utils import analytics, analytics_SME
+from src.utils.analytics import format_kzt
+from src.utils.transactions import load_transactions
+
+# Поднимать при изменении формата профиля — тогда профиль обновится во всех тредах
+PROFILE_FORMAT = 1
+
+_SEGMENT_LABELS = {1: "физическое лицо", 2: "юридическое лицо (бизнес)"}
+
+
+def _user_rows(user_id: int):
+    df = load_transactions()
+    return df[df["id"] == user_id]
+
+
+def profile_version(user_id: int, type_id: Optional[int]) -> Optional[str]:
+    """Fingerprint of the user's data; None if the user has no transactions."""
+    rows = _user_rows(user_id)
+    if rows.empty:
+        return None
+    fingerprint = "|".join(str(part) for part in (
+        PROFILE_FORMAT,
+        type_id,
+        rows.shape[0],
+        rows["date"].max().date(),
+        int(rows["amount"].sum()),
+        int(rows["salary"].iloc[-1]),
+    ))
+    return hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()[:12]
+
+
+def build_profile(user_id: int, type_id: Optional[int]) -> Optional[Tuple[str, str]]:
+    """Returns (version, profile message) or None if there is nothing to summarise."""
+    version = profile_version(user_id, type_id)
+    if version is None:
+        return None
+
+    # Профиль считаем за 3 месяца до последней транзакции клиента, а не до сегодня
+    last_date = _user_rows(user_id)["date"].max().strftime("%Y-%m-%d")
+    module = analytics_SME if type_id == 2 else analytics
+    result = module.user_analytics(user_id, last_date)
+
+    profile = result["profile"]
+    period = result["period"]
+    shares = sorted(result["categories"]["breakdown"], key=lambda c: c["share"], reverse=True)
+    shares_text = ", ".join(f"{c['category']} {round(c['share'] * 100)}%" for c in shares if c["amount"])
+    products_text = "; ".join(p["product"] for p in result["recommendations"]) or "нет"
+
+    lines = [
+        f"[RINAT] Профиль клиента (версия {version}, данные за {period['start_date']} — {period['end_date']}).",
+        f"Сегмент: {_SEGMENT_LABELS.get(type_id, 'не указан')}.",
+        f"Доход в месяц: {format_kzt(profile['salary_monthly'])}; траты в месяц: "
+        f"{format_kzt(profile['spent_monthly'])} ({round(profile['spent_ratio'] * 100)}% дохода); "
+        f"свободный остаток: {format_kzt(profile['balance_left_monthly'])} в месяц.",
+        f"Финансовый тип: {profile['financial_type']}.",
+        f"Транзакций за период: {result['activity']['transactions_count']}, "
+        f"средний чек {format_kzt(result['activity']['avg_ticket'])}.",
+        f"Доли трат по категориям: {shares_text}.",
+        f"Подходящие продукты: {products_text}.",
+        f"Совет: {result['advice']}",
+        "Это сводка — для точных цифр за другой период или по отдельным транзакциям вызывай функции.",
+    ]
+    return version, "\n".join(lines)
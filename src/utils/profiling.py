@@ -0,0 +1,225 @@
+"""
+Opt-in sampling profiler for HTTP requests.
+
+Two modes, both configured from the environment:
+
+- on demand: an admin (username listed in PROFILING_ADMINS) adds the
+  `X-Profile: 1` header or the `?__profile=1` query flag, and the profile of
+  that request is stored in PROFILE_DIR; the file name comes back in the
+  `X-Profile-File` response header;
+- global sampling: with PROFILE_SAMPLE_EVERY=N every N-th request is profiled
+  into PROFILE_DIR/sampled, which keeps only the last PROFILE_KEEP files.
+
+Profiles are written in the speedscope format (https://www.speedscope.app).
+The sampler walks `sys._current_frames()`. On the event-loop thread, which all
+async requests share, it keeps only the stacks that run inside this request's
+coroutine, so concurrent requests don't leak into the profile. Other threads
+(the pool that runs sync endpoints and `asyncio.to_thread` work) can't be told
+apart per request: they are sampled whenever they run project code and are
+labelled "shared" in the profile, since they may include other requests.
+
+Nothing is installed unless PROFILING_ENABLED is set, so the disabled mode
+costs nothing per request.
+"""
+import asyncio
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from src.utils.security import token_subject
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "").lower() in ("1", "true", "yes")
+PROFILING_ADMINS = {u.strip().lower() for u in os.getenv("PROFILING_ADMINS", "").split(",") if u.strip()}
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "100"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+PROJECT_SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_profiled: ContextVar[bool] = ContextVar("profiled", default=False)
+
+
+def is_profiled() -> bool:
+    """Whether the current request is being profiled (work sent to other processes would be invisible)."""
+    return _profiled.get()
+
+
+class _Sampler(threading.Thread):
+    """
+    Background thread that samples the stacks of the other threads; on `loop_thread`
+    only the stacks that pass through `root` (the request's coroutine frame).
+    """
+
+    def __init__(self, interval: float, loop_thread: Optional[int] = None, root=None):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = interval
+        self.loop_thread = loop_thread
+        self.root = root
+        self.frames: List[Dict] = []
+        self.samples: Dict[int, List[List[int]]] = {}
+        self.weights: Dict[int, List[float]] = {}
+        self.started_at = 0.0
+        self.finished_at = 0.0
+        self._frame_ids: Dict[Tuple[str, str, int], int] = {}
+        self._stopped = threading.Event()
+
+    def _frame_id(self, frame) -> int:
+        code = frame.f_code
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        idx = self._frame_ids.get(key)
+        if idx is None:
+            idx = self._frame_ids[key] = len(self.frames)
+            self.frames.append({"name": key[0], "file": key[1], "line": key[2]})
+        return idx
+
+    def _stack(self, frame, root=None) -> Optional[List[int]]:
+        # Потоки без кода проекта на стеке (простаивающий пул, event loop в select) пропускаем;
+        # с root — только стеки внутри корутины запроса, стек обрезается по ней
+        stack, ours = [], False
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename.startswith(PROJECT_SRC) and filename != __file__:
+                ours = True
+            stack.append(self._frame_id(frame))
+            if frame is root:
+                break
+            frame = frame.f_back
+        else:
+            if root is not None:
+                return None
+        if not ours:
+            return None
+        stack.reverse()
+        return stack
+
+    def run(self) -> None:
+        own = threading.get_ident()
+        self.started_at = last = time.perf_counter()
+        while not self._stopped.wait(self.interval):
+            now = time.perf_counter()
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = self._stack(frame, self.root if ident == self.loop_thread else None)
+                if stack is not None:
+                    self.samples.setdefault(ident, []).append(stack)
+                    self.weights.setdefault(ident, []).append(now - last)
+            last = now
+        self.finished_at = time.perf_counter()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+    def to_speedscope(self, name: str) -> Dict:
+        duration = self.finished_at - self.started_at
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "zaman-ai profiler",
+            "shared": {"frames": self.frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": "request" if ident == self.loop_thread else f"thread {ident} (shared)",
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": duration,
+                    "samples": self.samples[ident],
+                    "weights": self.weights[ident],
+                }
+                for ident in self.samples
+            ],
+        }
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles flagged (admin) and sampled requests."""
+
+    def __init__(self, app, profile_dir: str = PROFILE_DIR, sample_every: int = PROFILE_SAMPLE_EVERY,
+                 keep: int = PROFILE_KEEP, interval_ms: float = PROFILE_INTERVAL_MS, admins=None):
+        self.app = app
+        self.profile_dir = profile_dir
+        self.sampled_dir = os.path.join(profile_dir, "sampled")
+        self.sample_every = sample_every
+        self.keep = keep
+        self.interval = interval_ms / 1000
+        self.admins = PROFILING_ADMINS if admins is None else admins
+        self._counter = itertools.count(1)
+
+    def _is_requested(self, scope, headers: Dict[bytes, bytes]) -> bool:
+        if headers.get(b"x-profile") in (b"1", b"true"):
+            return True
+        return b"__profile=1" in scope.get("query_string", b"")
+
+    def _target_dir(self, scope) -> Optional[str]:
+        headers = dict(scope.get("headers", []))
+        if self._is_requested(scope, headers):
+            sub = token_subject(headers)
+            if sub and sub.lower() in self.admins:
+                return self.profile_dir
+        if self.sample_every and next(self._counter) % self.sample_every == 0:
+            return self.sampled_dir
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        target_dir = self._target_dir(scope)
+        if target_dir is None:
+            await self.app(scope, receive, send)
+            return
+
+        name = "{}-{}-{}.speedscope.json".format(
+            datetime.now().strftime("%Y%m%d-%H%M%S-%f"),
+            scope["method"],
+            re.sub(r"[^A-Za-z0-9_-]+", "_", scope["path"]).strip("_"),
+        )
+
+        async def send_with_header(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", [])) + [(b"x-profile-file", name.encode())]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        sampler = _Sampler(self.interval, threading.get_ident(), sys._getframe())
+        sampler.start()
+        token = _profiled.set(True)
+        try:
+            await self.app(scope, receive, send_with_header)
+        finally:
+            _profiled.reset(token)
+            sampler.stop()
+            profile = sampler.to_speedscope(f"{scope['method']} {scope['path']}")
+            await asyncio.to_thread(self._save, target_dir, name, profile)
+
+    def _save(self, target_dir: str, name: str, profile: Dict) -> None:
+        os.makedirs(target_dir, exist_ok=True)
+        with open(os.path.join(target_dir, name), "w", encoding="utf-8") as f:
+            json.dump(profile, f)
+
+        # Кольцевой буфер только для фонового сэмплирования
+        if target_dir == self.sampled_dir:
+            files = sorted(os.listdir(target_dir))
+            # files[:-0] пуст — при PROFILE_KEEP=0 буфер не хранит ничего
+            for old in files[:max(0, len(files) - self.keep)]:
+                try:
+                    os.remove(os.path.join(target_dir, old))
+                except OSError:
+                    pass
+
+
+def install_profiler(app) -> None:
+    """Adds ProfilingMiddleware to the app when PROFILING_ENABLED is set."""
+    if PROFILING_ENABLED:
+        app.add_middleware(ProfilingMiddleware)
@@ -0,0 +1,308 @@
+"""
+Token-bucket rate limiting per client and route class.
+
+Every request (and every chat websocket message) takes tokens from the bucket
+of its (client, route class). A bucket holds up to `capacity` tokens and
+refills at `per_minute` tokens a minute; the cost of a call depends on how
+expensive it is: one chat message runs the assistant and costs more than one
+/analytics call. An empty bucket answers 429 with Retry-After — the seconds
+until enough tokens are back.
+
+The client is the username from a verified Bearer token (the same subject
+get_current_user resolves), otherwise the client address. The user id in the
+path is not trusted: anyone can put any id there and get a fresh bucket.
+
+Backends (RATE_LIMIT_BACKEND):
+  * memory — per worker: tokens and timestamps in flat arrays indexed through
+    a dict, buckets idle longer than a full refill are swept (they are full
+    again, so dropping them changes nothing);
+  * sqlite — one table in RATE_LIMIT_DB shared by all workers of the host,
+    each take is one IMMEDIATE transaction.
+Other backends plug in through register_backend(name, factory).
+
+Configuration: RATE_LIMITS="analytics=60/60,chat=60/30" (capacity/per_minute),
+RATE_COSTS="chat=5,voice=4"; RATE_LIMIT_ENABLED=0 turns the layer off.
+"""
+import asyncio
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Callable, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from src.utils.metrics import register_metrics
+from src.utils.security import token_subject
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1").lower() in ("1", "true", "yes")
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "rate_limits.db")
+# Как часто (в операциях) вычищать простаивающие вёдра
+RATE_SWEEP_EVERY = int(os.getenv("RATE_SWEEP_EVERY", "10000"))
+
+
+def _parse(value: str) -> Dict[str, str]:
+    return dict(item.strip().split("=", 1) for item in value.split(",") if "=" in item)
+
+
+# класс: (ёмкость ведра, пополнение токенов в минуту)
+RATE_LIMITS: Dict[str, Tuple[float, float]] = {
+    "analytics": (60, 60),
+    "export": (20, 10),
+    "voice": (20, 10),
+    "chat": (60, 30),
+    "auth": (10, 10),
+    "default": (120, 120),
+}
+RATE_LIMITS.update({
+    name: tuple(float(x) for x in spec.split("/", 1))
+    for name, spec in _parse(os.getenv("RATE_LIMITS", "")).items()
+})
+# Стоимость одного запроса (для chat — одного сообщения в websocket)
+RATE_COSTS: Dict[str, float] = {"analytics": 1, "export": 5, "voice": 4, "chat": 5, "auth": 1, "default": 1}
+RATE_COSTS.update({name: float(cost) for name, cost in _parse(os.getenv("RATE_COSTS", "")).items()})
+
+# Ведро, простоявшее дольше полного пополнения, снова полное — его можно забыть
+RATE_IDLE_SECONDS = max(capacity / per_minute * 60 for capacity, per_minute in RATE_LIMITS.values())
+
+# Первое совпадение определяет класс; None — без лимита
+ROUTE_CLASSES: List[Tuple["re.Pattern", Optional[str]]] = [
+    (re.compile(r"^/api/v1/(health|ready|metrics)$|^/(docs|redoc|openapi\.json)"), None),
+    (re.compile(r"^/api/v1/(token|register)$"), "auth"),
+    (re.compile(r"^/api/v1/chat/voice$"), "voice"),
+    (re.compile(r"^/api/v1/(SME/)?users/\d+/(statement|transactions)$"), "export"),
+    (re.compile(r"^/api/v1/((SME/)?analytics/|(SME/)?users/\d+/(spending|anomalies|forecast|goals)|forecast|segments)"),
+     "analytics"),
+]
+
+
+def _take(tokens: float, elapsed: float, capacity: float, per_minute: float, cost: float) -> Tuple[float, float]:
+    """
+    Refills the bucket for `elapsed` seconds and takes `cost` (a negative cost gives
+    tokens back); (tokens left, seconds to wait or 0).
+    """
+    rate = per_minute / 60
+    tokens = min(capacity, tokens + elapsed * rate)
+    cost = min(cost, capacity)
+    if tokens >= cost:
+        return min(capacity, tokens - cost), 0.0
+    return tokens, (cost - tokens) / rate
+
+
+class RateLimitBackend:
+    """Storage of the buckets; take() is atomic per key."""
+
+    # take() ходит в файл/сеть — вызываем из потока, а не в event loop
+    blocking = False
+
+    def take(self, key: str, capacity: float, per_minute: float, cost: float) -> float:
+        """Takes `cost` tokens; returns 0 if allowed, otherwise seconds until it would be."""
+        raise NotImplementedError
+
+    def size(self) -> int:
+        raise NotImplementedError
+
+
+class MemoryBackend(RateLimitBackend):
+    """Buckets of this process: 16 bytes of arrays per bucket plus its dict entry."""
+
+    def __init__(self):
+        self.slots: Dict[str, int] = {}
+        self.tokens = array("d")
+        self.stamps = array("d")
+        self.free: List[int] = []
+        self.ops = 0
+
+    def take(self, key: str, capacity: float, per_minute: float, cost: float) -> float:
+        now = time.monotonic()
+        slot = self.slots.get(key)
+        if slot is None:
+            slot = self.free.pop() if self.free else len(self.tokens)
+            if slot == len(self.tokens):
+                self.tokens.append(0.0)
+                self.stamps.append(0.0)
+            self.slots[key] = slot
+            tokens, elapsed = capacity, 0.0
+        else:
+            tokens, elapsed = self.tokens[slot], now - self.stamps[slot]
+        self.tokens[slot], wait = _take(tokens, elapsed, capacity, per_minute, cost)
+        self.stamps[slot] = now
+
+        self.ops += 1
+        if self.ops % RATE_SWEEP_EVERY == 0:
+            self.sweep(now)
+        return wait
+
+    def sweep(self, now: float) -> None:
+        idle = [key for key, slot in self.slots.items() if now - self.stamps[slot] > RATE_IDLE_SECONDS]
+        for key in idle:
+            self.free.append(self.slots.pop(key))
+
+    def size(self) -> int:
+        return len(self.slots)
+
+
+class SQLiteBackend(RateLimitBackend):
+    """Buckets in a SQLite table, shared by the workers of one host."""
+
+    blocking = True
+
+    def __init__(self, path: str = RATE_LIMIT_DB):
+        self.conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self.lock = threading.Lock()
+        self.ops = 0
+
+    def take(self, key: str, capacity: float, per_minute: float, cost: float) -> float:
+        with self.lock:
+            now = time.time()
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+                tokens, elapsed = (row[0], now - row[1]) if row else (capacity, 0.0)
+                tokens, wait = _take(tokens, elapsed, capacity, per_minute, cost)
+                self.conn.execute(
+                    "INSERT INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                    (key, tokens, now),
+                )
+                self.ops += 1
+                if self.ops % RATE_SWEEP_EVERY == 0:
+                    self.conn.execute("DELETE FROM rate_buckets WHERE updated < ?", (now - RATE_IDLE_SECONDS,))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def size(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM rate_buckets").fetchone()[0]
+
+
+_factories: Dict[str, Callable[[], RateLimitBackend]] = {"memory": MemoryBackend, "sqlite": SQLiteBackend}
+_backend: Optional[RateLimitBackend] = None
+_stats: Dict[str, Dict[str, int]] = {}
+
+
+def register_backend(name: str, factory: Callable[[], RateLimitBackend]) -> None:
+    """Adds a backend selectable with RATE_LIMIT_BACKEND=name (e.g. a Redis-based one)."""
+    _factories[name] = factory
+
+
+def get_backend() -> RateLimitBackend:
+    # Создаётся при первом запросе, то есть уже в воркере после fork
+    global _backend
+    if _backend is None:
+        _backend = _factories[RATE_LIMIT_BACKEND]()
+    return _backend
+
+
+def route_class(path: str) -> Optional[str]:
+    for pattern, name in ROUTE_CLASSES:
+        if pattern.search(path):
+            return name
+    return "default"
+
+
+def client_key(scope) -> str:
+    sub = token_subject(dict(scope.get("headers", [])))
+    if sub:
+        return f"user:{sub.lower()}"
+    client = scope.get("client")
+    return f"ip:{client[0] if client else '-'}"
+
+
+async def charge(client: str, name: str, cost: Optional[float] = None) -> float:
+    """Takes the cost of one `name` call from the client's bucket; seconds to wait, 0 if allowed."""
+    wait = await _take_tokens(client, name, RATE_COSTS.get(name, 1) if cost is None else cost)
+    stats = _stats.setdefault(name, {"allowed": 0, "limited": 0})
+    stats["limited" if wait else "allowed"] += 1
+    return wait
+
+
+async def _take_tokens(client: str, name: str, cost: float) -> float:
+    capacity, per_minute = RATE_LIMITS[name]
+    backend = get_backend()
+    if backend.blocking:
+        return await asyncio.to_thread(backend.take, f"{client}|{name}", capacity, per_minute, cost)
+    return backend.take(f"{client}|{name}", capacity, per_minute, cost)
+
+
+def retry_after(wait: float) -> str:
+    return str(max(1, math.ceil(wait)))
+
+
+async def check(client: str, *names: str) -> None:
+    """
+    charge() for each of the route classes (websocket messages), raising 429 with
+    Retry-After when one of them is over the limit. Then the classes already
+    charged get their tokens back: a rejected message costs nothing.
+    """
+    if not RATE_LIMIT_ENABLED:
+        return
+    for i, name in enumerate(names):
+        wait = await charge(client, name)
+        if wait:
+            for charged in names[:i]:
+                await _take_tokens(client, charged, -RATE_COSTS.get(charged, 1))
+                _stats[charged]["allowed"] -= 1
+            raise HTTPException(
+                status_code=429,
+                detail=f"Слишком много запросов, повторите через {retry_after(wait)} с",
+                headers={"Retry-After": retry_after(wait)},
+            )
+
+
+class RateLimitMiddleware:
+    """ASGI middleware that charges every HTTP request to its route class."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        # Preflight OPTIONS отвечает CORSMiddleware, токенов он не стоит
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+        name = route_class(scope["path"])
+        if name is not None:
+            wait = await charge(client_key(scope), name)
+            if wait:
+                response = JSONResponse(
+                    {"detail": f"Слишком много запросов, повторите через {retry_after(wait)} с"},
+                    status_code=429,
+                    headers={"Retry-After": retry_after(wait)},
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+def install_rate_limiter(app) -> None:
+    """
+    Adds RateLimitMiddleware to the app unless RATE_LIMIT_ENABLED is off. Install it
+    before CORSMiddleware, so CORS wraps it and 429 responses carry the CORS headers.
+    """
+    if RATE_LIMIT_ENABLED:
+        app.add_middleware(RateLimitMiddleware)
+
+
+def rate_limit_metrics() -> Dict:
+    return {
+        "enabled": RATE_LIMIT_ENABLED,
+        "backend": RATE_LIMIT_BACKEND,
+        "buckets": _backend.size() if _backend is not None else 0,
+        "classes": _stats,
+    }
+
+
+register_metrics("rate_limit", rate_limit_metrics)
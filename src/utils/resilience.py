@@ -0,0 +1,249 @@
+"""
+Deadlines, retries and a circuit breaker for calls to the OpenAI API.
+
+Every upstream call from the request path goes through `call()` (plain calls)
+or `stream_events()` (assistant run and chat completion streams):
+
+- each operation has a deadline, streams additionally a deadline for the
+  first event and for silence between events;
+- failed calls are retried with full-jitter exponential backoff, but only
+  while the retry budget (a share of recent calls) allows, so a brownout
+  doesn't turn into a retry storm; writes that aren't idempotent are retried
+  only when the request surely wasn't processed;
+- after BREAKER_FAILURES consecutive failures the breaker opens and calls
+  fail fast with 503 for BREAKER_COOLDOWN seconds, then one probe call
+  decides whether to close it again.
+
+The OpenAI clients themselves don't retry (max_retries=0), see openai_client.
+For local testing point OPENAI_BASE_URL at benchmarks/fake_openai.py.
+"""
+import asyncio
+import os
+import random
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict
+
+from fastapi import HTTPException
+
+from src.utils.metrics import register_metrics
+
+OPENAI_RETRIES = int(os.getenv("OPENAI_RETRIES", "2"))
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "0.2"))
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", "2"))
+# Повтором можно потратить не больше RETRY_BUDGET_RATIO от числа вызовов (плюс запас RETRY_BUDGET_MAX)
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.1"))
+RETRY_BUDGET_MAX = float(os.getenv("RETRY_BUDGET_MAX", "10"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))
+
+# Дедлайны в секундах
+DEADLINE_API_CALL = float(os.getenv("DEADLINE_API_CALL", "15"))
+DEADLINE_TRANSCRIBE = float(os.getenv("DEADLINE_TRANSCRIBE", "60"))
+DEADLINE_FIRST_EVENT = float(os.getenv("DEADLINE_FIRST_EVENT", "20"))
+DEADLINE_STREAM_IDLE = float(os.getenv("DEADLINE_STREAM_IDLE", "30"))
+DEADLINE_RUN = float(os.getenv("DEADLINE_RUN", "180"))
+
+_stats = {"calls": 0, "retries": 0, "timeouts": 0, "failures": 0, "rejected": 0, "budget_exhausted": 0}
+
+
+def _unavailable() -> HTTPException:
+    return HTTPException(status_code=503, detail="Ассистент временно недоступен, попробуйте чуть позже")
+
+
+def _timed_out() -> HTTPException:
+    return HTTPException(status_code=504, detail="Ассистент не ответил вовремя, попробуйте ещё раз")
+
+
+class RetryBudget:
+    """Token bucket: every call deposits `ratio` tokens, every retry withdraws one."""
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, max_tokens: float = RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class CircuitBreaker:
+    """closed -> (BREAKER_FAILURES failures in a row) -> open -> (cooldown) -> half_open -> probe."""
+
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.failure_threshold = failures
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def before_call(self) -> None:
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.cooldown:
+                _stats["rejected"] += 1
+                raise _unavailable()
+            self.state = "half_open"
+        if self.state == "half_open":
+            # Пока идёт пробный вызов, остальные сразу получают отказ
+            if self._probing:
+                _stats["rejected"] += 1
+                raise _unavailable()
+            self._probing = True
+
+    def record_success(self) -> None:
+        self.state, self.failures, self._probing = "closed", 0, False
+
+    def release_probe(self) -> None:
+        """The probe call was abandoned (cancelled) without an answer either way."""
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker()
+budget = RetryBudget()
+
+
+def _is_upstream_failure(exc: BaseException) -> bool:
+    """Errors that say the upstream is unhealthy (as opposed to a bad request)."""
+    # SDK к этому моменту уже загружен клиентом; на импорте модуля его не тянем
+    import openai
+
+    return isinstance(exc, (
+        asyncio.TimeoutError,
+        openai.APIConnectionError,
+        openai.RateLimitError,
+        openai.InternalServerError,
+    ))
+
+
+def _is_retryable(exc: BaseException, idempotent: bool) -> bool:
+    import openai
+
+    if idempotent:
+        return _is_upstream_failure(exc)
+    # Запись могла дойти до сервера: повторяем, только если запрос точно не обработан
+    return isinstance(exc, openai.RateLimitError) or (
+        isinstance(exc, openai.APIConnectionError) and not isinstance(exc, openai.APITimeoutError)
+    )
+
+
+async def _backoff(attempt: int) -> None:
+    await asyncio.sleep(random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt)))
+
+
+def _final_error(exc: BaseException) -> BaseException:
+    import openai
+
+    if isinstance(exc, (asyncio.TimeoutError, openai.APITimeoutError)):
+        return _timed_out()
+    if _is_upstream_failure(exc):
+        return _unavailable()
+    return exc
+
+
+async def call(fn: Callable[..., Awaitable[Any]], *args: Any,
+               deadline: float = DEADLINE_API_CALL, idempotent: bool = True, **kwargs: Any) -> Any:
+    """Awaits `fn(*args, **kwargs)` with a deadline, retries and the circuit breaker."""
+    _stats["calls"] += 1
+    budget.deposit()
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = await asyncio.wait_for(fn(*args, **kwargs), deadline)
+        except asyncio.CancelledError:
+            breaker.release_probe()
+            raise
+        except Exception as e:
+            if not _is_upstream_failure(e):
+                breaker.record_success()
+                raise
+            _stats["failures"] += 1
+            _stats["timeouts"] += isinstance(e, asyncio.TimeoutError)
+            breaker.record_failure()
+            if attempt >= OPENAI_RETRIES or not _is_retryable(e, idempotent):
+                raise _final_error(e) from e
+            if not budget.withdraw():
+                _stats["budget_exhausted"] += 1
+                raise _final_error(e) from e
+            attempt += 1
+            _stats["retries"] += 1
+            await _backoff(attempt)
+        else:
+            breaker.record_success()
+            return result
+
+
+async def stream_events(open_stream: Callable[[], Any]) -> AsyncIterator[Any]:
+    """
+    Iterates an assistant run stream (`open_stream()` returns the SDK's async stream
+    manager) under the first-event, idle and total deadlines. The stream is retried
+    only if it failed before the first event, i.e. before the run was created.
+    """
+    _stats["calls"] += 1
+    budget.deposit()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    attempt = 0
+    while True:
+        breaker.before_call()
+        received = False
+        try:
+            async with open_stream() as stream:
+                events = stream.__aiter__()
+                while True:
+                    timeout = DEADLINE_STREAM_IDLE if received else DEADLINE_FIRST_EVENT
+                    timeout = min(timeout, DEADLINE_RUN - (loop.time() - started))
+                    if timeout <= 0:
+                        raise asyncio.TimeoutError()
+                    try:
+                        event = await asyncio.wait_for(events.__anext__(), timeout)
+                    except StopAsyncIteration:
+                        break
+                    received = True
+                    yield event
+        except (asyncio.CancelledError, GeneratorExit):
+            breaker.release_probe()
+            raise
+        except Exception as e:
+            if not _is_upstream_failure(e):
+                breaker.record_success()
+                raise
+            _stats["failures"] += 1
+            _stats["timeouts"] += isinstance(e, asyncio.TimeoutError)
+            breaker.record_failure()
+            if received or attempt >= OPENAI_RETRIES or not _is_retryable(e, idempotent=False):
+                raise _final_error(e) from e
+            if not budget.withdraw():
+                _stats["budget_exhausted"] += 1
+                raise _final_error(e) from e
+            attempt += 1
+            _stats["retries"] += 1
+            await _backoff(attempt)
+        else:
+            breaker.record_success()
+            return
+
+
+def upstream_metrics() -> Dict[str, Any]:
+    return {
+        "breaker": breaker.state,
+        "consecutive_failures": breaker.failures,
+        "retry_budget": round(budget.tokens, 2),
+        **_stats,
+    }
+
+
+register_metrics("upstream", upstream_metrics)
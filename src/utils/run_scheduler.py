@@ -0,0 +1,113 @@
+"""
+Scheduler for assistant runs.
+
+OpenAI allows one active run per thread, so everything that touches a thread
+(new message + run, or a locally answered exchange) takes the thread's lock
+and goes in arrival order. On top of that at most RUN_CONCURRENCY runs stream
+at once per process; waiting users get free slots round-robin, so a user with
+many queued messages doesn't delay everyone else.
+"""
+import asyncio
+import os
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict
+
+from src.utils.metrics import register_metrics
+
+RUN_CONCURRENCY = int(os.getenv("RUN_CONCURRENCY", "8"))
+
+
+class RunScheduler:
+    def __init__(self, limit: int = RUN_CONCURRENCY):
+        self.limit = limit
+        self.running = 0
+        self._thread_locks: Dict[str, asyncio.Lock] = {}
+        self._thread_refs: Dict[str, int] = {}
+        # user_id -> ожидающие слота; порядок ключей — очередь round-robin
+        self._waiting: "OrderedDict[Any, Deque[asyncio.Future]]" = OrderedDict()
+        self._depth: Dict[Any, int] = {}
+
+    @asynccontextmanager
+    async def thread(self, thread_id: str, user_id: Any) -> AsyncIterator[None]:
+        """Exclusive access to the thread; waiters are served in arrival order."""
+        lock = self._thread_locks.setdefault(thread_id, asyncio.Lock())
+        self._thread_refs[thread_id] = self._thread_refs.get(thread_id, 0) + 1
+        self._depth[user_id] = self._depth.get(user_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._depth[user_id] -= 1
+            if not self._depth[user_id]:
+                del self._depth[user_id]
+            self._thread_refs[thread_id] -= 1
+            if not self._thread_refs[thread_id]:
+                del self._thread_refs[thread_id]
+                del self._thread_locks[thread_id]
+
+    @asynccontextmanager
+    async def run_slot(self, user_id: Any) -> AsyncIterator[None]:
+        """One of the RUN_CONCURRENCY global run slots."""
+        await self._acquire(user_id)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def run(self, thread_id: str, user_id: Any) -> AsyncIterator[None]:
+        """Thread lock plus a global slot: everything a message + run needs."""
+        async with self.thread(thread_id, user_id):
+            async with self.run_slot(user_id):
+                yield
+
+    async def _acquire(self, user_id: Any) -> None:
+        if self.running < self.limit and not self._waiting:
+            self.running += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(user_id, deque()).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже выдали, но клиент ушёл — отдаём следующему
+                self._release()
+            else:
+                queue = self._waiting.get(user_id)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._waiting[user_id]
+            raise
+
+    def _release(self) -> None:
+        self.running -= 1
+        while self._waiting and self.running < self.limit:
+            user_id, queue = next(iter(self._waiting.items()))
+            waiter = queue.popleft()
+            # Пользователь уходит в конец очереди, если у него ещё есть ожидающие
+            del self._waiting[user_id]
+            if queue:
+                self._waiting[user_id] = queue
+            if not waiter.done():
+                self.running += 1
+                waiter.set_result(None)
+
+    def queue_depth(self, user_id: Any) -> int:
+        """Messages of the user waiting for or holding their thread."""
+        return self._depth.get(user_id, 0)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "running": self.running,
+            "waiting_for_slot": sum(len(q) for q in self._waiting.values()),
+            "queue_depth": {str(user_id): depth for user_id, depth in self._depth.items()},
+        }
+
+
+run_scheduler = RunScheduler()
+register_metrics("run_scheduler", run_scheduler.metrics)
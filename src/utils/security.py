@@ -32,6 +32,18 @@ def create_access_token(claims: Dict, expires_minutes: Optional[int] = None) ->
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
+def token_subject(headers: Dict[bytes, bytes]) -> Optional[str]:
+    """Username from the Bearer token of raw ASGI headers, without a DB lookup (for middlewares)."""
+    auth = headers.get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = auth.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return payload.get("sub")
+
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
     cred_exc = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
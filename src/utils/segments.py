@@ -0,0 +1,188 @@
+"""
+Customer segmentation over a columnar per-user profile table.
+
+The table holds one row per user of the transaction dataset with the numbers
+/analytics computes for a single user (salary, spend, spent_ratio, free cash,
+financial type, category shares, transaction counts) over the 3 months up to
+the anchor date. It is built once per anchor with a single groupby over the
+dataset and kept as numpy columns, so a segment query is a few vectorised
+comparisons, an argsort and a slice — milliseconds instead of one /analytics
+call per user.
+
+Category shares are addressed as `share.<категория>`, e.g. `share.Такси`.
+"""
+import operator
+import os
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+from fastapi import HTTPException
+
+from src.utils.analytics import financial_type
+from src.utils.transactions import CATEGORIES, load_transactions
+
+# Сколько таблиц (по разным датам отсчёта) держим в памяти
+SEGMENT_TABLE_CACHE = int(os.getenv("SEGMENT_TABLE_CACHE", "8"))
+PERIOD_DAYS = 90
+
+SHARE_PREFIX = "share."
+NUMERIC_FIELDS = [
+    "user_id", "salary", "spent_3m", "spent_monthly", "spent_ratio",
+    "free_cash_m", "balance_left", "tx_count", "avg_ticket",
+] + [SHARE_PREFIX + c for c in CATEGORIES]
+TEXT_FIELDS = ["financial_type"]
+
+_OPS = {
+    "eq": operator.eq, "ne": operator.ne,
+    "gt": operator.gt, "gte": operator.ge,
+    "lt": operator.lt, "lte": operator.le,
+}
+_TEXT_OPS = {"eq", "ne", "in", "not_in"}
+
+_tables: "OrderedDict[str, ProfileTable]" = OrderedDict()
+
+
+class ProfileTable:
+    """Per-user profiles as numpy columns, all of the same length."""
+
+    def __init__(self, as_of: datetime):
+        import numpy as np
+
+        df = load_transactions()
+        start = as_of - timedelta(days=PERIOD_DAYS)
+        day = df["date"].dt.normalize()
+        period = df[(day >= start) & (day <= as_of)]
+
+        by_user = period.groupby("id", observed=True)
+        agg = by_user.agg(
+            salary=("salary", "first"),
+            spent_3m=("amount", "sum"),
+            tx_count=("amount", "size"),
+            avg_ticket=("amount", "mean"),
+            balance_left=("balance_left", "first"),
+        )
+        by_category = (
+            period.groupby(["id", "category"], observed=True)["amount"].sum()
+            .unstack(fill_value=0)
+            .reindex(index=agg.index, columns=CATEGORIES, fill_value=0)
+        )
+
+        salary_3m = agg["salary"].to_numpy(dtype=float) * 3
+        spent_3m = agg["spent_3m"].to_numpy(dtype=float)
+        spent_ratio = np.divide(spent_3m, salary_3m, out=np.zeros_like(spent_3m), where=salary_3m > 0)
+        total = np.maximum(spent_3m, 1)
+
+        self.as_of = as_of
+        self.start = start
+        self.columns: Dict[str, Any] = {
+            "user_id": agg.index.to_numpy(dtype=np.int64),
+            "salary": agg["salary"].to_numpy(dtype=np.int64),
+            "spent_3m": spent_3m.astype(np.int64),
+            "spent_monthly": spent_3m / 3,
+            "spent_ratio": spent_ratio,
+            "free_cash_m": np.maximum(0.0, (salary_3m - spent_3m) / 3),
+            "balance_left": agg["balance_left"].to_numpy(dtype=np.int64),
+            "tx_count": agg["tx_count"].to_numpy(dtype=np.int64),
+            "avg_ticket": agg["avg_ticket"].to_numpy(dtype=float),
+            # Пороги типа — те же, что у /analytics
+            "financial_type": np.array([financial_type(r) for r in spent_ratio], dtype=object),
+        }
+        for category in CATEGORIES:
+            self.columns[SHARE_PREFIX + category] = by_category[category].to_numpy(dtype=float) / total
+
+    def __len__(self) -> int:
+        return len(self.columns["user_id"])
+
+
+def get_profile_table(end_date: Optional[str] = None) -> ProfileTable:
+    """Profile table anchored at end_date; by default at the last day of the dataset."""
+    if end_date:
+        try:
+            as_of = datetime.strptime(end_date, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Некорректный формат end_date. Используй YYYY-MM-DD")
+    else:
+        as_of = load_transactions()["date"].max().to_pydatetime()
+    key = as_of.strftime("%Y-%m-%d")
+
+    table = _tables.get(key)
+    if table is None:
+        table = ProfileTable(as_of)
+        _tables[key] = table
+        while len(_tables) > SEGMENT_TABLE_CACHE:
+            _tables.popitem(last=False)
+    _tables.move_to_end(key)
+    return table
+
+
+def _condition(table: ProfileTable, field: str, op: str, value: Any):
+    import numpy as np
+
+    if field not in table.columns:
+        raise HTTPException(status_code=400, detail=f"Неизвестное поле сегмента: {field}")
+    if field in TEXT_FIELDS and op not in _TEXT_OPS:
+        raise HTTPException(status_code=400, detail=f"Операция {op} не применима к полю {field}")
+
+    column = table.columns[field]
+    try:
+        if op in ("in", "not_in"):
+            mask = np.isin(column, list(value))
+            return ~mask if op == "not_in" else mask
+        if op == "between":
+            low, high = value
+            return (column >= low) & (column <= high)
+        return _OPS[op](column, value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Некорректное значение для {field} {op}: {value!r}")
+
+
+def query_segment(query: Dict[str, Any], user_ids: Optional[Sequence[int]] = None) -> Dict[str, Any]:
+    """
+    Runs a segment query (see src.schemas.segments.SegmentQuery, as a dict);
+    `user_ids` limits the population (e.g. to one type_id).
+    """
+    import numpy as np
+
+    table = get_profile_table(query.get("end_date"))
+
+    mask = np.ones(len(table), dtype=bool)
+    if user_ids is not None:
+        mask &= np.isin(table.columns["user_id"], np.asarray(user_ids, dtype=np.int64))
+    population = int(mask.sum())
+    for f in query.get("filters") or []:
+        mask &= _condition(table, f["field"], f["op"], f["value"])
+    matched = np.flatnonzero(mask)
+
+    sort_by = query.get("sort_by")
+    if sort_by:
+        if sort_by not in NUMERIC_FIELDS:
+            raise HTTPException(status_code=400, detail=f"Сортировать можно только по числовым полям: {sort_by}")
+        keys = table.columns[sort_by][matched]
+        matched = matched[np.argsort(-keys if query.get("descending") else keys, kind="stable")]
+
+    offset, limit = query.get("offset", 0), query.get("limit", 100)
+    page = matched[offset:offset + limit]
+
+    types, counts = np.unique(table.columns["financial_type"][matched], return_counts=True)
+    result: Dict[str, Any] = {
+        "period": {"start_date": table.start.strftime("%Y-%m-%d"), "end_date": table.as_of.strftime("%Y-%m-%d")},
+        "population": population,
+        "total": int(matched.size),
+        "by_financial_type": {str(t): int(c) for t, c in zip(types, counts)},
+        "offset": offset,
+        "limit": limit,
+        "ids": table.columns["user_id"][page].tolist(),
+    }
+
+    fields: List[str] = query.get("fields") or []
+    unknown = [f for f in fields if f not in table.columns]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные поля сегмента: {', '.join(unknown)}")
+    if fields:
+        values = {f: table.columns[f][page].tolist() for f in fields}
+        result["rows"] = [
+            {"user_id": uid, **{f: values[f][i] for f in fields}}
+            for i, uid in enumerate(result["ids"])
+        ]
+    return result
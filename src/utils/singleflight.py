@@ -0,0 +1,65 @@
+"""
+Single-flight: concurrent calls with the same key share one execution.
+
+The first caller starts the work as a task; everyone who asks for the same
+key while it runs awaits that task instead of repeating the work. The task
+is shielded, so a caller that goes away (closed websocket, cancelled
+request) doesn't cancel it for the others. Per process.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from src.utils.metrics import register_metrics
+
+_groups: Dict[str, "SingleFlight"] = {}
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.executions = 0
+        self.shared = 0
+        _groups[name] = self
+
+    def start(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args: Any) -> asyncio.Task:
+        """Task running `fn(*args)` for `key`: the one in flight, or a new one."""
+        task = self._calls.get(key)
+        if task is not None:
+            self.shared += 1
+            return task
+
+        task = asyncio.ensure_future(fn(*args))
+        self.executions += 1
+        self._calls[key] = task
+        task.add_done_callback(lambda t: self._forget(key, t))
+        return task
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Ошибку получат ожидающие; если их не было — не даём ей потеряться в логе
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def wait(self, key: Hashable) -> None:
+        """Waits for the call in flight for `key` (if any) to finish; its result or error is ignored."""
+        task = self._calls.get(key)
+        if task is not None:
+            await asyncio.wait({task})
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args: Any) -> Any:
+        return await asyncio.shield(self.start(key, fn, *args))
+
+
+def singleflight_metrics() -> Dict[str, Any]:
+    return {
+        name: {"executions": g.executions, "shared": g.shared, "in_flight": len(g._calls)}
+        for name, g in _groups.items()
+    }
+
+
+register_metrics("singleflight", singleflight_metrics)
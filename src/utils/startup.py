@@ -0,0 +1,146 @@
+"""
+Warm-up of the heavy parts of the app, behind readiness state.
+
+Importing the app loads neither pandas nor the OpenAI SDK and makes no network
+calls, so a fresh worker accepts connections right away (GET /health). The
+lifespan hook then warms the components in the background: the transaction
+dataset with the analytics modules, the peer sketches, the anomaly store, the
+forecast table, the product index, the analytics pool and the assistant
+bootstrap. GET /ready answers 503 until all of them are ready, so the
+balancer only routes to warm workers. Anything requested before that is
+loaded on first use, just slower.
+
+server.py runs the shareable components in the parent before forking
+(preload_components), so the workers' warm-up finds them already done.
+"""
+import asyncio
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from src.utils.metrics import register_metrics
+
+# Пауза перед повтором упавшего компонента (например, OpenAI недоступен при старте)
+WARMUP_RETRY_DELAY = float(os.getenv("WARMUP_RETRY_DELAY", "5"))
+WARMUP_RETRY_DELAY_MAX = 60.0
+
+_started_at = time.monotonic()
+_ready_after: Optional[float] = None
+_components: Dict[str, Dict[str, Any]] = {}
+
+
+def _load_dataset() -> None:
+    from src.utils import analytics, analytics_SME  # noqa: F401
+    from src.utils.transactions import load_transactions
+
+    load_transactions()
+
+
+def _build_peer_index() -> None:
+    from src.utils.peers import get_peer_index
+
+    get_peer_index()
+
+
+def _build_anomaly_store() -> None:
+    from src.utils.anomalies import get_anomaly_store
+
+    get_anomaly_store()
+
+
+def _build_forecast() -> None:
+    from src.utils.forecast import get_forecast_table
+    from src.utils.transactions import load_transactions
+
+    get_forecast_table(load_transactions()["date"].max().date())
+
+
+def _load_product_index() -> None:
+    from src.utils.product_index import get_product_index
+
+    get_product_index()
+
+
+def _start_analytics_pool() -> None:
+    from src.utils.analytics_pool import start_analytics_pool
+
+    start_analytics_pool()
+
+
+def _bootstrap_assistant() -> None:
+    from src.utils.openai_client import bootstrap_assistant
+
+    bootstrap_assistant()
+
+
+# Группы выполняются параллельно, компоненты внутри группы — по порядку (пулу нужен датасет)
+COMPONENT_GROUPS: List[List[Tuple[str, Callable[[], None]]]] = [
+    [("dataset", _load_dataset), ("peers", _build_peer_index),
+     ("anomalies", _build_anomaly_store), ("forecast", _build_forecast), ("analytics_pool", _start_analytics_pool)],
+    [("product_index", _load_product_index)],
+    [("assistant", _bootstrap_assistant)],
+]
+# Пул процессов у каждого воркера свой, остальное можно прогреть до fork
+SHAREABLE = ("dataset", "peers", "anomalies", "forecast", "product_index", "assistant")
+
+
+def preload_components() -> None:
+    """Warms the shareable components synchronously (server.py, before forking)."""
+    for group in COMPONENT_GROUPS:
+        for name, fn in group:
+            if name in SHAREABLE:
+                _run(name, fn)
+
+
+def _run(name: str, fn: Callable[[], None]) -> None:
+    started = time.monotonic()
+    fn()
+    _components[name] = {"ready": True, "seconds": round(time.monotonic() - started, 3)}
+
+
+async def _warm(name: str, fn: Callable[[], None]) -> None:
+    if _components.get(name, {}).get("ready"):
+        return
+    delay = WARMUP_RETRY_DELAY
+    while True:
+        try:
+            await asyncio.to_thread(_run, name, fn)
+            return
+        except Exception as e:
+            _components[name] = {"ready": False, "error": repr(e)}
+            print(f"⚠️ Warm-up of {name} failed, retrying in {delay:.0f}s: {e!r}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARMUP_RETRY_DELAY_MAX)
+
+
+async def warm_up() -> None:
+    global _ready_after
+    for group in COMPONENT_GROUPS:
+        for name, _ in group:
+            _components.setdefault(name, {"ready": False})
+
+    async def warm_group(group):
+        for name, fn in group:
+            await _warm(name, fn)
+
+    await asyncio.gather(*(warm_group(group) for group in COMPONENT_GROUPS))
+    _ready_after = round(time.monotonic() - _started_at, 3)
+
+
+def start_warm_up() -> asyncio.Task:
+    return asyncio.ensure_future(warm_up())
+
+
+def is_ready() -> bool:
+    return _ready_after is not None
+
+
+def readiness() -> Dict[str, Any]:
+    return {"ready": is_ready(), "components": _components}
+
+
+def startup_metrics() -> Dict[str, Any]:
+    return {"ready_after_seconds": _ready_after, "components": _components}
+
+
+register_metrics("startup", startup_metrics)
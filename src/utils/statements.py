@@ -0,0 +1,405 @@
+"""
+Statement export: a user's transactions for a date range as CSV or XLSX.
+
+The file is produced as a stream of byte chunks, EXPORT_CHUNK_ROWS rows at a
+time, so memory stays bounded whatever the length of the history. Rows come
+from a per-dataset index that orders row positions by (user, date): a user's
+date range is a contiguous slice found by binary search, nothing is filtered
+or sorted per request. Per-category subtotals are accumulated in the same pass
+and appended at the end (a section of the CSV, a second sheet of the XLSX).
+
+XLSX is a zip of SpreadsheetML parts written through zipfile in streaming
+mode (inline strings, no shared-strings table), so no Excel library is
+needed. Its size is known only after deflating it, so it is sent chunked,
+without Content-Length or byte ranges.
+
+The CSV length is computed from the slice without formatting it: the width of
+every field comes from the column (the label lengths of a categorical, the
+digit counts of an integer column), and the subtotal section is small. That
+gives Content-Length and single byte ranges (206); a range starts generating
+at the block of rows that contains its first byte, not at the top of the file.
+"""
+import csv
+import io
+import os
+import re
+import zipfile
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from fastapi import HTTPException
+
+from src.utils.transactions import load_transactions
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000"))
+
+# (колонка датасета, заголовок в выписке)
+COLUMNS = [("date", "Дата"), ("category", "Категория"), ("amount", "Сумма"), ("currency", "Валюта"), ("status", "Статус")]
+SUBTOTAL_HEADER = ["Категория", "Операций", "Сумма"]
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+_CSV_EOL = "\r\n"
+# Фиксированное время в zip-заголовках — одинаковые байты при каждой генерации
+_ZIP_TIME = (2025, 1, 1, 0, 0, 0)
+
+_index: Optional[Tuple[int, "StatementIndex"]] = None
+
+
+class StatementIndex:
+    """Row positions of the dataset ordered by (user id, date), rows without a date dropped."""
+
+    def __init__(self, df):
+        import numpy as np
+
+        days = df["date"].to_numpy(dtype="datetime64[ns]")
+        ids = df["id"].to_numpy()
+        valid = np.flatnonzero(~np.isnat(days))
+        self.order = valid[np.lexsort((days[valid], ids[valid]))]
+        self.ids = ids[self.order]
+        self.days = days[self.order]
+
+    def span(self, user_id: int, start: Optional[datetime], end: Optional[datetime]) -> Optional[Tuple[int, int]]:
+        """[lo, hi) into `order` for the user's rows with start <= date <= end; None if there's no such user."""
+        import numpy as np
+
+        lo = int(np.searchsorted(self.ids, user_id, side="left"))
+        hi = int(np.searchsorted(self.ids, user_id, side="right"))
+        if lo == hi:
+            return None
+        days = self.days[lo:hi]
+        first = lo + (int(np.searchsorted(days, np.datetime64(start), side="left")) if start else 0)
+        last = lo + (int(np.searchsorted(days, np.datetime64(end + timedelta(days=1)), side="left")) if end else hi - lo)
+        return first, max(first, last)
+
+
+def get_statement_index() -> StatementIndex:
+    global _index
+    df = load_transactions()
+    # Подменили датасет (install_transactions) — перестраиваем
+    if _index is None or _index[0] != id(df):
+        _index = (id(df), StatementIndex(df))
+    return _index[1]
+
+
+def _parse_date(value: Optional[str], name: str) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Некорректный формат {name}. Используй YYYY-MM-DD")
+
+
+class Statement:
+    """One export; chunks() can be iterated any number of times and yields the same bytes."""
+
+    def __init__(self, user_id: int, fmt: str, start_date: Optional[str] = None, end_date: Optional[str] = None):
+        if fmt not in MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail=f"Формат выписки: {', '.join(MEDIA_TYPES)}")
+        start, end = _parse_date(start_date, "start_date"), _parse_date(end_date, "end_date")
+        span = get_statement_index().span(user_id, start, end)
+        if span is None:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        if span[0] == span[1]:
+            raise HTTPException(status_code=404, detail="Нет транзакций за указанный период")
+
+        self.user_id = user_id
+        self.fmt = fmt
+        self.span = span
+        self.media_type = MEDIA_TYPES[fmt]
+        self.filename = f"statement_{user_id}_{start_date or 'start'}_{end_date or 'end'}.{fmt}"
+        self._layout: Optional[Tuple[bytes, List[int], bytes]] = None
+
+    def _blocks(self, skip: int = 0) -> Iterator[Tuple[List[List[Any]], Dict[str, List[int]]]]:
+        """
+        Rows of the range in blocks of EXPORT_CHUNK_ROWS (starting after `skip` blocks),
+        with the running per-category [count, sum].
+        """
+        import numpy as np
+
+        df = load_transactions()
+        index = get_statement_index()
+        # Колонки берём как numpy-представления без копий и выбираем по позициям блока
+        takers = [_taker(df[c]) for c, _ in COLUMNS[1:]]
+        subtotals: Dict[str, List[int]] = {}
+        lo, hi = self.span
+        for i in range(lo + skip * EXPORT_CHUNK_ROWS, hi, EXPORT_CHUNK_ROWS):
+            j = min(i + EXPORT_CHUNK_ROWS, hi)
+            positions = index.order[i:j]
+            dates = np.datetime_as_string(index.days[i:j], unit="D").tolist()
+            rows = [list(row) for row in zip(dates, *(take(positions) for take in takers))]
+            for _, category, amount, *_ in rows:
+                total = subtotals.setdefault(category, [0, 0])
+                total[0] += 1
+                total[1] += amount
+            yield rows, subtotals
+
+    @staticmethod
+    def _subtotal_rows(subtotals: Dict[str, List[int]]) -> List[List[Any]]:
+        rows = [[c, n, s] for c, (n, s) in sorted(subtotals.items(), key=lambda kv: -kv[1][1])]
+        rows.append(["Итого", sum(n for n, _ in subtotals.values()), sum(s for _, s in subtotals.values())])
+        return rows
+
+    def chunks(self) -> Iterator[bytes]:
+        return self._csv() if self.fmt == "csv" else self._xlsx()
+
+    def _csv(self) -> Iterator[bytes]:
+        head = _csv_head()
+        subtotals: Dict[str, List[int]] = {}
+        for rows, subtotals in self._blocks():
+            yield head + _csv_bytes(rows)
+            head = b""
+        yield head + self._csv_tail(subtotals)
+
+    def _csv_tail(self, subtotals: Dict[str, List[int]]) -> bytes:
+        return _csv_bytes([[], SUBTOTAL_HEADER, *self._subtotal_rows(subtotals)])
+
+    def csv_layout(self) -> Optional[Tuple[bytes, List[int], bytes]]:
+        """
+        (head, byte length of every block of rows, subtotal section) of the CSV, from the
+        field widths of the slice, without formatting the rows; None if a column has a
+        type whose width we can't compute.
+        """
+        import numpy as np
+        import pandas as pd
+
+        if self._layout is not None:
+            return self._layout
+        df = load_transactions()
+        widths = [_width(df[c]) for c, _ in COLUMNS[1:]]
+        if any(width is None for width in widths):
+            return None
+
+        lo, hi = self.span
+        positions = get_statement_index().order[lo:hi]
+        # Дата — всегда YYYY-MM-DD, поля через запятую, строка кончается \r\n
+        row = len("YYYY-MM-DD") + len(COLUMNS) - 1 + len(_CSV_EOL) + sum(width(positions) for width in widths)
+        blocks = np.add.reduceat(row, np.arange(0, len(row), EXPORT_CHUNK_ROWS)).tolist()
+
+        categories = pd.Series(_taker(df["category"])(positions))
+        totals = pd.Series(df["amount"].to_numpy()[positions]).groupby(categories, sort=False).agg(["size", "sum"])
+        subtotals = {category: [int(n), int(total)] for category, (n, total) in totals.iterrows()}
+        self._layout = _csv_head(), blocks, self._csv_tail(subtotals)
+        return self._layout
+
+    def csv_size(self) -> Optional[int]:
+        """Length of the CSV in bytes (see csv_layout()); None if it can't be computed."""
+        layout = self.csv_layout()
+        if layout is None:
+            return None
+        head, blocks, tail = layout
+        return len(head) + sum(blocks) + len(tail)
+
+    def _csv_from(self, first: int) -> Tuple[int, Iterator[bytes]]:
+        """Offset and chunks of the CSV from the block of rows that contains byte `first`."""
+        head, blocks, tail = self.csv_layout()
+        if first < len(head):
+            return 0, self._csv()
+        offset, skip = len(head), 0
+        for size in blocks:
+            if offset + size > first:
+                break
+            offset += size
+            skip += 1
+
+        def chunks() -> Iterator[bytes]:
+            for rows, _ in self._blocks(skip):
+                yield _csv_bytes(rows)
+            yield tail
+        return offset, chunks()
+
+    def _xlsx(self) -> Iterator[bytes]:
+        sink = _Sink()
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zf:
+            for name, data in _XLSX_PARTS.items():
+                zf.writestr(_zip_info(name), data)
+            yield sink.drain()
+
+            subtotals: Dict[str, List[int]] = {}
+            with zf.open(_zip_info("xl/worksheets/sheet1.xml"), "w") as sheet:
+                sheet.write(_SHEET_HEAD + _xlsx_row([title for _, title in COLUMNS]))
+                for rows, subtotals in self._blocks():
+                    sheet.write(b"".join(_xlsx_row(row) for row in rows))
+                    yield sink.drain()
+                sheet.write(_SHEET_TAIL)
+
+            rows = [SUBTOTAL_HEADER, *self._subtotal_rows(subtotals)]
+            zf.writestr(_zip_info("xl/worksheets/sheet2.xml"),
+                        _SHEET_HEAD + b"".join(_xlsx_row(row) for row in rows) + _SHEET_TAIL)
+        yield sink.drain()
+
+    def byte_range(self, first: int, last: int) -> Iterator[bytes]:
+        """Bytes first..last (inclusive) of the CSV: generated from the block containing `first`."""
+        position, chunks = self._csv_from(first)
+        for chunk in chunks:
+            end = position + len(chunk)
+            if end > first:
+                yield chunk[max(0, first - position):last + 1 - position]
+            if end > last:
+                return
+            position = end
+
+
+async def statement_response(user_id: int, fmt: str, start_date: Optional[str], end_date: Optional[str],
+                             range_header: Optional[str] = None):
+    """Streaming response with the statement: the whole file (200) or one byte range of it (206)."""
+    import asyncio
+
+    from fastapi.responses import StreamingResponse
+
+    statement = await asyncio.to_thread(Statement, user_id, fmt, start_date, end_date)
+    headers = {"Content-Disposition": f'attachment; filename="{statement.filename}"'}
+    size = await asyncio.to_thread(statement.csv_size) if fmt == "csv" else None
+    if size is None:
+        # Размер XLSX известен только после сжатия — отдаём chunked, без Content-Length и Range
+        return StreamingResponse(statement.chunks(), media_type=statement.media_type, headers=headers)
+
+    headers["Accept-Ranges"] = "bytes"
+    span = parse_range(range_header, size)
+    if span is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(statement.chunks(), media_type=statement.media_type, headers=headers)
+    first, last = span
+    headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+    headers["Content-Length"] = str(last - first + 1)
+    return StreamingResponse(statement.byte_range(first, last), status_code=206,
+                             media_type=statement.media_type, headers=headers)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Single `bytes=` range of the Range header as (first, last); None to send the whole
+    file (no header, several ranges or a unit we don't know). Raises 416 if unsatisfiable.
+    """
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", header or "")
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        first, last = max(0, size - int(last)), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise HTTPException(status_code=416, detail="Range Not Satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return first, last
+
+
+def _csv_bytes(rows: List[List[Any]]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator=_CSV_EOL).writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+def _csv_head() -> bytes:
+    # BOM — чтобы Excel открыл кириллицу без мастера импорта
+    return "\ufeff".encode("utf-8") + _csv_bytes([[title for _, title in COLUMNS]])
+
+
+def _width(series) -> Optional[Callable[[Any], Any]]:
+    """Byte widths of a column's CSV fields at given row positions; None for types other than categorical / integer."""
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        # Ширина метки — как её запишет csv (с кавычками, если нужны); код -1 берёт последнюю, как _taker
+        lengths = np.array([len(_csv_bytes([[label]])) - len(_CSV_EOL) for label in series.cat.categories] or [0])
+        return lambda positions: lengths[codes[positions]]
+    if pd.api.types.is_integer_dtype(series.dtype):
+        values = series.to_numpy()
+        return lambda positions: np.char.str_len(values[positions].astype(str))
+    return None
+
+
+def _taker(series) -> Callable[[Any], List[Any]]:
+    """Values of a column at given row positions, as Python objects."""
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        labels = np.asarray(series.cat.categories, dtype=object)
+        return lambda positions: labels[codes[positions]].tolist()
+    values = series.to_numpy()
+    return lambda positions: values[positions].tolist()
+
+
+class _Sink:
+    """Write-only, non-seekable file for zipfile: collects output until drained."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+def _zip_info(name: str) -> zipfile.ZipInfo:
+    info = zipfile.ZipInfo(name, date_time=_ZIP_TIME)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+def _xlsx_cell(value: Any) -> str:
+    if isinstance(value, (int, float)):
+        return f"<c><v>{value}</v></c>"
+    return f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def _xlsx_row(values: List[Any]) -> bytes:
+    return ("<row>" + "".join(_xlsx_cell(v) for v in values) + "</row>").encode("utf-8")
+
+
+_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_SHEET_HEAD = f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><worksheet xmlns="{_MAIN_NS}"><sheetData>'.encode()
+_SHEET_TAIL = b"</sheetData></worksheet>"
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet2.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'<Relationship Id="rId1" Type="{_REL_NS}/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        f'<workbook xmlns="{_MAIN_NS}" xmlns:r="{_REL_NS}"><sheets>'
+        '<sheet name="Выписка" sheetId="1" r:id="rId1"/>'
+        '<sheet name="Итоги" sheetId="2" r:id="rId2"/>'
+        '</sheets></workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        f'<Relationship Id="rId1" Type="{_REL_NS}/worksheet" Target="worksheets/sheet1.xml"/>'
+        f'<Relationship Id="rId2" Type="{_REL_NS}/worksheet" Target="worksheets/sheet2.xml"/>'
+        '</Relationships>'
+    ),
+}
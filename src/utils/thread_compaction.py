@@ -0,0 +1,190 @@
+"""
+Compaction of long-lived chat threads.
+
+Every user keeps one thread, so without compaction each run re-reads the
+whole conversation. After a run whose prompt exceeded THREAD_COMPACT_TOKENS
+the thread is rotated: older turns are summarised into one context message
+and a new thread is started from the seed messages (segment, profile), that
+summary and the last THREAD_KEEP_MESSAGES turns. The new thread's metadata
+points at the previous one, so /history can keep paging into older threads;
+messages written by compaction are marked and hidden from /history.
+"""
+import os
+import statistics
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from src.utils import resilience
+from src.utils.metrics import register_metrics
+from src.utils.openai_client import get_async_client
+
+THREAD_COMPACT_TOKENS = int(os.getenv("THREAD_COMPACT_TOKENS", "8000"))
+THREAD_KEEP_MESSAGES = int(os.getenv("THREAD_KEEP_MESSAGES", "6"))
+THREAD_SUMMARY_MODEL = os.getenv("THREAD_SUMMARY_MODEL", "gpt-4o-mini")
+# Больше этого в пересказ не отдаём: прошлое резюме целиком, из реплик — самые новые
+SUMMARY_INPUT_CHARS = 30000
+MAX_THREAD_MESSAGES = 500
+# Дальше по цепочке previous_thread_id не ходим
+MAX_THREAD_CHAIN = 100
+
+# metadata сообщений, созданных при сжатии: seed, summary или copy
+COMPACTION_KEY = "compaction"
+
+SUMMARY_PROMPT = (
+    "Ты сжимаешь переписку банковского ассистента с клиентом. Составь краткое резюме "
+    "(до 200 слов) на русском: цели клиента, обсуждённые продукты и условия, важные суммы и сроки, "
+    "договорённости и открытые вопросы. Только факты из переписки, без приветствий."
+)
+
+_prompt_tokens: Deque[int] = deque(maxlen=1000)
+_stats = {"runs": 0, "compactions": 0, "compaction_failures": 0}
+
+
+def record_run_usage(prompt_tokens: Optional[int]) -> None:
+    if prompt_tokens is None:
+        return
+    _stats["runs"] += 1
+    _prompt_tokens.append(prompt_tokens)
+
+
+def needs_compaction(prompt_tokens: Optional[int]) -> bool:
+    return prompt_tokens is not None and prompt_tokens > THREAD_COMPACT_TOKENS
+
+
+def is_compaction_message(message: Any) -> bool:
+    return bool((message.metadata or {}).get(COMPACTION_KEY))
+
+
+def message_text(message: Any) -> str:
+    return "".join(
+        block.text.value for block in message.content or []
+        if getattr(block, "type", None) == "text"
+    )
+
+
+async def _conversation(thread_id: str) -> List[Any]:
+    """The latest MAX_THREAD_MESSAGES messages of the thread, oldest first."""
+    messages, after = [], None
+    while len(messages) < MAX_THREAD_MESSAGES:
+        page = await resilience.call(
+            get_async_client().beta.threads.messages.list,
+            thread_id=thread_id, order="desc", limit=100, **({"after": after} if after else {}),
+        )
+        messages.extend(page.data)
+        if not page.has_more or not page.data:
+            break
+        after = page.data[-1].id
+    return messages[:MAX_THREAD_MESSAGES][::-1]
+
+
+async def is_previous_thread(thread_id: str, candidate: str) -> bool:
+    """Whether `candidate` is `thread_id` or one of the threads it was compacted from."""
+    for _ in range(MAX_THREAD_CHAIN):
+        if thread_id == candidate:
+            return True
+        thread = await resilience.call(get_async_client().beta.threads.retrieve, thread_id)
+        thread_id = (thread.metadata or {}).get("previous_thread_id")
+        if not thread_id:
+            return False
+    return False
+
+
+def _transcript(messages: List[Any]) -> str:
+    """
+    Summary input: the previous summary in full, then as many of the latest turns
+    as fit into SUMMARY_INPUT_CHARS — the oldest turns are the ones dropped.
+    """
+    summaries, lines = [], []
+    for m in messages:
+        if (m.metadata or {}).get(COMPACTION_KEY) == "summary":
+            summaries.append(message_text(m))
+        else:
+            speaker = "Клиент" if m.role == "user" else "Ассистент"
+            lines.append(f"{speaker}: {message_text(m)}")
+
+    budget = SUMMARY_INPUT_CHARS - sum(len(s) + 1 for s in summaries)
+    kept = []
+    for line in reversed(lines):
+        if len(line) + 1 > budget:
+            if not kept and budget > 0:
+                kept.append(line[-budget:])
+            break
+        kept.append(line)
+        budget -= len(line) + 1
+    return "\n".join(summaries + kept[::-1])
+
+
+async def _summarise(messages: List[Any]) -> str:
+    transcript = _transcript(messages)
+
+    completion = await resilience.call(
+        get_async_client().chat.completions.create,
+        model=THREAD_SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript},
+        ],
+        deadline=resilience.DEADLINE_RUN,
+    )
+    return completion.choices[0].message.content.strip()
+
+
+async def compact_thread(thread: Any, seed_messages: List[Dict[str, Any]],
+                         seed_metadata: Dict[str, str]) -> Optional[Any]:
+    """
+    Starts a compacted successor of `thread`; returns it, or None if there's nothing
+    to compact. `seed_messages` / `seed_metadata` are what a fresh thread of the user
+    starts with (see chat_threads.thread_seed).
+    """
+    conversation = []
+    for m in await _conversation(thread.id):
+        meta = (m.metadata or {}).get(COMPACTION_KEY)
+        text = message_text(m)
+        # Старые seed-сообщения ([RINAT] тип клиента, профиль) заменятся свежими
+        if meta == "seed" or (meta is None and m.role == "user" and text.startswith("[RINAT]")):
+            continue
+        conversation.append(m)
+
+    older, recent = conversation[:-THREAD_KEEP_MESSAGES], conversation[-THREAD_KEEP_MESSAGES:]
+    if not older:
+        return None
+
+    try:
+        summary = await _summarise(older)
+    except Exception:
+        _stats["compaction_failures"] += 1
+        raise
+
+    messages = [{**m, "metadata": {COMPACTION_KEY: "seed"}} for m in seed_messages]
+    messages.append({
+        "role": "user",
+        "content": f"[RINAT] Краткое содержание предыдущего разговора с клиентом:\n{summary}",
+        "metadata": {COMPACTION_KEY: "summary"},
+    })
+    messages.extend(
+        {"role": m.role, "content": message_text(m), "metadata": {COMPACTION_KEY: "copy"}}
+        for m in recent if message_text(m)
+    )
+
+    new_thread = await resilience.call(
+        get_async_client().beta.threads.create,
+        messages=messages,
+        metadata={**seed_metadata, "previous_thread_id": thread.id},
+        idempotent=False,
+    )
+    _stats["compactions"] += 1
+    return new_thread
+
+
+def compaction_metrics() -> Dict[str, Any]:
+    tokens = sorted(_prompt_tokens)
+    return {
+        **_stats,
+        "threshold_tokens": THREAD_COMPACT_TOKENS,
+        "prompt_tokens_last": _prompt_tokens[-1] if _prompt_tokens else None,
+        "prompt_tokens_p50": statistics.median(tokens) if tokens else None,
+        "prompt_tokens_p95": tokens[int(0.95 * (len(tokens) - 1))] if tokens else None,
+    }
+
+
+register_metrics("threads", compaction_metrics)
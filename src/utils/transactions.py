@@ -1,14 +1,55 @@
-import pandas as pd
+import os
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+CSV_PATH = os.path.join("src", "data", "transactions_kz_15k_final.csv")
+
+# Повторяющиеся строки храним как category: вместо 15k Python-строк — массив кодов,
+# который не трогается счётчиками ссылок и остаётся общим (copy-on-write) между воркерами.
+CATEGORICAL_COLUMNS = ["name", "status", "category", "currency"]
+
+# Фиксированный порядок категорий (как в датасете)
+CATEGORIES = [
+    "АЗС", "Доставка еды", "Играем дома", "Кофе и рестораны", "Кино",
+    "Отели", "Продукты питания", "Путешествия", "Развлечения",
+    "Отдых дома", "Такси"
+]
+
+_transactions_df = None
+
+
+def load_transactions() -> "pd.DataFrame":
+    """Читает датасет транзакций один раз на процесс; дальше отдаёт тот же DataFrame."""
+    global _transactions_df
+    if _transactions_df is None:
+        # pandas импортируем здесь, а не при импорте приложения (см. README, «Холодный старт»)
+        import pandas as pd
+
+        dtype = {"id": int, "amount": int, "salary": int}
+        dtype.update({col: "category" for col in CATEGORICAL_COLUMNS})
+        df = pd.read_csv(CSV_PATH, dtype=dtype, encoding="utf-8")
+        if "date" in df.columns:
+            df["date"] = pd.to_datetime(df["date"], errors="coerce")
+        _transactions_df = df
+    return _transactions_df
+
+
+def install_transactions(df: "pd.DataFrame") -> None:
+    """Подменяет датасет процесса (воркеры пула аналитики ставят сюда фрейм из shared memory)."""
+    global _transactions_df
+    _transactions_df = df
 
 
 def get_user_transactions(user_id: int):
-    CSV_PATH = r"src\data\transactions_kz_15k_final.csv"
-    df = pd.read_csv(CSV_PATH, dtype={"id": int, "amount": int, "salary": int}, encoding="utf-8")
+    df = load_transactions()
 
     user_data = df[df["id"] == user_id]
     if user_data.empty:
         return None
 
+    user_data = user_data.assign(date=user_data["date"].dt.strftime("%Y-%m-%d"))
     transactions = user_data.to_dict(orient="records")
 
     return transactions
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import tempfile
+from typing import IO
+
+from fastapi import HTTPException, UploadFile
+
+from src.utils import resilience
+from src.utils.openai_client import get_async_client
+
+# Whisper API принимает файлы до 25 МБ — больше нет смысла даже принимать
+VOICE_MAX_BYTES = int(os.getenv("VOICE_MAX_BYTES", str(25 * 1024 * 1024)))
+# До этого размера буфер живёт в памяти, дальше SpooledTemporaryFile уходит на диск
+VOICE_SPOOL_BYTES = int(os.getenv("VOICE_SPOOL_BYTES", str(1024 * 1024)))
+VOICE_CHUNK_BYTES = 64 * 1024
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "4"))
+
+_transcribe_slots = asyncio.Semaphore(TRANSCRIBE_CONCURRENCY)
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Аудиофайл больше {VOICE_MAX_BYTES // (1024 * 1024)} МБ",
+    )
+
+
+class AudioBuffer:
+    """Spooled buffer for audio arriving in chunks, with the VOICE_MAX_BYTES cap."""
+
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=VOICE_SPOOL_BYTES)
+        self.size = 0
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > VOICE_MAX_BYTES:
+            self.close()
+            raise _too_large()
+        self.file.write(chunk)
+
+    def rewind(self) -> IO[bytes]:
+        self.file.seek(0)
+        return self.file
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def check_audio_size(size: int) -> None:
+    if size > VOICE_MAX_BYTES:
+        raise _too_large()
+
+
+def guess_audio_suffix(data: bytes) -> str:
+    """Picks a file extension for Whisper from the audio container's magic bytes."""
+    if data[:4] == b"\x1aE\xdf\xa3":
+        return ".webm"
+    if data[:4] == b"OggS":
+        return ".ogg"
+    if data[:4] == b"RIFF":
+        return ".wav"
+    if data[:4] == b"fLaC":
+        return ".flac"
+    if data[4:8] == b"ftyp":
+        return ".m4a"
+    return ".mp3"
+
+
+async def spool_upload(file: UploadFile) -> IO[bytes]:
+    """
+    Returns a readable buffer with the upload, without copying it when possible.
+
+    Starlette already spools multipart files (in memory, then on disk), so when
+    the size is known the same buffer is handed on as is. Otherwise the upload
+    is streamed in chunks into an AudioBuffer, enforcing the size cap.
+    """
+    if file.size is not None:
+        check_audio_size(file.size)
+        await file.seek(0)
+        return file.file
+
+    buffer = AudioBuffer()
+    try:
+        while chunk := await file.read(VOICE_CHUNK_BYTES):
+            buffer.write(chunk)
+    except BaseException:
+        buffer.close()
+        raise
+    # Закрывает вызывающий (send_voice), после transcribe
+    return buffer.rewind()
+
+
+async def transcribe(audio: IO[bytes], filename: str) -> str:
+    """Transcribes audio without blocking the event loop; at most TRANSCRIBE_CONCURRENCY at once."""
+    async def translate():
+        # При повторе файл нужно отдать с начала
+        audio.seek(0)
+        return await get_async_client().audio.translations.create(
+            model="whisper-1",
+            file=(filename, audio),
+            prompt="Ответь мне на русском языке"
+        )
+
+    async with _transcribe_slots:
+        transcription = await resilience.call(translate, deadline=resilience.DEADLINE_TRANSCRIBE)
+    return transcription.text